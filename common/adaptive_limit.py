@@ -0,0 +1,145 @@
+"""
+An adaptive limit on the number of requests in flight (AIMD).
+
+A fixed `max_in_flight` is either too low, leaving the NIM container idle,
+or too high, so requests queue in the container and tail latency explodes;
+on a shared endpoint the right value changes with everyone else's load.
+`AIMDLimit` adjusts it from what the requests themselves observe:
+
+ - while the median latency of the last round of `limit` requests stays
+   below the lower edge of the target band, the limit grows additively, by
+   about one request per round,
+ - inside the band it holds,
+ - above the band (requests are queueing) or on a 429/503 it is cut
+   multiplicatively, at most once per round trip so that one burst of slow
+   responses does not collapse it.
+
+The band is given in seconds, or as multiples of the no-load latency: the
+lowest round median seen so far. It never rises, so latency grown from
+sustained queueing is not taken for the norm.
+
+Pass an `AIMDLimit` as `max_in_flight` to `map_concurrent`, with a client
+from `nim_models(retry_throttled=False)`: a client that retries throttled
+requests itself hides them from the limit.
+"""
+from collections import deque
+import threading
+import time
+
+THROTTLE_STATUSES = (429, 503)
+# points of a trajectory drawn on a card; the artifact keeps all of them
+MAX_TRAJECTORY_POINTS = 500
+
+
+def is_throttle(ex):
+    status = getattr(ex, "status", None) or getattr(ex, "status_code", None)
+    return status in THROTTLE_STATUSES
+
+
+class AIMDLimit(object):
+    def __init__(
+        self,
+        initial=4,
+        min_limit=1,
+        max_limit=64,
+        band=(1.25, 2.0),
+        target=None,
+        decrease=0.5,
+        window=200,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.band = band
+        self.target = target
+        self.decrease = decrease
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._recent = deque(maxlen=window)
+        self._baseline = None
+        self._hold_until = 0.0
+        self._lock = threading.Lock()
+        self._t0 = time.time()
+        self.throttles = 0
+        self.trajectory = [{"seconds": 0.0, "limit": self.value, "event": "start"}]
+
+    @property
+    def value(self):
+        return int(self._limit)
+
+    def band_seconds(self):
+        """The (low, high) latency band in seconds, or None before a full round."""
+        if self.target is not None:
+            return self.target
+        if self._baseline is None:
+            return None
+        return self._baseline * self.band[0], self._baseline * self.band[1]
+
+    def _set(self, limit, event):
+        before = self.value
+        self._limit = max(self.min_limit, min(self.max_limit, limit))
+        if self.value != before:
+            self.trajectory.append(
+                {"seconds": time.time() - self._t0, "limit": self.value, "event": event}
+            )
+
+    def _cut(self, event, now, latency=0.0):
+        if now < self._hold_until:
+            return
+        self._set(self._limit * self.decrease, event)
+        # requests sent before the cut are still draining; ignore them
+        self._hold_until = now + max(latency, 0.1)
+
+    def record(self, latency):
+        """Account for a request that completed in `latency` seconds."""
+        with self._lock:
+            self._recent.append(latency)
+            # single requests are noisy; judge the last round as a whole
+            n = max(8, self.value)
+            if len(self._recent) < n:
+                return
+            median = sorted(list(self._recent)[-n:])[n // 2]
+            if self._baseline is None or median < self._baseline:
+                self._baseline = median
+            low, high = self.band_seconds()
+            if median > high:
+                self._cut("queueing", time.time(), latency)
+            elif median <= low:
+                self._set(self._limit + 1.0 / self._limit, "increase")
+
+    def throttled(self):
+        """Account for a request rejected with a throttling status."""
+        with self._lock:
+            self.throttles += 1
+            self._cut("throttled", time.time())
+
+    def summary(self):
+        limits = [p["limit"] for p in self.trajectory]
+        return {
+            "final": self.value,
+            "min": min(limits),
+            "max": max(limits),
+            "changes": len(self.trajectory) - 1,
+            "throttles": self.throttles,
+        }
+
+
+def trajectory_spec(trajectory, title="Requests in flight", max_points=MAX_TRAJECTORY_POINTS):
+    """
+    Vega-Lite step chart of a limit's trajectory, drawn from a sample of at
+    most `max_points` of its changes that always ends with the latest.
+    """
+    from card_report import sample_rows
+
+    points = sample_rows(trajectory[:-1], max_points - 1) + trajectory[-1:]
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "width": 600,
+        "height": 160,
+        "title": title,
+        "data": {"values": points},
+        "mark": {"type": "line", "interpolate": "step-after", "point": True},
+        "encoding": {
+            "x": {"field": "seconds", "type": "quantitative", "title": "Seconds"},
+            "y": {"field": "limit", "type": "quantitative", "title": "Limit"},
+            "tooltip": [{"field": "event"}, {"field": "limit"}],
+        },
+    }
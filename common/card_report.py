@@ -0,0 +1,128 @@
+"""
+Card components whose size and rendering cost do not grow with the run.
+
+A card is rendered and uploaded every time it is refreshed, and a final card
+is stored with the run, so a card that holds one element per request gets
+slow to update and huge at production volumes. Flows report instead
+
+ - through a `Refresher`, which updates and refreshes a card at most once
+   per interval, however often results arrive,
+ - pre-aggregated summaries: the latency quantile tables and histograms of
+   `telemetry`, and counts,
+ - a sample of the trace, `bounded_rows`, capped in rows, characters per
+   cell and total bytes, with a caption saying what was left out; the full
+   trace stays in the task's artifacts. A foreach task keeps its own
+   sample as a small artifact, and the join combines them with
+   `merge_samples` without loading any task's full trace.
+"""
+from collections import deque
+import json
+import random
+import time
+
+MAX_TRACE_ROWS = 100
+MAX_CELL_CHARS = 200
+MAX_TABLE_BYTES = 256 << 10
+
+
+class Refresher(object):
+    """
+    Calls `render()`, which updates the card's components, and refreshes
+    `card`, at most once per `interval` seconds unless forced.
+    """
+
+    def __init__(self, card, interval=1.0, render=None):
+        self.card = card
+        self.interval = interval
+        self.render = render
+        self.refreshes = 0
+        self._last = None
+
+    def __call__(self, force=False):
+        now = time.monotonic()
+        if not force and self._last is not None and now - self._last < self.interval:
+            return False
+        if self.render is not None:
+            self.render()
+        self.card.refresh()
+        self.refreshes += 1
+        self._last = now
+        return True
+
+
+class Latest(object):
+    """The last `n` items appended, newest first."""
+
+    def __init__(self, n=50):
+        self.items = deque(maxlen=n)
+
+    def append(self, item):
+        self.items.append(item)
+
+    def __iter__(self):
+        return reversed(self.items)
+
+
+def truncate(value, max_chars=MAX_CELL_CHARS):
+    if not isinstance(value, (str, int, float, bool, type(None))):
+        value = json.dumps(value, default=str)
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[: max_chars - 3] + "..."
+    return value
+
+
+def sample_rows(rows, k, seed=0):
+    """`k` rows picked uniformly at random, kept in their original order."""
+    if len(rows) <= k:
+        return list(rows)
+    picked = sorted(random.Random(seed).sample(range(len(rows)), k))
+    return [rows[i] for i in picked]
+
+
+def bounded_rows(
+    rows,
+    max_rows=MAX_TRACE_ROWS,
+    max_cell_chars=MAX_CELL_CHARS,
+    max_bytes=MAX_TABLE_BYTES,
+    seed=0,
+):
+    """
+    A sample of `rows` (lists of cells) for a card Table, and a caption. At
+    most `max_rows` rows are kept, cells are truncated to `max_cell_chars`
+    and rows are dropped from the end until the JSON size is under
+    `max_bytes`.
+    """
+    sample = [
+        [truncate(cell, max_cell_chars) for cell in row]
+        for row in sample_rows(rows, max_rows, seed)
+    ]
+    size = 0
+    for n, row in enumerate(sample):
+        size += len(json.dumps(row, default=str))
+        if size > max_bytes:
+            sample = sample[:n]
+            break
+    if len(sample) == len(rows):
+        caption = f"All {len(rows)} rows"
+    else:
+        caption = f"A sample of {len(sample)} of {len(rows)} rows; the rest are in the artifacts"
+    return sample, caption
+
+
+def merge_samples(samples, counts, max_rows=MAX_TRACE_ROWS, seed=0):
+    """
+    Combine the `bounded_rows` samples of several tasks, taken from traces
+    of `counts` rows, into one sample of at most `max_rows` rows, with each
+    task represented in proportion to its trace, and a caption.
+    """
+    total = sum(counts)
+    rows = []
+    for sample, n in zip(samples, counts):
+        k = round(max_rows * n / total) if total > max_rows else len(sample)
+        rows.extend(sample_rows(sample, k, seed))
+    rows = rows[:max_rows]
+    if len(rows) == total:
+        caption = f"All {total} rows"
+    else:
+        caption = f"A sample of {len(rows)} of {total} rows; the rest are in the tasks' artifacts"
+    return rows, caption
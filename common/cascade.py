@@ -0,0 +1,170 @@
+"""
+Two-model cascades: a small model answers first, a large one only when needed.
+
+Most classification and extraction requests are easy, and the small model's
+answer is as good as the large one's at a fraction of the latency and GPU
+cost. A `Cascade` sends each request to the small model and escalates it to
+the large model only when `accept(response)` rejects the answer, e.g.
+because it is off-label, fails a schema, or its tokens have low probability.
+
+Each call returns the accepted response. `stats` holds sums that can be
+added up across foreach tasks with `merge_stats` and summarized with
+`cascade_report`.
+"""
+import math
+import threading
+import time
+
+# relative serving cost per token, roughly proportional to parameter count
+COST_PER_TOKEN = {
+    "meta/llama3-8b-instruct": 1.0,
+    "meta/llama3-70b-instruct": 70 / 8,
+}
+
+
+def confidence(response):
+    """
+    Per-token probability of the generated answer, the geometric mean of its
+    token probabilities, from a response requested with `logprobs=True`. For
+    a one-token label it is the label's probability; unlike the product it
+    does not fall with the length of an extraction. None when the response
+    carries no logprobs.
+    """
+    logprobs = (response["choices"][0].get("logprobs") or {}).get("content")
+    if not logprobs:
+        return None
+    return math.exp(sum(t["logprob"] for t in logprobs) / len(logprobs))
+
+
+def tokens(response):
+    usage = response.get("usage") or {}
+    return usage.get("total_tokens") or (
+        usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+    )
+
+
+class Cascade(object):
+    def __init__(self, models, small_model, large_model, accept, min_confidence=0.0):
+        self.small = models[small_model]
+        self.large = models[large_model]
+        self.small_model = small_model
+        self.large_model = large_model
+        self.accept = accept
+        self.min_confidence = min_confidence
+        self.stats = {
+            "requests": 0,
+            "escalated": 0,
+            "reasons": {},
+            "small_seconds": 0.0,
+            "large_seconds": 0.0,
+            "small_tokens": 0,
+            "large_tokens": 0,
+            "escalated_small_tokens": 0,
+        }
+        self._lock = threading.Lock()
+
+    def reason(self, response):
+        """Why `response` should be escalated, or None to accept it."""
+        reason = self.accept(response)
+        if reason is None and self.min_confidence > 0:
+            p = confidence(response)
+            if p is not None and p < self.min_confidence:
+                reason = "low confidence"
+        return reason
+
+    def __call__(self, **args):
+        if self.min_confidence > 0:
+            args.setdefault("logprobs", True)
+        t0 = time.time()
+        response = self.small(**dict(args, model=self.small_model))
+        small_seconds = time.time() - t0
+        reason = self.reason(response)
+        small_tokens = tokens(response)
+
+        large_seconds, large_tokens = 0.0, 0
+        if reason is not None:
+            t0 = time.time()
+            response = self.large(**dict(args, model=self.large_model))
+            large_seconds = time.time() - t0
+            large_tokens = tokens(response)
+
+        with self._lock:
+            s = self.stats
+            s["requests"] += 1
+            s["small_seconds"] += small_seconds
+            s["small_tokens"] += small_tokens
+            if reason is not None:
+                s["escalated"] += 1
+                s["reasons"][reason] = s["reasons"].get(reason, 0) + 1
+                s["large_seconds"] += large_seconds
+                s["large_tokens"] += large_tokens
+                s["escalated_small_tokens"] += small_tokens
+        return response
+
+
+def merge_stats(stats_list):
+    merged = {}
+    for stats in stats_list:
+        for k, v in stats.items():
+            if k == "reasons":
+                reasons = merged.setdefault("reasons", {})
+                for reason, n in v.items():
+                    reasons[reason] = reasons.get(reason, 0) + n
+            else:
+                merged[k] = merged.get(k, 0) + v
+    return merged
+
+
+def cascade_report(stats, small_model, large_model):
+    """
+    Escalation rate and the latency and cost saved against sending every
+    request to the large model. Large-model latency and token counts of the
+    requests that were not escalated are extrapolated from the escalated
+    ones, so the savings are estimates and need some escalations to exist.
+    """
+    n, escalated = stats.get("requests", 0), stats.get("escalated", 0)
+    report = {
+        "requests": n,
+        "escalated": escalated,
+        "escalation_rate": escalated / n if n else None,
+        "reasons": stats.get("reasons", {}),
+        "cascade_seconds": stats.get("small_seconds", 0.0) + stats.get("large_seconds", 0.0),
+        "large_only_seconds": None,
+        "seconds_saved": None,
+        "cost_saved": None,
+    }
+    if escalated:
+        # per request, the large model took this long and used this many
+        # tokens for every small-model token
+        large_latency = stats["large_seconds"] / escalated
+        token_ratio = stats["large_tokens"] / max(1, stats["escalated_small_tokens"])
+        report["large_only_seconds"] = large_latency * n
+        report["seconds_saved"] = report["large_only_seconds"] - report["cascade_seconds"]
+
+        small_rate = COST_PER_TOKEN.get(small_model, 1.0)
+        large_rate = COST_PER_TOKEN.get(large_model, 1.0)
+        cascade_cost = stats["small_tokens"] * small_rate + stats["large_tokens"] * large_rate
+        large_only_cost = stats["small_tokens"] * token_ratio * large_rate
+        if large_only_cost:
+            report["cost_saved"] = 1 - cascade_cost / large_only_cost
+    return report
+
+
+def format_report(report):
+    if not report["requests"]:
+        return "Cascade: no requests"
+    text = (
+        f"Cascade: {report['escalated']}/{report['requests']} requests escalated "
+        f"({report['escalation_rate']:.1%}"
+    )
+    if report["reasons"]:
+        text += "; " + ", ".join(f"{r}: {n}" for r, n in sorted(report["reasons"].items()))
+    text += ")"
+    if report["seconds_saved"] is not None:
+        text += (
+            f", {report['seconds_saved']:.1f}s of request time saved out of an estimated "
+            f"{report['large_only_seconds']:.1f}s on the large model alone"
+        )
+    if report["cost_saved"] is not None:
+        text += f", {report['cost_saved']:.0%} lower estimated token cost"
+    return text
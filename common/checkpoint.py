@@ -0,0 +1,149 @@
+"""
+Checkpoints of per-item results, so that a retried task resumes mid-batch.
+
+When a task decorated with `@retry` fails, Metaflow runs it again from the
+start. A `TaskCheckpoint` saves the results finished so far, every few items
+and every few seconds, to run storage (see run_storage.py) under the task's
+pathspec, which stays the same across attempts. The next attempt loads them
+and only sends the requests that had not completed.
+
+A save writes only the results finished since the previous one, as a new
+delta file, so its cost does not grow with the number of results. The file is
+written and uploaded by a background thread, never by the thread dispatching
+requests. A restore merges every delta file of the task; a file cut short by
+a killed attempt is skipped, and its results are simply sent again.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import pickle
+import time
+
+from request_pool import map_concurrent
+
+SAVE_INTERVAL = 30.0
+
+
+class CheckpointLog(object):
+    """
+    Results by item index, saved as delta files under `prefix` in `storage`,
+    a `RunStorage`. Files written by this log are named after `attempt`, so
+    they never replace the files of an earlier attempt.
+    """
+
+    def __init__(self, storage, prefix, attempt=0, every=10, interval=SAVE_INTERVAL):
+        self.storage = storage
+        self.prefix = prefix
+        self.attempt = attempt
+        self.every = max(1, int(every))
+        self.interval = interval
+        self.done = self.restore()
+        self._delta = {}
+        self._saves = 0
+        self._last_save = time.time()
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def restore(self):
+        done = {}
+        for key in self.storage.keys(self.prefix):
+            try:
+                with open(self.storage.local_path(key), "rb") as f:
+                    done.update(pickle.load(f))
+            except (EOFError, pickle.UnpicklingError):
+                continue
+        return done
+
+    def add(self, idx, result):
+        self.done[idx] = result
+        self._delta[idx] = result
+        if len(self._delta) >= self.every or time.time() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        """Hand the results added since the last save to the background writer."""
+        self._raise_failed()
+        if not self._delta:
+            return
+        name = f"{self.prefix}/{self.attempt:03d}-{self._saves:06d}.pkl"
+        self._pending.append(self._writer.submit(self._write, name, self._delta))
+        self._delta = {}
+        self._saves += 1
+        self._last_save = time.time()
+
+    def _write(self, name, delta):
+        with self.storage.writer(name) as path:
+            # a partly written file is never listed under its final name
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(delta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+
+    def _raise_failed(self):
+        running = []
+        for future in self._pending:
+            if future.done():
+                future.result()
+            else:
+                running.append(future)
+        self._pending = running
+
+    def close(self):
+        """Save what is left and wait until every delta file is written."""
+        self.save()
+        self._writer.shutdown(wait=True)
+        self._raise_failed()
+
+
+class TaskCheckpoint(CheckpointLog):
+    def __init__(self, flow, every=10, interval=SAVE_INTERVAL, name="results"):
+        from metaflow import current
+        from run_storage import RunStorage
+
+        super(TaskCheckpoint, self).__init__(
+            RunStorage(flow),
+            os.path.join("checkpoints", current.step_name, current.task_id, name),
+            attempt=current.retry_count,
+            every=every,
+            interval=interval,
+        )
+        if self.done:
+            print(
+                f"Attempt {current.retry_count}: resuming with "
+                f"{len(self.done)} results from the checkpoint"
+            )
+
+
+def resumable_map(fn, items, checkpoint, max_in_flight=8, on_result=None):
+    """
+    `map_concurrent` over the items that `checkpoint` has no result for.
+
+    Restored results are passed to `on_result` first, so progress displays
+    start where the failed attempt stopped. Results are returned in the order
+    of `items`, and the checkpoint is closed before returning or raising. If
+closing fails while an item's error is being raised, the item's error is
+raised and the failed save is only printed.
+    """
+    items = list(items)
+    for idx in sorted(checkpoint.done):
+        if on_result is not None:
+            on_result(idx, checkpoint.done[idx])
+    todo = [idx for idx in range(len(items)) if idx not in checkpoint.done]
+
+    def record(j, result):
+        checkpoint.add(todo[j], result)
+        if on_result is not None:
+            on_result(todo[j], result)
+
+    try:
+        map_concurrent(
+            lambda idx: fn(items[idx]), todo, max_in_flight=max_in_flight, on_result=record
+        )
+    except BaseException:
+        # the task's error is the one to raise; a checkpoint that could not
+        # be saved only means the next attempt sends more requests again
+        try:
+            checkpoint.close()
+        except Exception as ex:
+            print(f"Could not save the checkpoint: {ex!r}")
+        raise
+    checkpoint.close()
+    return [checkpoint.done[idx] for idx in range(len(items))]
@@ -0,0 +1,123 @@
+"""
+A small persistent key/value cache backed by SQLite.
+
+Entries are evicted least-recently-used first once the stored values exceed
+`max_bytes`, and optionally expire `ttl` seconds after they were written.
+SQLite handles locking, so several local foreach tasks can share one file.
+
+The file lives on the local disk of the machine running the task. That makes
+it a cache for local runs and for tasks sharing a persistent host: a
+`@kubernetes` or `@batch` task starts from an empty disk every time, so its
+cache is empty at the start of every run and is dropped when the task ends. A
+warning is printed when a cache is opened in such a task.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+)
+"""
+# stay well below SQLite's limit on host parameters per statement
+_CHUNK = 500
+# set in tasks running on remote compute, whose local disk does not persist
+REMOTE_TASK_ENV = ("METAFLOW_KUBERNETES_POD_NAME", "AWS_BATCH_JOB_ID")
+
+
+def is_remote_task():
+    return any(os.environ.get(var) for var in REMOTE_TASK_ENV)
+
+
+class DiskCache(object):
+    def __init__(self, path, max_bytes=1 << 30, ttl=None):
+        path = os.path.expanduser(path)
+        if is_remote_task():
+            print(
+                f"Cache {path} is on the local disk of a remote task; it starts "
+                "empty and is discarded when the task ends"
+            )
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(_SCHEMA)
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+
+    def get_many(self, keys):
+        """Return a dict with the cached value of every key that is present."""
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        with self._lock, self._db:
+            for i in range(0, len(keys), _CHUNK):
+                chunk = keys[i : i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                query = "SELECT key, value, created FROM entries WHERE key IN (%s)"
+                for key, value, created in self._db.execute(query % marks, chunk):
+                    if self.ttl is None or now - created <= self.ttl:
+                        found[key] = value
+                hits = [k for k in chunk if k in found]
+                if not hits:
+                    continue
+                self._db.execute(
+                    "UPDATE entries SET accessed = ? WHERE key IN (%s)"
+                    % ",".join("?" * len(hits)),
+                    [now] + hits,
+                )
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """Store a `{key: bytes}` mapping and evict down to `max_bytes`."""
+        now = time.time()
+        rows = [(k, v, len(v), now, now) for k, v in items.items()]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._evict(now)
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims = []
+        for key, size in self._db.execute(
+            "SELECT key, size FROM entries ORDER BY accessed ASC"
+        ):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,70 @@
+"""
+Content-addressed cache of embedding vectors.
+
+Vectors are keyed by a hash of (model, input_type, text) and stored as packed
+float32, the same layout `TextEmbedding.embed` emits, so that unchanged text
+is never sent to the NIM endpoint twice.
+"""
+from array import array
+import hashlib
+import json
+import time
+
+from disk_cache import DiskCache
+
+
+def cache_key(model, input_type, text):
+    payload = json.dumps([model, input_type, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def pack(vector):
+    return array("f", vector).tobytes()
+
+
+class EmbeddingCache(object):
+    def __init__(self, path, max_bytes=1 << 30):
+        self.store = DiskCache(path, max_bytes=max_bytes)
+
+    def lookup(self, model, input_type, texts):
+        """Return packed vectors per text, or None where the text is not cached."""
+        keys = [cache_key(model, input_type, t) for t in texts]
+        found = self.store.get_many(keys)
+        return [found.get(k) for k in keys]
+
+    def store_many(self, model, input_type, texts, packed):
+        self.store.put_many(
+            {cache_key(model, input_type, t): p for t, p in zip(texts, packed)}
+        )
+
+
+def embed_batch(llm, model, input_type, texts, cache=None):
+    """
+    Embed `texts` with the NIM client `llm`, sending only the cache misses.
+
+    Returns `(vectors, usage)` where `vectors` holds one packed float32 vector
+    per text, in order, and `usage` is the endpoint's usage dict extended with
+    the client-side request time and the number of cache hits.
+    """
+    vectors = [None] * len(texts)
+    if cache is not None:
+        vectors = cache.lookup(model, input_type, texts)
+    misses = [i for i, v in enumerate(vectors) if v is None]
+
+    usage = {"prompt_tokens": 0, "total_tokens": 0}
+    t0 = time.perf_counter()
+    if misses:
+        miss_text = [texts[i] for i in misses]
+        res_json = llm(input=miss_text, input_type=input_type)
+        # API reference: https://docs.nvidia.com/nim/nemo-retriever/text-embedding/latest/reference.html
+        res_data = sorted(res_json["data"], key=lambda d: d["index"])
+        packed = [pack(d["embedding"]) for d in res_data]
+        for i, p in zip(misses, packed):
+            vectors[i] = p
+        if cache is not None:
+            cache.store_many(model, input_type, miss_text, packed)
+        usage = res_json["usage"]
+    tf = time.perf_counter()
+    usage["client-e2e-time"] = tf - t0
+    usage["cache-hits"] = len(vectors) - len(misses)
+    return vectors, usage
@@ -0,0 +1,55 @@
+"""
+Assemble the per-batch outputs of `TextEmbedding.embed` into one matrix.
+
+Each embed task stores its vectors as packed float32 bytes. The join sizes a
+single contiguous matrix from the batch lengths, which can be a memory-mapped
+.npy file, and copies each batch into its slice, so time and memory grow
+linearly with the number of vectors.
+"""
+import numpy as np
+import pandas as pd
+
+DTYPE = np.float32
+
+
+def assemble_embeddings(inputs, path=None):
+    """
+    Copy the embeddings of a sequence of embed tasks into one matrix.
+
+    Each input needs a `text_batch` list, `embeddings` as packed float32 bytes
+    and `embedding_dim`. When `path` is given the matrix is written to that
+    .npy file through a memory map instead of being held in memory.
+    Returns `(embeddings, embeddings_meta)`.
+    """
+    sizes = [len(inp.text_batch) for inp in inputs]
+    # empty batches carry no dimension; no batches give an empty (0, 0) matrix
+    dims = {inp.embedding_dim for inp, size in zip(inputs, sizes) if size}
+    if len(dims) > 1:
+        raise ValueError(f"Batches have different embedding dimensions: {sorted(dims)}")
+    shape = (sum(sizes), dims.pop() if dims else 0)
+    if path is None:
+        embeddings = np.empty(shape, dtype=DTYPE)
+    else:
+        embeddings = np.lib.format.open_memmap(path, mode="w+", dtype=DTYPE, shape=shape)
+
+    texts = []
+    offset = 0
+    for inp, size in zip(inputs, sizes):
+        if not size:
+            continue
+        block = np.frombuffer(inp.embeddings, dtype=DTYPE).reshape(size, shape[1])
+        embeddings[offset : offset + size] = block
+        texts.extend(inp.text_batch)
+        offset += size
+    if path is not None:
+        embeddings.flush()
+
+    embeddings_meta = pd.DataFrame(
+        {"text": texts, "embedding_row_idx": np.arange(shape[0])}
+    )
+    return embeddings, embeddings_meta
+
+
+def open_embeddings(path):
+    """Open an embeddings .npy file read-only without loading it."""
+    return np.load(path, mmap_mode="r")
@@ -0,0 +1,161 @@
+"""
+An inverted-file (IVF) approximate nearest-neighbour index in NumPy.
+
+Vectors are L2-normalised and clustered with spherical k-means. Each vector is
+stored in the list of its closest centroid, with the lists laid out
+contiguously so that a probe is a single slice. A search scores the query
+against the centroids, visits the `n_probe` best lists and ranks only the
+vectors found there by inner product (cosine similarity).
+"""
+import numpy as np
+
+DTYPE = np.float32
+
+
+def normalize(x):
+    x = np.asarray(x, dtype=DTYPE)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, np.finfo(DTYPE).tiny)
+
+
+def top_k(scores, k):
+    """Indices of the `k` largest scores along the last axis, best first."""
+    k = min(k, scores.shape[-1])
+    idx = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=-1), axis=-1)
+    return np.take_along_axis(idx, order, axis=-1)
+
+
+def brute_force_search(vectors, queries, k=10, normalized=True, chunk_size=65536):
+    """
+    Exact cosine search, scanning `vectors` in chunks so a memory-mapped
+    corpus is never loaded as a whole. Pass `normalized=False` if the stored
+    vectors are not unit length. Returns `(scores, ids)`, best first.
+    """
+    queries = normalize(np.atleast_2d(queries))
+    scores = np.empty((len(queries), 0), dtype=DTYPE)
+    ids = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        block = np.asarray(vectors[start : start + chunk_size], dtype=DTYPE)
+        if not normalized:
+            block = normalize(block)
+        block_ids = np.broadcast_to(
+            np.arange(start, start + len(block)), (len(queries), len(block))
+        )
+        scores = np.concatenate([scores, queries @ block.T], axis=1)
+        ids = np.concatenate([ids, block_ids], axis=1)
+        best = top_k(scores, k)
+        scores = np.take_along_axis(scores, best, axis=-1)
+        ids = np.take_along_axis(ids, best, axis=-1)
+    return scores, ids
+
+
+def kmeans(vectors, n_lists, n_iter=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        # re-seed empty lists with random points so every list stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex(object):
+    def __init__(self, centroids, offsets, ids, vectors):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+
+    @classmethod
+    def build(
+        cls, embeddings, n_lists=None, n_iter=10, seed=0, path=None, chunk_size=65536
+    ):
+        """
+        Cluster `embeddings` into `n_lists` lists (about 4 * sqrt(n) by
+        default). Rows are processed in chunks so a memory-mapped input is never
+        loaded as a whole, and the reordered vectors are written to the .npy
+        file at `path` when one is given.
+        """
+        n = len(embeddings)
+        if n == 0:
+            # no lists at all: every search finds nothing
+            empty = np.empty((0, embeddings.shape[1]), dtype=DTYPE)
+            return cls(empty, np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), empty)
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(n))
+        n_lists = max(1, min(n_lists, n))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, min(n, 256 * n_lists), replace=False))
+        sample = normalize(embeddings[sample])
+        centroids = kmeans(sample, n_lists, n_iter=n_iter, seed=seed)
+
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, chunk_size):
+            block = normalize(embeddings[start : start + chunk_size])
+            assign[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        ids = np.argsort(assign, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=offsets[1:])
+        shape = (n, embeddings.shape[1])
+        if path is None:
+            vectors = np.empty(shape, dtype=DTYPE)
+        else:
+            vectors = np.lib.format.open_memmap(path, mode="w+", dtype=DTYPE, shape=shape)
+        for start in range(0, n, chunk_size):
+            rows = ids[start : start + chunk_size]
+            vectors[start : start + len(rows)] = normalize(embeddings[rows])
+        if path is not None:
+            vectors.flush()
+        return cls(centroids, offsets, ids, vectors)
+
+    def search(self, queries, k=10, n_probe=8):
+        """Return `(scores, ids)` of the `k` best rows per query, best first."""
+        queries = normalize(np.atleast_2d(queries))
+        n_probe = min(n_probe, len(self.centroids))
+        scores = np.full((len(queries), k), -np.inf, dtype=DTYPE)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if n_probe == 0:
+            return scores, ids
+        probes = top_k(queries @ self.centroids.T, n_probe)
+        for qi, q in enumerate(queries):
+            rows = np.concatenate(
+                [np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes[qi]]
+            )
+            if len(rows) == 0:
+                continue
+            s = self.vectors[rows] @ q
+            best = top_k(s, k)
+            scores[qi, : len(best)] = s[best]
+            ids[qi, : len(best)] = self.ids[rows[best]]
+        return scores, ids
+
+    def to_dict(self):
+        """Everything but the vectors, small enough to be a Metaflow artifact."""
+        return {"centroids": self.centroids, "offsets": self.offsets, "ids": self.ids}
+
+
+def search_texts(llm, questions, ann_index, vectors, texts, k=5, n_probe=8, input_type="query"):
+    """
+    Embed `questions` with the NIM embedding model `llm` and return, per
+    question, the `k` closest `(text, score)` pairs of an index saved by
+    `IVFIndex.to_dict` as `ann_index`, over its reordered `vectors`; `texts`
+    are the texts of the embedded rows, in their original order.
+    """
+    questions = list(questions)
+    if not questions:
+        return []
+    index = IVFIndex(vectors=vectors, **ann_index)
+    res_json = llm(input=questions, input_type=input_type)
+    queries = np.asarray(
+        [d["embedding"] for d in sorted(res_json["data"], key=lambda d: d["index"])]
+    )
+    scores, ids = index.search(queries, k=k, n_probe=n_probe)
+    return [
+        [(texts[i], float(s)) for i, s in zip(row_ids, row_scores) if i >= 0]
+        for row_ids, row_scores in zip(ids, scores)
+    ]
@@ -0,0 +1,565 @@
+"""
+Access to the NIM model clients used by the example flows.
+
+Inside a flow `nim_models()` returns clients for the containers managed by
+`@nim`. When the `NIM_BASE_URL` environment variable is set, it instead
+returns clients for the OpenAI-compatible server at that address, such as
+the local stand-in in `nim-standin/`:
+
+    NIM_BASE_URL=http://127.0.0.1:8000 python flow.py run
+
+Every client is called with the same keyword arguments and returns the same
+response dicts as a `current.nim.models` handle, either blocking,
+`llm(**kwargs)`, or from asyncio, `await llm.acall(**kwargs)`. Requests
+
+ - reuse pooled keep-alive connections to each server,
+ - have separate connect and read timeouts per endpoint kind, so a stalled
+   container fails the request instead of hanging the task,
+ - are retried with jittered exponential backoff on 429 and 5xx responses
+   and on connection errors, honouring Retry-After. A request that timed out
+   waiting for its response is not sent again, since the server may still
+   be working on it,
+ - accepted with 202 are polled until their result is ready, like the
+   handles do.
+
+`llm.stream(**kwargs)` sends a streamed chat completion through the same
+pool and retry policy (see streaming.py).
+
+Timeouts and retries can be set with environment variables, e.g. through
+`@environment`:
+
+    NIM_TIMEOUTS='{"chat": [5, 300], "embedding": [5, 60]}'   # connect, read
+    NIM_MAX_RETRIES=4
+    NIM_HTTP2=1      # HTTP/2 through httpx, if httpx and h2 are installed
+
+Without `NIM_BASE_URL` the `current.nim.models` handles themselves are
+called, with the same retry policy. Every call, retries included, is
+recorded as one span in `telemetry`.
+"""
+import asyncio
+import http.client
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import telemetry
+
+ENDPOINT_PATHS = {
+    "chat": "/v1/chat/completions",
+    "embedding": "/v1/embeddings",
+    "ranking": "/v1/ranking",
+}
+# (connect, read) seconds
+DEFAULT_TIMEOUTS = {
+    "chat": (5.0, 600.0),
+    "embedding": (5.0, 120.0),
+    "ranking": (5.0, 120.0),
+}
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# not retried by clients from nim_models(retry_throttled=False)
+THROTTLE_STATUSES = frozenset([429, 503])
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+POOL_SIZE = 64
+# seconds between polls of a request accepted with 202
+POLL_INTERVAL = 0.5
+# where NVIDIA cloud functions report a request accepted with an NVCF-REQID
+NVCF_STATUS_PATH = "/v2/nvcf/pexec/status/"
+
+
+class NIMHTTPError(RuntimeError):
+    def __init__(self, status, body, url):
+        super().__init__(f"HTTP {status} from {url}: {body[:500]!r}")
+        self.status = status
+        self.body = body
+
+
+class NIMReadTimeout(RuntimeError):
+    """
+    A request was sent but its response did not arrive within the read
+    timeout. It is never retried: the server may still be processing it.
+    """
+
+
+def endpoint_kind(model):
+    """Kind of API serving `model`, following the NIM API references."""
+    if "embed" in model:
+        return "embedding"
+    if "rerank" in model:
+        return "ranking"
+    return "chat"
+
+
+def endpoint_path(model):
+    return ENDPOINT_PATHS[endpoint_kind(model)]
+
+
+def timeouts():
+    configured = dict(DEFAULT_TIMEOUTS)
+    for kind, (connect, read) in json.loads(os.environ.get("NIM_TIMEOUTS") or "{}").items():
+        configured[kind] = (float(connect), float(read))
+    return configured
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, but no sooner than Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP/1.1 connections to one server, shared by threads."""
+
+    def __init__(self, base_url, size=POOL_SIZE):
+        parts = urlsplit(base_url)
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.conn_cls = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self, timeout):
+        connect_timeout, read_timeout = timeout
+        conn = self.conn_cls(self.netloc, timeout=connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(read_timeout)
+        return conn
+
+    def _release(self, conn, resp):
+        if resp.will_close:
+            conn.close()
+        else:
+            try:
+                self.idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def _send(self, method, path, body, headers, timeout):
+        """Send a request and return the connection and its response."""
+        try:
+            conn, reused = self.idle.get_nowait(), True
+            conn.sock.settimeout(timeout[1])
+        except queue.Empty:
+            conn, reused = self._connect(timeout), False
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            return conn, conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # the server closed an idle connection; this is not a failure
+            return self._send(method, path, body, headers, timeout)
+        except TimeoutError as ex:
+            conn.close()
+            raise NIMReadTimeout(f"no response from {self.netloc}{path} in {timeout[1]}s") from ex
+        except BaseException:
+            conn.close()
+            raise
+
+    def request(self, path, body, headers, timeout, method="POST"):
+        """Send `body` and return `(status, headers, data)`."""
+        conn, resp = self._send(method, path, body, headers, timeout)
+        try:
+            data = resp.read()
+        except TimeoutError as ex:
+            conn.close()
+            raise NIMReadTimeout(f"response from {self.netloc}{path} stalled") from ex
+        except BaseException:
+            conn.close()
+            raise
+        self._release(conn, resp)
+        return resp.status, resp.headers, data
+
+    def stream(self, path, body, headers, timeout):
+        """
+        POST `body` and return `(status, headers, body)`, where `body` is an
+        iterator over the lines of a 200 response, or the bytes of any other.
+        """
+        conn, resp = self._send("POST", path, body, headers, timeout)
+        if resp.status != 200:
+            data = resp.read()
+            self._release(conn, resp)
+            return resp.status, resp.headers, data
+
+        def lines():
+            try:
+                for line in resp:
+                    yield line
+            except TimeoutError as ex:
+                raise NIMReadTimeout(f"stream from {self.netloc}{path} stalled") from ex
+            finally:
+                # a stream abandoned halfway leaves the connection unusable
+                if resp.isclosed():
+                    self._release(conn, resp)
+                else:
+                    conn.close()
+
+        return resp.status, resp.headers, lines()
+
+    async def arequest(self, path, body, headers, timeout, method="POST"):
+        return await asyncio.to_thread(self.request, path, body, headers, timeout, method)
+
+
+class HttpxPool(object):
+    """HTTP/2 (or pooled HTTP/1.1) connections through httpx."""
+
+    def __init__(self, base_url, size=POOL_SIZE):
+        import httpx
+
+        self.httpx = httpx
+        self.base_url = base_url.rstrip("/")
+        self.limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+        self.client = httpx.Client(http2=True, limits=self.limits)
+        self.async_clients = {}
+
+    def _timeout(self, timeout):
+        connect_timeout, read_timeout = timeout
+        return self.httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    @contextmanager
+    def _errors(self, path):
+        """httpx errors as the ones ConnectionPool raises, so both retry alike."""
+        try:
+            yield
+        except (self.httpx.ConnectError, self.httpx.ConnectTimeout, self.httpx.PoolTimeout) as ex:
+            raise ConnectionError(str(ex)) from ex
+        except (self.httpx.ReadTimeout, self.httpx.WriteTimeout) as ex:
+            raise NIMReadTimeout(f"no response from {self.base_url}{path}") from ex
+
+    def request(self, path, body, headers, timeout, method="POST"):
+        with self._errors(path):
+            r = self.client.request(
+                method,
+                self.base_url + path,
+                content=body,
+                headers=headers,
+                timeout=self._timeout(timeout),
+            )
+        return r.status_code, r.headers, r.content
+
+    def stream(self, path, body, headers, timeout):
+        request = self.client.build_request(
+            "POST", self.base_url + path, content=body, headers=headers,
+            timeout=self._timeout(timeout),
+        )
+        with self._errors(path):
+            r = self.client.send(request, stream=True)
+        if r.status_code != 200:
+            with self._errors(path):
+                data = r.read()
+            r.close()
+            return r.status_code, r.headers, data
+
+        def lines():
+            try:
+                with self._errors(path):
+                    for line in r.iter_lines():
+                        yield line.encode("utf-8")
+            finally:
+                r.close()
+
+        return r.status_code, r.headers, lines()
+
+    async def arequest(self, path, body, headers, timeout, method="POST"):
+        # an AsyncClient belongs to the event loop it was first used in
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_clients:
+            self.async_clients[loop] = self.httpx.AsyncClient(http2=True, limits=self.limits)
+        with self._errors(path):
+            r = await self.async_clients[loop].request(
+                method,
+                self.base_url + path,
+                content=body,
+                headers=headers,
+                timeout=self._timeout(timeout),
+            )
+        return r.status_code, r.headers, r.content
+
+
+def make_pool(base_url):
+    if os.environ.get("NIM_HTTP2"):
+        try:
+            import h2  # noqa: F401
+            return HttpxPool(base_url)
+        except ImportError:
+            print("NIM_HTTP2 is set but httpx or h2 is missing; using HTTP/1.1")
+    return ConnectionPool(base_url)
+
+
+# failures to connect or to get any response; a read timeout is a
+# NIMReadTimeout, which is not among them
+RETRIABLE_ERRORS = (OSError, http.client.HTTPException)
+
+
+class EndpointModel(object):
+    # per-token timing is available, see streaming.py
+    streaming = True
+
+    def __init__(
+        self, pool, base_url, model, headers=None, max_retries=MAX_RETRIES,
+        retry_statuses=RETRY_STATUSES,
+    ):
+        self.pool = pool
+        self.model = model
+        self.path = endpoint_path(model)
+        self.base_path = urlsplit(base_url).path.rstrip("/")
+        self.endpoint = base_url.rstrip("/") + self.path
+        self.timeout = timeouts()[endpoint_kind(model)]
+        self.max_retries = max_retries
+        self.retry_statuses = retry_statuses
+        self.headers = dict(headers or {})
+        if os.environ.get("NIM_API_KEY"):
+            self.headers["Authorization"] = "Bearer " + os.environ["NIM_API_KEY"]
+
+    def _request(self, kwargs, accept="application/json"):
+        # like the OpenAI client, extra_body is merged into the request body
+        payload = {"model": self.model}
+        payload.update(kwargs)
+        payload.update(payload.pop("extra_body", None) or {})
+        headers = dict(self.headers, **{"Content-Type": "application/json", "Accept": accept})
+        return json.dumps(payload).encode("utf-8"), headers
+
+    def _poll_path(self, headers, path):
+        """Where to ask for the result of a request accepted with 202."""
+        location = headers.get("Location")
+        if location:
+            parts = urlsplit(location)
+            path = parts.path + ("?" + parts.query if parts.query else "")
+            # paths are sent relative to the base URL
+            if self.base_path and path.startswith(self.base_path + "/"):
+                path = path[len(self.base_path) :]
+        elif headers.get("NVCF-REQID"):
+            path = NVCF_STATUS_PATH + headers["NVCF-REQID"]
+        if path is None:
+            raise NIMHTTPError(202, b"no Location or NVCF-REQID to poll", self.endpoint)
+        return path
+
+    def _outcome(self, attempt, status, headers, data, polled=None):
+        """
+        `(result, delay, poll)`: the response dict, or the seconds to wait
+        before the next request, and the path that request polls if the
+        request was accepted with 202. `polled` is the path being polled.
+        """
+        if status == 202:
+            return None, POLL_INTERVAL, self._poll_path(headers, polled)
+        if 200 <= status < 300:
+            return (json.loads(data) if data.strip() else {}), None, None
+        if status in self.retry_statuses and attempt < self.max_retries:
+            return None, backoff_delay(attempt, headers.get("Retry-After")), polled
+        raise NIMHTTPError(status, data, self.endpoint)
+
+    def _failed(self, ex, attempt, polled):
+        """The seconds to wait after a request got no response, or raise `ex`."""
+        # a POST that timed out may still be running; polls are safe to repeat
+        if attempt == self.max_retries or (isinstance(ex, NIMReadTimeout) and polled is None):
+            raise ex
+        return backoff_delay(attempt)
+
+    def __call__(self, **kwargs):
+        body, headers = self._request(kwargs)
+        with telemetry.span(self.model, len(body)) as span:
+            attempt, polled = 0, None
+            while True:
+                try:
+                    if polled is None:
+                        reply = self.pool.request(self.path, body, headers, self.timeout)
+                    else:
+                        reply = self.pool.request(polled, None, headers, self.timeout, "GET")
+                except RETRIABLE_ERRORS + (NIMReadTimeout,) as ex:
+                    time.sleep(self._failed(ex, attempt, polled))
+                    attempt += 1
+                    continue
+                result, delay, poll = self._outcome(attempt, *reply, polled=polled)
+                if delay is None:
+                    span.response_bytes = len(reply[2])
+                    span.set_usage(result)
+                    return result
+                if reply[0] != 202:
+                    attempt += 1
+                polled = poll
+                time.sleep(delay)
+
+    async def acall(self, **kwargs):
+        body, headers = self._request(kwargs)
+        with telemetry.span(self.model, len(body)) as span:
+            attempt, polled = 0, None
+            while True:
+                try:
+                    if polled is None:
+                        reply = await self.pool.arequest(self.path, body, headers, self.timeout)
+                    else:
+                        reply = await self.pool.arequest(
+                            polled, None, headers, self.timeout, "GET"
+                        )
+                except RETRIABLE_ERRORS + (NIMReadTimeout,) as ex:
+                    await asyncio.sleep(self._failed(ex, attempt, polled))
+                    attempt += 1
+                    continue
+                result, delay, poll = self._outcome(attempt, *reply, polled=polled)
+                if delay is None:
+                    span.response_bytes = len(reply[2])
+                    span.set_usage(result)
+                    return result
+                if reply[0] != 202:
+                    attempt += 1
+                polled = poll
+                await asyncio.sleep(delay)
+
+    def stream(self, **kwargs):
+        """
+        Send a chat completion with `stream=True` and yield `(arrival_time,
+        chunk)` for each server-sent event. Failures before the stream starts
+        are retried like blocking calls; once it has started, never.
+        """
+        body, headers = self._request(dict(kwargs, stream=True), accept="text/event-stream")
+        attempt = 0
+        while True:
+            try:
+                status, resp_headers, lines = self.pool.stream(
+                    self.path, body, headers, self.timeout
+                )
+            except RETRIABLE_ERRORS + (NIMReadTimeout,) as ex:
+                time.sleep(self._failed(ex, attempt, None))
+                attempt += 1
+                continue
+            if status == 200:
+                break
+            if status in self.retry_statuses and attempt < self.max_retries:
+                time.sleep(backoff_delay(attempt, resp_headers.get("Retry-After")))
+                attempt += 1
+                continue
+            raise NIMHTTPError(status, lines, self.endpoint)
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:") :].strip()
+            if data == b"[DONE]":
+                break
+            yield time.perf_counter(), json.loads(data)
+        # read to the end so the connection goes back to the pool
+        for _ in lines:
+            pass
+
+
+class HandleModel(object):
+    """A `current.nim.models` handle called with the shared retry policy."""
+
+    # the handle only returns whole responses
+    streaming = False
+
+    def __init__(self, handle, model, max_retries=MAX_RETRIES, retry_statuses=RETRY_STATUSES):
+        self.handle = handle
+        self.model = model
+        self.max_retries = max_retries
+        self.retry_statuses = retry_statuses
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+    def _retriable(self, ex):
+        status = getattr(ex, "status_code", None) or getattr(
+            getattr(ex, "response", None), "status_code", None
+        )
+        return status in self.retry_statuses or isinstance(ex, RETRIABLE_ERRORS)
+
+    def __call__(self, **kwargs):
+        with telemetry.span(self.model, len(json.dumps(kwargs))) as span:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = self.handle(**kwargs)
+                    span.set_usage(result)
+                    return result
+                except Exception as ex:
+                    if attempt == self.max_retries or not self._retriable(ex):
+                        raise
+                    time.sleep(backoff_delay(attempt))
+
+    async def acall(self, **kwargs):
+        return await asyncio.to_thread(self, **kwargs)
+
+
+class EndpointModels(object):
+    """Clients of one server, or of the `@nim` handles, by model name."""
+
+    def __init__(
+        self, base_url=None, handles=None, max_retries=MAX_RETRIES, retry_statuses=RETRY_STATUSES
+    ):
+        self.base_url = base_url
+        self.handles = handles
+        self.max_retries = max_retries
+        self.retry_statuses = retry_statuses
+        self._pools = {}
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, base_url):
+        if base_url not in self._pools:
+            self._pools[base_url] = make_pool(base_url)
+        return self._pools[base_url]
+
+    def __getitem__(self, model):
+        with self._lock:
+            if model not in self._models:
+                self._models[model] = self._client(model)
+            return self._models[model]
+
+    def _client(self, model):
+        if self.base_url:
+            return EndpointModel(
+                self._pool(self.base_url),
+                self.base_url,
+                model,
+                max_retries=self.max_retries,
+                retry_statuses=self.retry_statuses,
+            )
+        return HandleModel(self.handles[model], model, self.max_retries, self.retry_statuses)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def nim_models(max_retries=None, retry_throttled=True):
+    """
+    The model clients of this process, shared so that connections are
+    pooled across calls. `max_retries` overrides NIM_MAX_RETRIES, e.g. 0 to
+    observe throttling in a load test. With `retry_throttled=False`, 429 and
+    503 responses are raised at once, so that an adaptive limit (see
+    adaptive_limit.py) is told about every throttled request.
+    """
+    if max_retries is None:
+        max_retries = int(os.environ.get("NIM_MAX_RETRIES", MAX_RETRIES))
+    retry_statuses = RETRY_STATUSES if retry_throttled else RETRY_STATUSES - THROTTLE_STATUSES
+    base_url = os.environ.get("NIM_BASE_URL")
+    with _clients_lock:
+        key = (base_url, max_retries, retry_statuses)
+        if key not in _clients:
+            if base_url:
+                _clients[key] = EndpointModels(
+                    base_url, max_retries=max_retries, retry_statuses=retry_statuses
+                )
+            else:
+                from metaflow import current
+
+                _clients[key] = EndpointModels(
+                    handles=current.nim.models,
+                    max_retries=max_retries,
+                    retry_statuses=retry_statuses,
+                )
+        return _clients[key]
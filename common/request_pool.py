@@ -0,0 +1,98 @@
+"""
+Bounded concurrent dispatch of blocking NIM requests from inside a single task.
+
+The NIM clients exposed through `current.nim.models` are blocking calls that
+spend almost all of their time waiting on the network, so a thread pool is
+enough to keep many requests in flight from one Metaflow task.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+
+_THROTTLED = object()
+
+
+def timed(fn, *args, **kwargs):
+    """
+    Call `fn` and return `(result, seconds)` measured around the call only,
+    with the monotonic clock of telemetry spans.
+    """
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    tf = time.perf_counter()
+    return result, tf - t0
+
+
+def map_concurrent(fn, items, max_in_flight=8, on_result=None, max_throttled=5):
+    """
+    Apply `fn` to every item with at most `max_in_flight` calls outstanding.
+
+    Results are collected in completion order, passed to
+    `on_result(index, result)` as they arrive (e.g. to update a progress bar),
+    and returned in the original order of `items`. The first exception raised
+    by `fn` cancels the requests that have not started yet and is re-raised.
+
+    `max_in_flight` may also be an adaptive limit such as
+    `adaptive_limit.AIMDLimit`, which is told the latency of every call and
+    read again before each submission. Calls failing with a throttling
+    status are then reported to it and retried, up to `max_throttled` times
+    per item, instead of ending the loop.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    if not items:
+        return results
+    limiter = max_in_flight if hasattr(max_in_flight, "record") else None
+    if limiter is None:
+        max_in_flight = max(1, min(int(max_in_flight), len(items)))
+        workers = max_in_flight
+    else:
+        from adaptive_limit import is_throttle
+
+        workers = max(1, min(limiter.max_limit, len(items)))
+
+    def call(item):
+        t0 = time.time()
+        try:
+            result = fn(item)
+        except Exception as ex:
+            if is_throttle(ex):
+                limiter.throttled()
+                return _THROTTLED, ex
+            raise
+        limiter.record(time.time() - t0)
+        return result, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        queue = deque(range(len(items)))
+        throttled = [0] * len(items)
+        try:
+            while queue or pending:
+                cap = max_in_flight if limiter is None else max(1, limiter.value)
+                while queue and len(pending) < cap:
+                    idx = queue.popleft()
+                    if limiter is None:
+                        pending[pool.submit(fn, items[idx])] = idx
+                    else:
+                        pending[pool.submit(call, items[idx])] = idx
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx = pending.pop(future)
+                    result = future.result()
+                    if limiter is not None:
+                        result, ex = result
+                        if result is _THROTTLED:
+                            throttled[idx] += 1
+                            if throttled[idx] > max_throttled:
+                                raise ex
+                            queue.append(idx)
+                            continue
+                    results[idx] = result
+                    if on_result is not None:
+                        on_result(idx, results[idx])
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return results
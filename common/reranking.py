@@ -0,0 +1,20 @@
+"""
+Request helpers for the NeMo Retriever text reranking NIM.
+
+API Reference: https://docs.nvidia.com/nim/nemo-retriever/text-reranking/latest/reference.html
+"""
+
+
+def rerank_request(query, passages, truncate="END"):
+    """Build the keyword arguments of one rerank call for a query and its passages."""
+    return {
+        "query": {"text": query},
+        "passages": [{"text": p} for p in passages],
+        "truncate": truncate,
+    }
+
+
+def ranked_indices(res_json):
+    """Passage indices of a rerank response, most relevant first."""
+    rankings = sorted(res_json["rankings"], key=lambda r: r["logit"], reverse=True)
+    return [r["index"] for r in rankings]
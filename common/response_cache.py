@@ -0,0 +1,110 @@
+"""
+Memoization of chat completions on local disk.
+
+Requests are keyed on their canonical JSON form: the model plus every
+argument (messages, max_tokens, sampling parameters, extra_body, ...) with
+sorted keys. Responses live in a `DiskCache`, so entries are evicted least
+recently used beyond a size bound and expire after a TTL.
+
+In the default "auto" mode only requests that decode deterministically are
+cached, since a sampled completion is not a reproducible function of its
+request. "on" caches every request and "off" disables the cache.
+"""
+from concurrent.futures import Future
+import hashlib
+import json
+import threading
+
+from disk_cache import DiskCache
+
+MODES = ("auto", "on", "off")
+
+
+def request_key(model, args):
+    canonical = json.dumps(
+        {"model": model, "args": args},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(args):
+    """Greedy decoding: temperature 0 or top_k 1, and a single choice."""
+    if args.get("n", 1) != 1:
+        return False
+    return args.get("temperature") == 0 or args.get("top_k") == 1
+
+
+class CachedModel(object):
+    """
+    Wrap a `current.nim.models[model]` handle so that repeated requests are
+    answered from the cache. Calls take the same keyword arguments and return
+    the same response dicts as the handle.
+
+    Concurrent calls with the same cacheable request share one request to the
+    endpoint: the first is sent and the others wait for its response. They
+    count as `coalesced` rather than as misses.
+    """
+
+    def __init__(self, llm, model, cache, mode="auto"):
+        if mode not in MODES:
+            raise ValueError(f"response cache mode must be one of {MODES}, got {mode!r}")
+        self.llm = llm
+        self.model = model
+        self.cache = cache
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def cacheable(self, args):
+        if self.cache is None or self.mode == "off" or args.get("stream"):
+            return False
+        return self.mode == "on" or is_deterministic(args)
+
+    def __call__(self, **args):
+        return self.call(**args)[0]
+
+    def call(self, **args):
+        """
+        Return `(response, cache_hit)`, where `cache_hit` is true when no
+        request was sent for this call: the response came from the cache or
+        from an identical request in flight.
+        """
+        if not self.cacheable(args):
+            return self.llm(**args), False
+        key = request_key(self.model, args)
+        cached = self.cache.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return json.loads(cached), True
+        with self._lock:
+            pending = self._in_flight.get(key)
+            if pending is None:
+                self.misses += 1
+                self._in_flight[key] = future = Future()
+            else:
+                self.coalesced += 1
+        if pending is not None:
+            return pending.result(), True
+        try:
+            resp = self.llm(**args)
+            self.cache.put(key, json.dumps(resp).encode("utf-8"))
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(resp)
+            return resp, False
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+def open_response_cache(path, max_mb=512, ttl_hours=24 * 7):
+    return DiskCache(path, max_bytes=max_mb << 20, ttl=ttl_hours * 3600)
@@ -0,0 +1,112 @@
+"""
+Run-scoped file storage for large binary outputs.
+
+Metaflow artifacts are pickled and loaded fully into memory. Large arrays are
+better written once as files and memory-mapped by the steps that read them.
+Files live under the run's prefix in S3 when the task's datastore is S3, and
+under the local datastore root otherwise.
+
+A step writes a file under its own run with `writer(name)` and keeps
+`key(name)` as the artifact that refers to it. The key names the run that
+wrote the file, so a step of a resumed run, which has a new run id but
+inherits the artifacts of the steps it did not rerun, still finds it.
+"""
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+
+
+def datastore_type(flow=None):
+    """
+    "s3" or "local": the datastore of the running task, which follows
+    `--datastore`, or the configured default outside a task.
+    """
+    ds = getattr(flow, "_datastore", None)
+    kind = getattr(getattr(ds, "_storage_impl", None), "TYPE", None)
+    if kind is None:
+        from metaflow.metaflow_config import DEFAULT_DATASTORE
+
+        kind = DEFAULT_DATASTORE
+    return kind
+
+
+class RunStorage(object):
+    def __init__(self, flow, flow_name=None, run_id=None):
+        if flow_name is None or run_id is None:
+            from metaflow import current
+
+            flow_name, run_id = current.flow_name, current.run_id
+        self.flow_name = flow_name
+        self.run_id = run_id
+        self.use_s3 = datastore_type(flow) == "s3"
+        if self.use_s3:
+            self.root = os.path.join(tempfile.gettempdir(), "run_storage", flow_name)
+        else:
+            from metaflow.metaflow_config import DATASTORE_SYSROOT_LOCAL
+
+            base = DATASTORE_SYSROOT_LOCAL or os.path.join(os.getcwd(), ".metaflow")
+            self.root = os.path.join(base, "run_storage", flow_name)
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def for_run(cls, run):
+        """Storage of a finished `metaflow.Run`, to read its files from a notebook."""
+        return cls(None, *run.pathspec.split("/"))
+
+    def key(self, name):
+        """The run-qualified key of `name` in this run, to keep as an artifact."""
+        return f"{self.run_id}/{name}"
+
+    def _s3(self):
+        from metaflow import S3
+        from metaflow.metaflow_config import DATATOOLS_S3ROOT
+
+        # the layout of S3(run=flow): <DATATOOLS_S3ROOT>/<flow>/<run_id>/<name>
+        return S3(s3root=os.path.join(DATATOOLS_S3ROOT, self.flow_name))
+
+    @contextmanager
+    def writer(self, name):
+        """Yield a local path to write `name` of this run to; it is published on exit."""
+        key = self.key(name)
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        yield path
+        if self.use_s3:
+            with self._s3() as s3:
+                s3.put_files([(key, path)])
+
+    def keys(self, prefix):
+        """The run-qualified keys of this run's files under the directory `prefix`."""
+        top = self.key(prefix)
+        if self.use_s3:
+            with self._s3() as s3:
+                return sorted(obj.key for obj in s3.list_recursive([top]) if obj.exists)
+        found = []
+        for dirpath, _, files in os.walk(os.path.join(self.root, top)):
+            found.extend(
+                os.path.relpath(os.path.join(dirpath, f), self.root)
+                for f in files
+                if not f.endswith(".tmp")
+            )
+        return sorted(found)
+
+    def local_path(self, key, missing_ok=False):
+        """
+        Return a local path to the file at the run-qualified `key`, downloading
+        it once if needed. A missing file raises FileNotFoundError, or returns
+        None if `missing_ok`.
+        """
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            if self.use_s3:
+                with self._s3() as s3:
+                    obj = s3.get(key, return_missing=True)
+                    if obj.exists:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        shutil.move(obj.path, path)
+            if not os.path.exists(path):
+                if missing_ok:
+                    return None
+                raise FileNotFoundError(path)
+        return path
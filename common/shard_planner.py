@@ -0,0 +1,77 @@
+"""
+Splitting the work items of a foreach into shards that finish together.
+
+A foreach step is as slow as its slowest task. Splitting by item count
+ignores that a long review or a query with many passages costs several
+times more than a short one, so some shards end up with a straggler's share
+of the work. Here every item gets an estimated cost and items are assigned
+longest-processing-time first: in decreasing order of cost, each goes to the
+shard with the least work so far. That keeps the largest shard within 4/3 of
+the optimum and never leaves a shard empty while there are items to give it.
+"""
+import heapq
+
+# fixed cost of a request (network, scheduling, prompt template) counted in
+# characters of input, so that many tiny items are not treated as free
+REQUEST_OVERHEAD_CHARS = 200
+
+
+def text_cost(text, overhead=REQUEST_OVERHEAD_CHARS):
+    """Estimated cost of a request whose input is `text`."""
+    return overhead + len(text or "")
+
+
+def plan_shards(costs, n_shards):
+    """
+    Assign item indices to at most `n_shards` shards, longest processing time
+    first. Returns `(shards, loads)`: the item indices of each shard in their
+    original order, and the predicted cost of each shard. No shard is empty.
+    """
+    costs = list(costs)
+    n_shards = max(1, min(int(n_shards), len(costs)))
+    if not costs:
+        return [], []
+    heap = [(0.0, s) for s in range(n_shards)]
+    shards = [[] for _ in range(n_shards)]
+    for idx in sorted(range(len(costs)), key=lambda i: costs[i], reverse=True):
+        load, s = heapq.heappop(heap)
+        shards[s].append(idx)
+        heapq.heappush(heap, (load + costs[idx], s))
+    loads = [0.0] * n_shards
+    for load, s in heap:
+        loads[s] = load
+    return [sorted(shard) for shard in shards], loads
+
+
+def imbalance(loads):
+    """Largest shard over the mean shard; 1.0 is perfectly balanced."""
+    loads = [l for l in loads if l is not None]
+    if not loads or sum(loads) == 0:
+        return None
+    return max(loads) / (sum(loads) / len(loads))
+
+
+def balance_report(predicted, actual):
+    """
+    Compare the planned shard costs with the measured task times, both
+    listed in the same shard order.
+    """
+    return {
+        "shards": len(predicted),
+        "predicted_imbalance": imbalance(predicted),
+        "actual_imbalance": imbalance(actual),
+        "slowest_shard_seconds": max(actual) if actual else None,
+        "mean_shard_seconds": sum(actual) / len(actual) if actual else None,
+    }
+
+
+def format_report(report):
+    def fmt(x):
+        return "-" if x is None else f"{x:.2f}"
+
+    return (
+        f"{report['shards']} shards: predicted imbalance {fmt(report['predicted_imbalance'])}, "
+        f"actual imbalance {fmt(report['actual_imbalance'])} "
+        f"(slowest {fmt(report['slowest_shard_seconds'])}s, "
+        f"mean {fmt(report['mean_shard_seconds'])}s)"
+    )
@@ -0,0 +1,98 @@
+"""
+Streaming chat completions with per-token timing.
+
+A blocking completion only tells the client when the whole answer arrived.
+Streaming the server-sent chunks separates the time to first token (queueing
+plus prefill) from the inter-token latency (decode).
+
+The stream is sent by the `nim_client` model client, through its connection
+pool and with its timeouts and retries. Only the endpoint clients used with
+`NIM_BASE_URL` can stream; with the `current.nim.models` handles
+`stream_chat` raises, and flows check `require_streaming` in `start`.
+"""
+import json
+import time
+
+import telemetry
+
+def require_streaming(llm):
+    """
+    Raise unless the client `llm` can stream, so that a run measuring
+    per-token latency fails at once instead of recording it as missing.
+    """
+    if not getattr(llm, "streaming", False):
+        raise RuntimeError(
+            "Streaming needs a client that reads the endpoint's server-sent "
+            "events, and the @nim model handles only return whole responses. "
+            "Set NIM_BASE_URL to the server's base URL (see common/nim_client.py)."
+        )
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of `values` for `q` in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def stream_chat(llm, model, on_first_token=None, **openai_client_args):
+    """
+    Run one chat completion as a stream, calling `on_first_token()`, if
+    given, when the first chunk arrives, i.e. once the prompt is prefilled.
+
+    Returns `(response, metrics)`. `response` has the same shape as the
+    blocking call's response dict; `metrics` holds the time to first token,
+    inter-token latency percentiles (seconds) and decode tokens/sec.
+    """
+    payload = dict(openai_client_args, model=model, stream=True)
+    payload.setdefault("stream_options", {"include_usage": True})
+    require_streaming(llm)
+
+    with telemetry.span(model, len(json.dumps(payload))) as span:
+        t0 = time.perf_counter()
+        content, arrivals = [], []
+        finish_reason, usage, resp_model = None, None, model
+        for arrival, chunk in llm.stream(**payload):
+            if on_first_token is not None:
+                on_first_token()
+                on_first_token = None
+            resp_model = chunk.get("model", resp_model)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices", []):
+                delta = choice.get("delta", {}).get("content")
+                if delta:
+                    content.append(delta)
+                    arrivals.append(arrival)
+                finish_reason = choice.get("finish_reason") or finish_reason
+        tf = time.perf_counter()
+        span.ttft = arrivals[0] - t0 if arrivals else None
+        span.set_usage({"usage": usage})
+
+    if usage is None:
+        # servers that do not report usage on streams send one token per chunk
+        usage = {"completion_tokens": len(arrivals)}
+    n_tokens = usage.get("completion_tokens") or len(arrivals)
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    decode_time = arrivals[-1] - arrivals[0] if len(arrivals) > 1 else 0.0
+    metrics = {
+        "ttft": arrivals[0] - t0 if arrivals else None,
+        "itl_p50": percentile(gaps, 50),
+        "itl_p90": percentile(gaps, 90),
+        "itl_p99": percentile(gaps, 99),
+        "decode_tps": (n_tokens - 1) / decode_time if decode_time > 0 else None,
+        "e2e": tf - t0,
+    }
+    response = {
+        "model": resp_model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(content)},
+                "finish_reason": finish_reason,
+            }
+        ],
+        "usage": usage,
+    }
+    return response, metrics
@@ -0,0 +1,313 @@
+"""
+Request telemetry shared by every NIM client: spans and latency histograms.
+
+Every call made through `nim_client` (and every streamed completion) is
+wrapped in a span with monotonic start/end timestamps, the request and
+response sizes in bytes and the token counts. Spans are aggregated per model
+into `LogHistogram`s, which take a fixed amount of memory however many
+requests they count and merge by adding bucket counts. A task stores
+`snapshot()` as an artifact, and a join adds up its inputs' snapshots with
+`merge()` instead of concatenating raw per-request rows, so p99s over
+millions of requests cost a few kilobytes per task.
+
+Only a bounded reservoir sample of raw spans is kept, for inspection.
+Per-row times that flows keep in their traces, such as `client-e2e-time`,
+are measured with the same monotonic clock (`request_pool.timed`) and are
+for looking up single requests; aggregate latencies come from the spans.
+"""
+from contextlib import contextmanager
+import math
+import random
+import threading
+import time
+
+RELATIVE_ACCURACY = 0.01
+SPAN_SAMPLE_SIZE = 100
+METRICS = ("latency", "ttft", "request_bytes", "response_bytes", "prompt_tokens", "completion_tokens")
+
+
+class LogHistogram(object):
+    """
+    Counts of positive values in logarithmic buckets.
+
+    Bucket `i` holds values in (gamma^(i-1), gamma^i] with
+    gamma = (1 + a) / (1 - a), so any quantile is returned within a relative
+    error `a` of an actual value. Between 1 microsecond and 11 days, or 1 and
+    1e12 bytes, there are at most about 1400 buckets at a = 1%.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, n=1):
+        if value is None:
+            return
+        self.count += n
+        self.total += value * n
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zeros += n
+            return
+        i = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[i] = self.buckets.get(i, 0) + n
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge histograms of different accuracy")
+        for i, n in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        for attr, pick in (("min", min), ("max", max)):
+            theirs = getattr(other, attr)
+            if theirs is not None:
+                ours = getattr(self, attr)
+                setattr(self, attr, theirs if ours is None else pick(ours, theirs))
+        return self
+
+    def quantile(self, q):
+        """Value at quantile `q` in [0, 1], or None when empty."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if rank < seen:
+                value = 2 * self.gamma**i / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def bins(self):
+        """`(lower, upper, count)` of every non-empty bucket, in order."""
+        out = [(0.0, 0.0, self.zeros)] if self.zeros else []
+        for i in sorted(self.buckets):
+            out.append((self.gamma ** (i - 1), self.gamma**i, self.buckets[i]))
+        return out
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": dict(self.buckets),
+            "zeros": self.zeros,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d["relative_accuracy"])
+        h.buckets = {int(i): n for i, n in d["buckets"].items()}
+        for k in ("zeros", "count", "total", "min", "max"):
+            setattr(h, k, d[k])
+        return h
+
+
+class Span(object):
+    __slots__ = ("model", "start", "end", "request_bytes", "response_bytes",
+                 "prompt_tokens", "completion_tokens", "ttft", "error")
+
+    def __init__(self, model, request_bytes=None):
+        self.model = model
+        self.start = time.monotonic()
+        self.end = None
+        self.request_bytes = request_bytes
+        self.response_bytes = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.ttft = None
+        self.error = None
+
+    @property
+    def latency(self):
+        return None if self.end is None else self.end - self.start
+
+    def set_usage(self, response):
+        usage = (response or {}).get("usage") or {}
+        self.prompt_tokens = usage.get("prompt_tokens")
+        self.completion_tokens = usage.get("completion_tokens")
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class Recorder(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.errors = {}
+        self.samples = []
+        self._seen = 0
+
+    def record(self, span):
+        if span.end is None:
+            span.end = time.monotonic()
+        with self._lock:
+            per_model = self.histograms.setdefault(span.model, {})
+            if span.error is not None:
+                self.errors[span.model] = self.errors.get(span.model, 0) + 1
+            else:
+                for metric in METRICS:
+                    value = getattr(span, metric)
+                    if value is not None:
+                        per_model.setdefault(metric, LogHistogram()).add(value)
+            # reservoir sampling keeps a uniform sample of every span seen
+            self._seen += 1
+            if len(self.samples) < SPAN_SAMPLE_SIZE:
+                self.samples.append(span.to_dict())
+            else:
+                j = random.randrange(self._seen)
+                if j < SPAN_SAMPLE_SIZE:
+                    self.samples[j] = span.to_dict()
+
+    def snapshot(self, reset=False):
+        """Plain-dict state of the recorder, to store as an artifact."""
+        with self._lock:
+            snap = {
+                "histograms": {
+                    model: {metric: h.to_dict() for metric, h in metrics.items()}
+                    for model, metrics in self.histograms.items()
+                },
+                "errors": dict(self.errors),
+                "samples": list(self.samples),
+            }
+            if reset:
+                self.reset()
+        return snap
+
+
+recorder = Recorder()
+
+
+@contextmanager
+def span(model, request_bytes=None):
+    """
+    Time a request to `model`. The caller fills in the response details of
+    the yielded span; a request that raises is counted as an error.
+    """
+    s = Span(model, request_bytes)
+    try:
+        yield s
+    except BaseException as ex:
+        s.error = type(ex).__name__
+        raise
+    finally:
+        recorder.record(s)
+
+
+def snapshot(reset=False):
+    return recorder.snapshot(reset)
+
+
+def merge(snapshots):
+    """Add up snapshots of several tasks into one, keeping a bounded sample."""
+    histograms, errors, samples = {}, {}, []
+    for snap in snapshots:
+        if not snap:
+            continue
+        for model, metrics in snap["histograms"].items():
+            merged = histograms.setdefault(model, {})
+            for metric, d in metrics.items():
+                h = LogHistogram.from_dict(d)
+                if metric in merged:
+                    h = LogHistogram.from_dict(merged[metric]).merge(h)
+                merged[metric] = h.to_dict()
+        for model, n in snap["errors"].items():
+            errors[model] = errors.get(model, 0) + n
+        samples.extend(snap["samples"])
+    if len(samples) > SPAN_SAMPLE_SIZE:
+        samples = random.sample(samples, SPAN_SAMPLE_SIZE)
+    return {"histograms": histograms, "errors": errors, "samples": samples}
+
+
+def histogram(snap, model, metric="latency"):
+    d = snap["histograms"].get(model, {}).get(metric)
+    return LogHistogram.from_dict(d) if d else LogHistogram()
+
+
+def summary_rows(snap, quantiles=(0.5, 0.95, 0.99)):
+    """One row per model: requests, errors, latency quantiles and mean sizes."""
+    rows = []
+    for model in sorted(set(snap["histograms"]) | set(snap["errors"])):
+        latency = histogram(snap, model, "latency")
+        row = {
+            "model": model,
+            "requests": latency.count,
+            "errors": snap["errors"].get(model, 0),
+        }
+        for q in quantiles:
+            row[f"p{round(q * 100)}"] = latency.quantile(q)
+        ttft = histogram(snap, model, "ttft")
+        if ttft.count:
+            row["ttft_p50"] = ttft.quantile(0.5)
+            row["ttft_p99"] = ttft.quantile(0.99)
+        for metric in ("request_bytes", "prompt_tokens", "completion_tokens"):
+            row[f"mean_{metric}"] = histogram(snap, model, metric).mean
+        rows.append(row)
+    return rows
+
+
+def summary_table(snap):
+    """`(headers, data)` of `summary_rows` for a card Table."""
+    rows = summary_rows(snap)
+    # only models with streamed requests have ttft columns
+    headers = ["model", "requests", "errors"]
+    for row in rows:
+        headers.extend(k for k in row if k not in headers)
+    data = [
+        [round(v, 4) if isinstance(v, float) else v for v in map(row.get, headers)]
+        for row in rows
+    ]
+    return headers, data
+
+
+def format_summary(snap):
+    lines = []
+    for row in summary_rows(snap):
+        lines.append(
+            f"{row['model']}: {row['requests']} requests, {row['errors']} errors, "
+            + ", ".join(
+                f"{k} {row[k]:.3f}s" for k in ("p50", "p95", "p99") if row[k] is not None
+            )
+        )
+    return "\n".join(lines)
+
+
+def histogram_spec(h, title="Client end-to-end time (s)"):
+    """Vega-Lite bar chart of a LogHistogram's buckets on a log scale."""
+    values = [
+        {"lower": max(lo, h.min or lo), "upper": hi, "count": n} for lo, hi, n in h.bins() if hi > 0
+    ]
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "width": 500,
+        "height": 160,
+        "data": {"values": values},
+        "mark": "bar",
+        "encoding": {
+            "x": {"field": "lower", "type": "quantitative", "scale": {"type": "log"}, "title": title},
+            "x2": {"field": "upper"},
+            "y": {"field": "count", "type": "quantitative", "title": "Requests"},
+        },
+    }
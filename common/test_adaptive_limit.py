@@ -0,0 +1,59 @@
+import os
+import sys
+import threading
+
+from adaptive_limit import AIMDLimit, trajectory_spec
+from request_pool import map_concurrent
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nim-standin"))
+from server import StandinServer  # noqa: E402
+
+MODEL = "meta/llama3-8b-instruct"
+
+
+def test_the_limit_grows_while_latency_holds():
+    limit = AIMDLimit(initial=4, max_limit=16)
+    for _ in range(200):
+        limit.record(0.01)
+    assert limit.value > 4
+    assert limit.summary()["throttles"] == 0
+
+
+def test_queueing_cuts_the_limit():
+    limit = AIMDLimit(initial=8, max_limit=16)
+    for _ in range(8):
+        limit.record(0.01)
+    for _ in range(8):
+        limit.record(0.1)
+    assert limit.value == 4
+    assert limit.trajectory[-1]["event"] == "queueing"
+
+
+def test_throttling_by_the_server_reaches_the_limit(monkeypatch):
+    server = StandinServer(("127.0.0.1", 0), {"*": {"throttle_rate": 0.2}}, seed=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("NIM_BASE_URL", "http://%s:%d" % server.server_address)
+    from nim_client import nim_models
+
+    llm = nim_models(retry_throttled=False)[MODEL]
+    limit = AIMDLimit(initial=16, max_limit=16)
+    messages = [{"role": "user", "content": "once upon a time"}]
+    results = map_concurrent(
+        lambda i: llm(messages=messages, max_tokens=4, seed=i), range(60), max_in_flight=limit
+    )
+    server.shutdown()
+    assert all(r["choices"] for r in results)
+    throttled = server.sims[MODEL].stats["throttled"]
+    assert throttled > 0
+    # every 429 was reported to the limit, none was retried by the client
+    assert limit.throttles == throttled
+    assert limit.summary()["min"] < 16
+    assert any(p["event"] == "throttled" for p in limit.trajectory)
+
+
+def test_the_chart_of_a_long_trajectory_is_bounded():
+    trajectory = [{"seconds": float(i), "limit": i % 7 + 1, "event": "x"} for i in range(5000)]
+    points = trajectory_spec(trajectory, max_points=100)["data"]["values"]
+    assert len(points) == 100
+    assert points[0]["seconds"] < points[-1]["seconds"] and points[-1] is trajectory[-1]
+    assert trajectory_spec(trajectory[:3])["data"]["values"] == trajectory[:3]
@@ -0,0 +1,21 @@
+from card_report import bounded_rows, merge_samples
+
+
+def test_rows_and_cells_are_bounded():
+    rows, caption = bounded_rows([[i, "x" * 500] for i in range(1000)], max_rows=10)
+    assert len(rows) == 10 and all(len(r[1]) == 200 for r in rows)
+    assert caption.startswith("A sample of 10 of 1000")
+
+
+def test_task_samples_merge_in_proportion():
+    traces = [[[t, i] for i in range(n)] for t, n in enumerate([900, 100, 0])]
+    samples = [bounded_rows(trace, max_rows=50)[0] for trace in traces]
+    rows, caption = merge_samples(samples, [900, 100, 0], max_rows=50)
+    assert len(rows) == 50
+    assert sum(1 for r in rows if r[0] == 1) == 5
+    assert caption.startswith("A sample of 50 of 1000")
+
+
+def test_small_traces_are_kept_whole():
+    rows, caption = merge_samples([[[1]], [[2], [3]]], [1, 2])
+    assert rows == [[1], [2], [3]] and caption == "All 3 rows"
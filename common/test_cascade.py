@@ -0,0 +1,96 @@
+import math
+
+import pytest
+
+from cascade import Cascade, cascade_report, confidence, format_report, merge_stats
+
+SMALL, LARGE = "meta/llama3-8b-instruct", "meta/llama3-70b-instruct"
+
+
+def response(content, logprobs=None, total_tokens=10):
+    choice = {"message": {"content": content}}
+    if logprobs is not None:
+        choice["logprobs"] = {"content": [{"logprob": lp} for lp in logprobs]}
+    return {"choices": [choice], "usage": {"total_tokens": total_tokens}}
+
+
+class Echo(object):
+    """A model answering with a fixed response and recording its requests."""
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.requests = []
+
+    def __call__(self, **args):
+        self.requests.append(args)
+        return self.resp
+
+
+def off_label(resp):
+    return None if resp["choices"][0]["message"]["content"] in ("HAPPY", "SAD") else "off-label"
+
+
+def test_confidence_is_the_geometric_mean():
+    assert confidence(response("x")) is None
+    assert confidence(response("x", [math.log(0.5), math.log(0.125)])) == pytest.approx(0.25)
+
+
+def test_accepted_answers_never_reach_the_large_model():
+    small, large = Echo(response("HAPPY")), Echo(response("SAD", total_tokens=20))
+    cascade = Cascade({SMALL: small, LARGE: large}, SMALL, LARGE, accept=off_label)
+    assert cascade(messages=[]) is small.resp
+    assert small.requests == [{"messages": [], "model": SMALL}]
+    assert large.requests == []
+    report = cascade_report(cascade.stats, SMALL, LARGE)
+    assert report["escalation_rate"] == 0
+    assert report["seconds_saved"] is None
+
+
+def test_off_label_and_low_confidence_escalate():
+    small = Echo(response("maybe"))
+    large = Echo(response("SAD", total_tokens=20))
+    cascade = Cascade({SMALL: small, LARGE: large}, SMALL, LARGE, accept=off_label)
+    assert cascade(messages=[]) is large.resp
+    assert large.requests[0]["model"] == LARGE
+
+    unsure = Echo(response("HAPPY", [math.log(0.6)]))
+    cascade = Cascade(
+        {SMALL: unsure, LARGE: large}, SMALL, LARGE, accept=off_label, min_confidence=0.9
+    )
+    cascade(messages=[])
+    assert unsure.requests[0]["logprobs"] is True
+    assert cascade.stats["reasons"] == {"low confidence": 1}
+
+
+def test_stats_merge_across_tasks():
+    a = {"requests": 3, "escalated": 1, "reasons": {"schema": 1}, "small_tokens": 30}
+    b = {"requests": 2, "escalated": 2, "reasons": {"schema": 1, "invalid JSON": 1}}
+    merged = merge_stats([a, b])
+    assert merged["requests"] == 5 and merged["escalated"] == 3
+    assert merged["reasons"] == {"schema": 2, "invalid JSON": 1}
+    assert merge_stats([]) == {}
+
+
+def test_report_of_no_requests():
+    report = cascade_report({}, SMALL, LARGE)
+    assert report["escalation_rate"] is None
+    assert format_report(report) == "Cascade: no requests"
+
+
+def test_savings_are_estimated_from_escalations():
+    stats = {
+        "requests": 10,
+        "escalated": 2,
+        "reasons": {"off-label": 2},
+        "small_seconds": 1.0,
+        "large_seconds": 2.0,
+        "small_tokens": 100,
+        "large_tokens": 40,
+        "escalated_small_tokens": 20,
+    }
+    report = cascade_report(stats, SMALL, LARGE)
+    assert report["large_only_seconds"] == pytest.approx(10.0)
+    assert report["seconds_saved"] == pytest.approx(7.0)
+    # 100 + 40 * 8.75 small-token units against 100 * 2 * 8.75
+    assert report["cost_saved"] == pytest.approx(1 - 450 / 1750)
+    assert "2/10 requests escalated" in format_report(report)
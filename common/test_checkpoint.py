@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+import os
+import pickle
+
+import pytest
+
+from checkpoint import CheckpointLog, resumable_map
+
+
+class DirStorage(object):
+    """The part of RunStorage a checkpoint uses, in one local directory."""
+
+    def __init__(self, root, run_id="1"):
+        self.root = str(root)
+        self.run_id = run_id
+
+    def key(self, name):
+        return f"{self.run_id}/{name}"
+
+    @contextmanager
+    def writer(self, name):
+        path = os.path.join(self.root, self.key(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        yield path
+
+    def keys(self, prefix):
+        top = os.path.join(self.root, self.key(prefix))
+        if not os.path.isdir(top):
+            return []
+        return sorted(
+            os.path.relpath(os.path.join(top, f), self.root)
+            for f in os.listdir(top)
+            if not f.endswith(".tmp")
+        )
+
+    def local_path(self, key):
+        return os.path.join(self.root, key)
+
+
+def test_a_retry_resumes_where_the_failed_attempt_stopped(tmp_path):
+    storage = DirStorage(tmp_path)
+    items = list(range(30))
+
+    def failing(x):
+        if x == 17:
+            raise RuntimeError("endpoint went away")
+        return x * x
+
+    first = CheckpointLog(storage, "checkpoints/query/3/results", attempt=0, every=5)
+    with pytest.raises(RuntimeError):
+        resumable_map(failing, items, first, max_in_flight=1)
+    assert sorted(first.done) == list(range(17))
+
+    sent = []
+
+    def square(x):
+        sent.append(x)
+        return x * x
+
+    second = CheckpointLog(storage, "checkpoints/query/3/results", attempt=1, every=5)
+    assert sorted(second.done) == list(range(17))
+    restored = []
+    results = resumable_map(
+        square, items, second, max_in_flight=4, on_result=lambda i, r: restored.append(i)
+    )
+    assert results == [x * x for x in items]
+    assert sorted(sent) == list(range(17, 30))
+    assert restored[:17] == list(range(17))
+
+
+def test_saves_write_only_new_results(tmp_path):
+    storage = DirStorage(tmp_path)
+    log = CheckpointLog(storage, "c", every=4, interval=1e9)
+    for i in range(10):
+        log.add(i, str(i))
+    log.close()
+    deltas = []
+    for key in storage.keys("c"):
+        with open(storage.local_path(key), "rb") as f:
+            deltas.append(pickle.load(f))
+    assert [sorted(d) for d in deltas] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_a_truncated_delta_is_skipped(tmp_path):
+    storage = DirStorage(tmp_path)
+    log = CheckpointLog(storage, "c", every=2)
+    for i in range(4):
+        log.add(i, i)
+    log.close()
+    last = storage.local_path(storage.keys("c")[-1])
+    with open(last, "r+b") as f:
+        f.truncate(3)
+    assert sorted(CheckpointLog(storage, "c", attempt=1).done) == [0, 1]
+
+
+def test_nothing_to_do(tmp_path):
+    log = CheckpointLog(DirStorage(tmp_path), "c")
+    assert resumable_map(lambda x: x, [], log) == []
+    assert DirStorage(tmp_path).keys("c") == []
+
+
+def test_a_failed_write_is_raised(tmp_path):
+    class BrokenStorage(DirStorage):
+        @contextmanager
+        def writer(self, name):
+            raise OSError("disk full")
+            yield
+
+    log = CheckpointLog(BrokenStorage(tmp_path), "c", every=1)
+    log.add(0, 0)
+    with pytest.raises(OSError):
+        log.close()
+
+
+def test_a_failed_save_does_not_hide_the_task_error(tmp_path, capsys):
+    class BrokenStorage(DirStorage):
+        @contextmanager
+        def writer(self, name):
+            raise OSError("disk full")
+            yield
+
+    def failing(x):
+        if x == 3:
+            raise RuntimeError("endpoint went away")
+        return x
+
+    log = CheckpointLog(BrokenStorage(tmp_path), "c", every=100)
+    with pytest.raises(RuntimeError, match="endpoint went away"):
+        resumable_map(failing, range(5), log, max_in_flight=1)
+    assert "disk full" in capsys.readouterr().out
+    # with no error of its own, the failed save is raised
+    log = CheckpointLog(BrokenStorage(tmp_path), "c", every=100)
+    with pytest.raises(OSError):
+        resumable_map(lambda x: x, range(5), log)
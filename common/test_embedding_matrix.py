@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from embedding_matrix import assemble_embeddings, open_embeddings
+
+
+def batch(texts, dim, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((len(texts), dim))
+    return SimpleNamespace(
+        text_batch=texts,
+        embeddings=vectors.astype(np.float32).tobytes(),
+        embedding_dim=dim if texts else 0,
+    ), vectors.astype(np.float32)
+
+
+def test_batches_are_copied_in_order(tmp_path):
+    a, va = batch(["a", "b"], 3, seed=1)
+    b, vb = batch(["c"], 3, seed=2)
+    path = str(tmp_path / "e.npy")
+    _, meta = assemble_embeddings([a, b], path)
+    np.testing.assert_array_equal(open_embeddings(path), np.vstack([va, vb]))
+    assert list(meta.text) == ["a", "b", "c"]
+    assert list(meta.embedding_row_idx) == [0, 1, 2]
+
+
+def test_no_inputs_give_an_empty_matrix(tmp_path):
+    embeddings, meta = assemble_embeddings([], str(tmp_path / "e.npy"))
+    assert embeddings.shape == (0, 0)
+    assert len(meta) == 0
+
+
+def test_empty_batches_are_skipped():
+    empty, _ = batch([], 0)
+    full, vectors = batch(["a", "b"], 4)
+    embeddings, meta = assemble_embeddings([empty, full, empty])
+    np.testing.assert_array_equal(embeddings, vectors)
+    assert list(meta.text) == ["a", "b"]
+
+
+def test_mixed_dimensions_are_rejected():
+    with pytest.raises(ValueError):
+        assemble_embeddings([batch(["a"], 3)[0], batch(["b"], 4)[0]])
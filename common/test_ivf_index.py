@@ -0,0 +1,52 @@
+import numpy as np
+
+from ivf_index import IVFIndex, brute_force_search, normalize, search_texts
+
+
+def corpus(n=200, dim=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def test_probing_every_list_is_exact():
+    vectors = corpus()
+    queries = corpus(5, seed=1)
+    index = IVFIndex.build(vectors, n_lists=10)
+    _, ids = index.search(queries, k=3, n_probe=10)
+    _, exact = brute_force_search(normalize(vectors), queries, k=3)
+    np.testing.assert_array_equal(ids, exact)
+
+
+def test_index_round_trips_through_its_artifact(tmp_path):
+    vectors = corpus()
+    path = str(tmp_path / "ann.npy")
+    index = IVFIndex.build(vectors, n_lists=4, path=path)
+    reloaded = IVFIndex(vectors=np.load(path, mmap_mode="r"), **index.to_dict())
+    query = vectors[17]
+    _, ids = reloaded.search(query, k=1, n_probe=4)
+    assert ids[0, 0] == 17
+
+
+def test_empty_corpus_finds_nothing():
+    index = IVFIndex.build(np.zeros((0, 8), dtype=np.float32))
+    scores, ids = index.search(corpus(2), k=3)
+    assert (ids == -1).all() and np.isneginf(scores).all()
+    scores, ids = brute_force_search(np.zeros((0, 8)), corpus(2), k=3)
+    assert ids.shape == (2, 0)
+
+
+def test_search_texts_embeds_questions_in_order():
+    vectors = corpus(50)
+    texts = [f"text {i}" for i in range(50)]
+    index = IVFIndex.build(vectors, n_lists=5)
+    sent = []
+
+    def llm(input, input_type):
+        sent.append((input, input_type))
+        # answered out of order, as the API allows
+        rows = [{"index": i, "embedding": vectors[7 * (i + 1)].tolist()} for i in range(len(input))]
+        return {"data": rows[::-1]}
+
+    hits = search_texts(llm, ["a", "b"], index.to_dict(), index.vectors, texts, k=2, n_probe=5)
+    assert sent == [(["a", "b"], "query")]
+    assert [h[0][0] for h in hits] == ["text 7", "text 14"]
+    assert search_texts(llm, [], index.to_dict(), index.vectors, texts) == []
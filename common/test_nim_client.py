@@ -0,0 +1,120 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from nim_client import EndpointModels, HandleModel, NIMReadTimeout
+from streaming import require_streaming, stream_chat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nim-standin"))
+from server import StandinServer  # noqa: E402
+
+MODEL = "meta/llama3-8b-instruct"
+MESSAGES = [{"role": "user", "content": "once upon a time"}]
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://%s:%d" % server.server_address
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Answers requests from the server's `script`, recording each one."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self):
+        self.server.seen.append((self.command, self.path))
+        delay, status, headers, body = self.server.script.pop(0)
+        time.sleep(delay)
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply()
+
+    def do_GET(self):
+        self.reply()
+
+
+def scripted(script):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+    server.daemon_threads = True
+    server.script, server.seen = list(script), []
+    return server, EndpointModels(serve(server))[MODEL]
+
+
+def test_accepted_requests_are_polled():
+    done = {"choices": [{"message": {"content": "hi"}}]}
+    server, llm = scripted(
+        [
+            (0, 202, {"NVCF-REQID": "abc"}, None),
+            (0, 202, {}, None),
+            (0, 200, {}, done),
+        ]
+    )
+    assert llm(messages=MESSAGES) == done
+    assert server.seen == [
+        ("POST", "/v1/chat/completions"),
+        ("GET", "/v2/nvcf/pexec/status/abc"),
+        ("GET", "/v2/nvcf/pexec/status/abc"),
+    ]
+    server.shutdown()
+
+
+def test_a_timed_out_request_is_not_sent_again():
+    server, llm = scripted([(1.0, 200, {}, {}), (0, 200, {}, {})])
+    llm.timeout = (1.0, 0.2)
+    with pytest.raises(NIMReadTimeout):
+        llm(messages=MESSAGES)
+    assert server.seen == [("POST", "/v1/chat/completions")]
+    server.shutdown()
+
+
+def test_throttled_requests_are_retried():
+    server, llm = scripted([(0, 429, {"Retry-After": "0"}, None), (0, 201, {}, {"ok": 1})])
+    assert llm(messages=MESSAGES) == {"ok": 1}
+    assert len(server.seen) == 2
+    server.shutdown()
+
+
+def test_streams_reuse_the_pool():
+    server = StandinServer(("127.0.0.1", 0), {"*": {}})
+    models = EndpointModels(serve(server))
+    llm = models[MODEL]
+    for _ in range(2):
+        resp, metrics = stream_chat(llm, MODEL, messages=MESSAGES, max_tokens=8)
+        assert resp["choices"][0]["message"]["content"]
+        assert metrics["ttft"] is not None
+    assert llm.pool.idle.qsize() == 1
+    server.shutdown()
+
+
+def test_handles_are_called_without_a_base_url():
+    class Handle(object):
+        url = "http://10.0.0.1:8000/v1"
+
+        def __call__(self, **kwargs):
+            return {"choices": [{"message": {"content": "hi"}}]}
+
+    llm = EndpointModels(handles={MODEL: Handle()})[MODEL]
+    assert isinstance(llm, HandleModel)
+    assert llm(messages=MESSAGES)["choices"][0]["message"]["content"] == "hi"
+    # no blocking fallback that would record the per-token metrics as None
+    with pytest.raises(RuntimeError, match="NIM_BASE_URL"):
+        require_streaming(llm)
+    with pytest.raises(RuntimeError, match="NIM_BASE_URL"):
+        stream_chat(llm, MODEL, messages=MESSAGES)
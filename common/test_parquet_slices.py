@@ -0,0 +1,60 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from parquet_slices import iter_slices, open_parquet, plan_row_slices
+
+
+@pytest.fixture
+def parquet_file(tmp_path):
+    path = str(tmp_path / "rows.parquet")
+    n = 1000
+    table = pa.table({"id": list(range(n)), "text": ["x" * (i % 50) for i in range(n)]})
+    pq.write_table(table, path, row_group_size=300)
+    return open_parquet(path)
+
+
+def ids(tables):
+    return [i for t in tables for i in t.column("id").to_pylist()]
+
+
+def test_slices_cover_every_row_once(parquet_file):
+    shards, loads, total = plan_row_slices(parquet_file, 3, 40)
+    assert total == 1000 and len(shards) == len(loads) == 3
+    assert all(length <= 40 for shard in shards for _, _, length in shard)
+    rows = sorted(i for shard in shards for i in ids(iter_slices(parquet_file, shard)))
+    assert rows == list(range(1000))
+
+
+def test_batches_stay_within_batch_size(parquet_file):
+    shards, _, _ = plan_row_slices(parquet_file, 2, 64)
+    for shard in shards:
+        tables = list(iter_slices(parquet_file, shard, columns=["id"], batch_size=25))
+        assert max(t.num_rows for t in tables) <= 25
+        assert tables[0].column_names == ["id"]
+        expected = [rg * 300 + o + k for rg, o, n in shard for k in range(n)]
+        assert ids(tables) == expected
+
+
+def test_a_slice_inside_a_row_group_reads_only_its_rows(parquet_file):
+    tables = list(iter_slices(parquet_file, [(1, 17, 5), (1, 200, 3), (3, 0, 2)]))
+    assert [t.num_rows for t in tables] == [5, 3, 2]
+    assert ids(tables) == [317, 318, 319, 320, 321, 500, 501, 502, 900, 901]
+
+
+def test_slices_not_aligned_with_read_batches(parquet_file):
+    tables = list(iter_slices(parquet_file, [(0, 7, 30)], batch_size=8))
+    assert [t.num_rows for t in tables] == [8, 8, 8, 6]
+    assert ids(tables) == list(range(7, 37))
+
+
+def test_no_slices(parquet_file):
+    assert list(iter_slices(parquet_file, [])) == []
+    assert list(iter_slices(parquet_file, [(0, 5, 0)])) == []
+
+
+def test_empty_file(tmp_path):
+    path = str(tmp_path / "empty.parquet")
+    pq.write_table(pa.table({"id": pa.array([], pa.int64())}), path)
+    shards, loads, total = plan_row_slices(open_parquet(path), 4, 10)
+    assert (shards, loads, total) == ([], [], 0)
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from response_cache import CachedModel, open_response_cache
+
+ARGS = dict(messages=[{"role": "user", "content": "hi"}], max_tokens=8, temperature=0)
+
+
+class SlowModel(object):
+    """Answers once `release` is set, counting the requests it received."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self, **args):
+        self.calls += 1
+        self.release.wait(5)
+        return {"choices": [{"message": {"content": "hello"}}], "n": self.calls}
+
+
+def test_hits_are_flagged(tmp_path):
+    llm = SlowModel()
+    llm.release.set()
+    model = CachedModel(llm, "m", open_response_cache(str(tmp_path / "c.sqlite")))
+    assert model.call(**ARGS)[1] is False
+    resp, hit = model.call(**ARGS)
+    assert hit and resp["n"] == 1
+    assert (model.hits, model.misses, llm.calls) == (1, 1, 1)
+
+
+def test_sampled_requests_are_not_cached(tmp_path):
+    llm = SlowModel()
+    llm.release.set()
+    model = CachedModel(llm, "m", open_response_cache(str(tmp_path / "c.sqlite")))
+    args = dict(ARGS, temperature=0.7)
+    assert [model.call(**args)[1] for _ in range(2)] == [False, False]
+    assert llm.calls == 2
+
+
+def test_concurrent_identical_misses_send_one_request(tmp_path):
+    llm = SlowModel()
+    model = CachedModel(llm, "m", open_response_cache(str(tmp_path / "c.sqlite")))
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(model.call, **ARGS) for _ in range(4)]
+        while model.misses + model.coalesced < 4:
+            pass
+        llm.release.set()
+        results = [f.result() for f in futures]
+    assert llm.calls == 1
+    assert sorted(hit for _, hit in results) == [False, True, True, True]
+    assert (model.misses, model.coalesced) == (1, 3)
+
+
+def test_a_failed_request_fails_its_waiters(tmp_path):
+    release = threading.Event()
+
+    def failing(**args):
+        release.wait(5)
+        raise OSError("connection reset")
+
+    model = CachedModel(failing, "m", open_response_cache(str(tmp_path / "c.sqlite")))
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(model.call, **ARGS) for _ in range(2)]
+        while model.misses + model.coalesced < 2:
+            pass
+        release.set()
+        for f in futures:
+            with pytest.raises(OSError):
+                f.result()
+    assert not model._in_flight
@@ -0,0 +1,49 @@
+import pytest
+
+from shard_planner import (
+    balance_report,
+    format_report,
+    imbalance,
+    plan_shards,
+    text_cost,
+)
+
+
+def test_no_items_no_shards():
+    assert plan_shards([], 4) == ([], [])
+
+
+def test_never_more_shards_than_items():
+    shards, loads = plan_shards([5, 1], 8)
+    assert sorted(map(len, shards)) == [1, 1]
+    assert sorted(loads) == [1, 5]
+
+
+def test_every_item_lands_in_exactly_one_shard_in_order():
+    costs = [7, 3, 9, 1, 4, 4, 8, 2]
+    shards, loads = plan_shards(costs, 3)
+    assert sorted(i for shard in shards for i in shard) == list(range(len(costs)))
+    assert all(shard == sorted(shard) for shard in shards)
+    assert loads == [sum(costs[i] for i in shard) for shard in shards]
+
+
+def test_lpt_balances_a_straggler():
+    # by count, the first shard would hold 100 + 1 against 2
+    shards, loads = plan_shards([100, 1, 1, 1], 2)
+    assert max(loads) == 100
+    assert [0] in shards
+
+
+def test_costs():
+    assert text_cost("abc", overhead=10) == 13
+    assert text_cost(None, overhead=10) == 10
+
+
+def test_imbalance_and_report():
+    assert imbalance([]) is None
+    assert imbalance([0, 0]) is None
+    assert imbalance([1, 3]) == pytest.approx(1.5)
+    report = balance_report([1, 3], [2.0, 2.0])
+    assert report["actual_imbalance"] == pytest.approx(1.0)
+    assert "2 shards" in format_report(report)
+    assert balance_report([], [])["slowest_shard_seconds"] is None
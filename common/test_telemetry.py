@@ -0,0 +1,66 @@
+import pytest
+
+import telemetry
+from telemetry import LogHistogram, merge, summary_table
+
+
+@pytest.fixture(autouse=True)
+def fresh_recorder():
+    telemetry.snapshot(reset=True)
+    yield
+    telemetry.snapshot(reset=True)
+
+
+def test_quantiles_are_within_the_relative_accuracy():
+    h = LogHistogram()
+    values = [i / 1000 for i in range(1, 1001)]
+    for v in values:
+        h.add(v)
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert h.quantile(q) == pytest.approx(exact, rel=h.relative_accuracy * 2)
+
+
+def test_merged_histograms_count_every_request():
+    a, b = LogHistogram(), LogHistogram()
+    for v in (0.1, 0.2):
+        a.add(v)
+    b.add(0.0)
+    b.add(5.0)
+    merged = LogHistogram.from_dict(a.to_dict()).merge(b)
+    assert (merged.count, merged.zeros, merged.min, merged.max) == (4, 1, 0.0, 5.0)
+
+
+def test_a_summary_of_mixed_rows_has_every_column():
+    # only the streamed model has ttft quantiles
+    with telemetry.span("streamed", 100) as span:
+        span.ttft = 0.05
+    with telemetry.span("blocking", 100):
+        pass
+    with pytest.raises(OSError):
+        with telemetry.span("failing", 100):
+            raise OSError("connection reset")
+    headers, data = summary_table(telemetry.snapshot())
+    assert headers[:3] == ["model", "requests", "errors"]
+    assert "ttft_p50" in headers and "ttft_p99" in headers
+    assert all(len(row) == len(headers) for row in data)
+    rows = {row[0]: dict(zip(headers, row)) for row in data}
+    assert rows["blocking"]["ttft_p50"] is None
+    assert rows["streamed"]["ttft_p50"] == pytest.approx(0.05, rel=0.02)
+    assert (rows["failing"]["requests"], rows["failing"]["errors"]) == (0, 1)
+
+
+def test_snapshots_of_tasks_merge():
+    with telemetry.span("m", 10):
+        pass
+    first = telemetry.snapshot(reset=True)
+    with telemetry.span("m", 10):
+        pass
+    merged = merge([first, None, telemetry.snapshot(reset=True)])
+    assert telemetry.histogram(merged, "m").count == 2
+    assert len(merged["samples"]) == 2
+
+
+def test_an_empty_summary():
+    headers, data = summary_table(telemetry.snapshot())
+    assert headers == ["model", "requests", "errors"] and data == []
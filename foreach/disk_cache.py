@@ -0,0 +1 @@
+../common/disk_cache.py
\ No newline at end of file
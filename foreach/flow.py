@@ -6,31 +6,91 @@ from metaflow import (
     card,
     retry,
     catch,
+    pypi,
     IncludeFile,
     JSONType,
     Parameter,
 )
-from metaflow.cards import Table, VegaChart
+from metaflow.cards import Markdown, Table, VegaChart
 import time
 import json
 
 MODELS = ["meta/llama3-8b-instruct", "meta/llama3-70b-instruct"]
+MAX_CHART_POINTS = 1000
 
 
 @nim(models=MODELS)
 class ParallelLLMEval(FlowSpec):
 
-    n = Parameter("n", default=100)
+    n = Parameter("n", default=100, help="Total number of prompts to evaluate")
+    prompts_per_task = Parameter(
+        "prompts_per_task",
+        default=25,
+        help="Number of prompts each foreach task sends to every model",
+    )
+    max_in_flight = Parameter(
+        "max_in_flight",
+        default=16,
+        help="Maximum number of concurrent requests inside one task",
+    )
+    stream = Parameter(
+        "stream",
+        default=False,
+        type=bool,
+        help="Stream completions and record TTFT, inter-token latency and decode rate; "
+        "needs NIM_BASE_URL",
+    )
+    response_cache = Parameter(
+        "response_cache",
+        default="auto",
+        help="Chat completion cache: 'auto' caches deterministic requests only, "
+        "'on' caches every request, 'off' disables it",
+    )
+    response_cache_path = Parameter(
+        "response_cache_path",
+        default="~/.cache/nim-examples/responses.sqlite",
+        help="File of the chat completion cache on local disk, shared across local "
+        "runs (not persisted by @kubernetes/@batch tasks)",
+    )
+    checkpoint_every = Parameter(
+        "checkpoint_every",
+        default=10,
+        help="Save finished completions every this many requests, so a retry resumes",
+    )
     json_file = IncludeFile("v", default="vega_spec.json")
 
     @step
     def start(self):
-        self.worker = list(range(self.n))
+        if self.stream:
+            from nim_client import nim_models
+            from streaming import require_streaming
+
+            require_streaming(nim_models()[MODELS[0]])
+        if self.prompts_per_task < 1:
+            raise ValueError(
+                f"--prompts_per_task must be at least 1, not {self.prompts_per_task}"
+            )
+        prompt_ids = list(range(self.n))
+        self.worker = [
+            prompt_ids[i : i + self.prompts_per_task]
+            for i in range(0, len(prompt_ids), self.prompts_per_task)
+        ]
         self.next(self.query, foreach="worker")
 
     @card
+    @retry(times=2)
+    @pypi(packages={"pyarrow": "17.0.0"})
     @step
     def query(self):
+        from request_pool import timed
+        from checkpoint import TaskCheckpoint, resumable_map
+        from streaming import stream_chat
+        from response_cache import CachedModel, open_response_cache
+        from nim_client import nim_models
+        from run_storage import RunStorage
+        from trace_table import build_tables, write_tables
+        from card_report import bounded_rows
+        import telemetry
 
         q = "Write a fanciful tale of princesses, a dragon, and a garbage collector."
 
@@ -42,15 +102,32 @@ class ParallelLLMEval(FlowSpec):
             max_tokens=111,
         )
 
-        # level 0 prompt tracking/versioning with Outerbounds
-        self.prompt_trace = []
-        for model_name in MODELS:
-            llm = current.nim.models[model_name]
-            t0 = time.time()
-            resp = llm(**self.openai_client_args)
-            tf = time.time()
+        cache = None
+        if self.response_cache != "off":
+            cache = open_response_cache(self.response_cache_path)
+        models = {
+            m: CachedModel(nim_models()[m], m, cache, self.response_cache)
+            for m in MODELS
+        }
+
+        def send(job):
+            _, model_name = job
+            llm = models[model_name]
+            stream_metrics = {}
+            cache_hit = False
+            if self.stream:
+                # streamed requests are timed per token and never cached
+                resp, stream_metrics = stream_chat(
+                    nim_models()[model_name],
+                    model_name,
+                    **self.openai_client_args,
+                )
+                elapsed = stream_metrics.pop("e2e")
+            else:
+                (resp, cache_hit), elapsed = timed(llm.call, **self.openai_client_args)
             print(
-                f"{model_name} returned {resp['usage']['completion_tokens']} tokens to client in {round(tf - t0, 3)} seconds."
+                f"{model_name} returned {resp['usage']['completion_tokens']} tokens to client in {round(elapsed, 3)} seconds"
+                + (" from the cache." if cache_hit else ".")
             )
             assert (
                 resp["model"] == model_name
@@ -60,42 +137,106 @@ class ParallelLLMEval(FlowSpec):
                 resp["usage"]["completion_tokens"]
                 <= self.openai_client_args["max_tokens"]
             ), "Too many tokens in completion"
-            self.prompt_trace.append(
-                {
-                    "prompt": self.openai_client_args,
-                    "response": resp,
-                    "model": model_name,
-                    "time": tf - t0,
-                }
-            )
+            return {
+                "prompt_id": job[0],
+                "prompt": self.openai_client_args,
+                "response": resp,
+                "model": model_name,
+                "time": elapsed,
+                "cache_hit": cache_hit,
+                **stream_metrics,
+            }
+
+        # level 0 prompt tracking/versioning with Outerbounds
+        # every (prompt, model) pair is in flight at once, bounded by max_in_flight;
+        # a retried task only sends the pairs its failed attempt did not finish
+        jobs = [
+            (prompt_id, model_name)
+            for prompt_id in self.input
+            for model_name in MODELS
+        ]
+        checkpoint = TaskCheckpoint(self, every=self.checkpoint_every)
+        prompt_trace = resumable_map(
+            send, jobs, checkpoint, max_in_flight=self.max_in_flight
+        )
+        self.response_cache_stats = {
+            m: {"hits": llm.hits, "misses": llm.misses, "coalesced": llm.coalesced}
+            for m, llm in models.items()
+        }
+        print("Response cache:", self.response_cache_stats)
+        self.telemetry = telemetry.snapshot(reset=True)
+
+        # the trace is stored as Parquet tables in run storage, with the
+        # prompt interned, instead of a pickled list of dicts
+        prompts, traces = build_tables(prompt_trace)
+        storage = RunStorage(self)
+        prompts_file = f"prompts/{current.task_id}.parquet"
+        trace_file = f"traces/{current.task_id}.parquet"
+        with storage.writer(prompts_file) as prompts_path:
+            with storage.writer(trace_file) as traces_path:
+                write_tables(prompts, traces, prompts_path, traces_path)
+        # run-qualified, so that the join of a resumed run finds the tables
+        # of the tasks it did not rerun
+        self.prompts_key = storage.key(prompts_file)
+        self.trace_key = storage.key(trace_file)
 
+        # one row per prompt, with every model's response; the card shows a
+        # bounded sample, the full responses are in the trace tables
+        rows = []
+        for i in range(0, len(prompt_trace), len(MODELS)):
+            rows.append(
+                [time.strftime("%Y-%m-%d %H:%M:%S"), q]
+                + [
+                    trial["response"]["choices"][0]["message"]["content"]
+                    for trial in prompt_trace[i : i + len(MODELS)]
+                ]
+            )
+        rows, caption = bounded_rows(rows)
+        current.card.append(Markdown(caption))
         current.card.append(
             Table(
                 headers=["Date", "Prompt", "Llama3 8b Response", "Llama3 70b Response"],
-                data=[
-                    [
-                        time.strftime("%Y-%m-%d %H:%M:%S"),
-                        q,
-                        self.prompt_trace[0]["response"]["choices"][0]["message"][
-                            "content"
-                        ],
-                        self.prompt_trace[1]["response"]["choices"][0]["message"][
-                            "content"
-                        ],
-                    ]
-                ],
+                data=rows,
             )
         )
 
         self.next(self.join)
 
     @card
+    @pypi(packages={"pyarrow": "17.0.0"})
     @step
     def join(self, inputs):
-        self.prompt_trace = [trial for i in inputs for trial in i.prompt_trace]
-        data = []
-        for p in self.prompt_trace:
-            data.append({"model": p["model"], "time": p["time"]})
+        from telemetry import merge, summary_table
+        from card_report import sample_rows
+        from run_storage import RunStorage
+        from trace_table import STREAM_METRICS, concat_prompts, concat_traces, read_rows
+
+        # the tasks' tables are appended file to file; only their keys are
+        # loaded from the inputs' artifacts
+        storage = RunStorage(self)
+        prompts_file = "prompts/all.parquet"
+        trace_file = "traces/all.parquet"
+        with storage.writer(prompts_file) as path:
+            self.n_prompts = concat_prompts(
+                [storage.local_path(i.prompts_key) for i in inputs], path
+            )
+        with storage.writer(trace_file) as path:
+            self.n_requests = concat_traces(
+                [storage.local_path(i.trace_key) for i in inputs], path
+            )
+            # the chart plots a fixed-size sample of the requests that were
+            # sent, leaving out cache hits, which took no time; quantiles over
+            # all of them are in the summary table below
+            sent = [
+                i
+                for i, row in enumerate(read_rows(path, ["cache_hit"]))
+                if not row["cache_hit"]
+            ]
+            sample = sample_rows(sent, MAX_CHART_POINTS)
+            data = [
+                {k: v for k, v in row.items() if v is not None}
+                for row in read_rows(path, ["model", "time"] + STREAM_METRICS, sample)
+            ]
 
         vega_spec = json.loads(self.json_file)
         for i, data_source in enumerate(vega_spec["data"]):
@@ -105,11 +246,19 @@ class ParallelLLMEval(FlowSpec):
         chart = VegaChart(vega_spec)
         current.card.append(chart)
 
+        # requests sent, by model, from the tasks' merged latency histograms;
+        # cache hits never reach the client, so they are not counted
+        self.telemetry = merge(i.telemetry for i in inputs)
+        headers, rows = summary_table(self.telemetry)
+        current.card.append(Table(headers=headers, data=rows))
+
+        self.prompts_key = storage.key(prompts_file)
+        self.trace_key = storage.key(trace_file)
         self.next(self.end)
 
     @step
     def end(self):
-        print(len(self.prompt_trace))
+        print(f"{self.n_requests} requests of {self.n_prompts} distinct prompts in {self.trace_key}")
 
 
 if __name__ == "__main__":
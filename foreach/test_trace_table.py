@@ -0,0 +1,57 @@
+from trace_table import (
+    STREAM_METRICS,
+    build_tables,
+    concat_prompts,
+    concat_traces,
+    read_rows,
+    write_tables,
+)
+
+ARGS = {"messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "u"}]}
+
+
+def entry(prompt_id, model, cache_hit=None, **metrics):
+    resp = {
+        "id": f"r{prompt_id}",
+        "created": 1,
+        "choices": [{"message": {"content": f"tale {prompt_id}"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 20, "completion_tokens": 9},
+    }
+    e = {"prompt_id": prompt_id, "prompt": ARGS, "response": resp, "model": model, "time": 0.5}
+    if cache_hit is not None:
+        e["cache_hit"] = cache_hit
+    e.update(metrics)
+    return e
+
+
+def test_prompts_are_interned():
+    prompts, traces = build_tables([entry(0, "a"), entry(0, "b"), entry(1, "a")])
+    assert prompts.num_rows == 1
+    assert prompts.column("user").to_pylist() == ["u"]
+    assert traces.num_rows == 3
+    assert traces.column("content").to_pylist() == ["tale 0", "tale 0", "tale 1"]
+
+
+def test_cache_hits_are_flagged():
+    _, traces = build_tables([entry(0, "a", cache_hit=True), entry(1, "a", cache_hit=False), entry(2, "a")])
+    # entries from before the column was added were all sent
+    assert traces.column("cache_hit").to_pylist() == [True, False, False]
+
+
+def test_stream_metrics_are_optional():
+    _, traces = build_tables([entry(0, "a", ttft=0.1), entry(1, "a")])
+    assert traces.column("ttft").to_pylist() == [0.1, None]
+    assert all(traces.column(m).null_count >= 1 for m in STREAM_METRICS)
+
+
+def test_tasks_tables_concatenate(tmp_path):
+    paths = []
+    for task, trace in enumerate([[entry(0, "a", cache_hit=True)], [entry(1, "a"), entry(2, "b")]]):
+        p, t = tmp_path / f"p{task}.parquet", tmp_path / f"t{task}.parquet"
+        write_tables(*build_tables(trace), str(p), str(t))
+        paths.append((str(p), str(t)))
+    assert concat_prompts([p for p, _ in paths], str(tmp_path / "prompts.parquet")) == 1
+    out = str(tmp_path / "traces.parquet")
+    assert concat_traces([t for _, t in paths], out) == 3
+    rows = read_rows(out, ["prompt_id", "cache_hit"], [0, 2])
+    assert rows == [{"prompt_id": 0, "cache_hit": True}, {"prompt_id": 2, "cache_hit": False}]
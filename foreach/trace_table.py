@@ -0,0 +1,145 @@
+"""
+Columnar storage of ParallelLLMEval traces in Parquet.
+
+Every request of a task is one row of a trace table with typed columns:
+the prompt id, the model, the client-side timings, whether the response
+came from the response cache, whose near-zero times are no latency sample,
+and the fields of the response that are worth keeping, content and token
+counts. The request
+arguments are not repeated per row. They are interned by content hash in a
+separate prompts table, which holds one row per distinct prompt.
+
+A task writes its two tables to run storage; the join appends the tasks'
+trace tables to one Parquet file, row group by row group, and keeps the
+first copy of every prompt, so it never loads a pickled Python object or
+holds more than one task's trace in memory.
+"""
+import hashlib
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STREAM_METRICS = ["ttft", "itl_p50", "itl_p90", "itl_p99", "decode_tps"]
+
+PROMPT_SCHEMA = pa.schema(
+    [
+        ("prompt_hash", pa.string()),
+        ("system", pa.string()),
+        ("user", pa.string()),
+        ("args", pa.string()),
+    ]
+)
+TRACE_SCHEMA = pa.schema(
+    [
+        ("prompt_id", pa.int64()),
+        ("prompt_hash", pa.string()),
+        ("model", pa.dictionary(pa.int32(), pa.string())),
+        ("time", pa.float64()),
+        ("cache_hit", pa.bool_()),
+    ]
+    + [(m, pa.float64()) for m in STREAM_METRICS]
+    + [
+        ("response_id", pa.string()),
+        ("created", pa.int64()),
+        ("finish_reason", pa.dictionary(pa.int32(), pa.string())),
+        ("content", pa.string()),
+        ("prompt_tokens", pa.int32()),
+        ("completion_tokens", pa.int32()),
+    ]
+)
+
+
+def prompt_hash(args):
+    """Content hash of a request's arguments, independent of key order."""
+    canonical = json.dumps(args, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def _message(args, role):
+    contents = [m["content"] for m in args.get("messages", []) if m["role"] == role]
+    return contents[-1] if contents else None
+
+
+def build_tables(trace):
+    """
+    The `(prompts, traces)` tables of a list of trace entries, each a dict
+    with the request arguments under "prompt" and the response dict under
+    "response".
+    """
+    prompts = {}
+    columns = {name: [] for name in TRACE_SCHEMA.names}
+    for entry in trace:
+        args = entry["prompt"]
+        h = prompt_hash(args)
+        if h not in prompts:
+            prompts[h] = {
+                "prompt_hash": h,
+                "system": _message(args, "system"),
+                "user": _message(args, "user"),
+                "args": json.dumps(args, sort_keys=True),
+            }
+        resp = entry["response"]
+        choice = resp["choices"][0]
+        usage = resp.get("usage") or {}
+        row = {
+            "prompt_id": entry.get("prompt_id"),
+            "prompt_hash": h,
+            "model": entry["model"],
+            "time": entry["time"],
+            "cache_hit": entry.get("cache_hit", False),
+            "response_id": resp.get("id"),
+            "created": resp.get("created"),
+            "finish_reason": choice.get("finish_reason"),
+            "content": choice["message"]["content"],
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+        }
+        for m in STREAM_METRICS:
+            row[m] = entry.get(m)
+        for name in TRACE_SCHEMA.names:
+            columns[name].append(row[name])
+    return (
+        pa.Table.from_pylist(list(prompts.values()), schema=PROMPT_SCHEMA),
+        pa.Table.from_pydict(columns, schema=TRACE_SCHEMA),
+    )
+
+
+def write_tables(prompts, traces, prompts_path, traces_path):
+    pq.write_table(prompts, prompts_path)
+    pq.write_table(traces, traces_path)
+
+
+def concat_traces(paths, out_path):
+    """Append the trace tables at `paths` to one file; return the row count."""
+    rows = 0
+    with pq.ParquetWriter(out_path, TRACE_SCHEMA) as writer:
+        for path in paths:
+            table = pq.read_table(path, schema=TRACE_SCHEMA)
+            writer.write_table(table)
+            rows += table.num_rows
+    return rows
+
+
+def concat_prompts(paths, out_path):
+    """Merge the prompt tables at `paths`, keeping one row per hash."""
+    seen = set()
+    with pq.ParquetWriter(out_path, PROMPT_SCHEMA) as writer:
+        for path in paths:
+            table = pq.read_table(path, schema=PROMPT_SCHEMA)
+            keep = []
+            for i, h in enumerate(table.column("prompt_hash").to_pylist()):
+                if h not in seen:
+                    seen.add(h)
+                    keep.append(i)
+            if keep:
+                writer.write_table(table.take(keep))
+    return len(seen)
+
+
+def read_rows(path, columns, indices=None):
+    """Rows of `columns` as dicts, optionally only those at `indices`."""
+    table = pq.read_table(path, columns=columns)
+    if indices is not None:
+        table = table.take(indices)
+    return table.to_pylist()
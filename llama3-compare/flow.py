@@ -1,4 +1,4 @@
-from metaflow import FlowSpec, step, nim, current, card
+from metaflow import FlowSpec, step, nim, current, card, Parameter
 from metaflow.cards import Table
 import time
 
@@ -8,9 +8,36 @@ MODELS = ["meta/llama3-8b-instruct", "meta/llama3-70b-instruct"]
 @nim(models=MODELS)
 class Llama3Comparison(FlowSpec):
 
+    stream = Parameter(
+        "stream",
+        default=False,
+        type=bool,
+        help="Stream completions and record TTFT, inter-token latency and decode rate; "
+        "needs NIM_BASE_URL",
+    )
+    response_cache = Parameter(
+        "response_cache",
+        default="auto",
+        help="Chat completion cache: 'auto' caches deterministic requests only, "
+        "'on' caches every request, 'off' disables it",
+    )
+    response_cache_path = Parameter(
+        "response_cache_path",
+        default="~/.cache/nim-examples/responses.sqlite",
+        help="File of the chat completion cache on local disk, shared across local "
+        "runs (not persisted by @kubernetes/@batch tasks)",
+    )
+
     @card
     @step
     def start(self):
+        from streaming import require_streaming, stream_chat
+        from response_cache import CachedModel, open_response_cache
+        from nim_client import nim_models
+        import telemetry
+
+        if self.stream:
+            require_streaming(nim_models()[MODELS[0]])
 
         q = "What's the weather like today?"
 
@@ -22,15 +49,32 @@ class Llama3Comparison(FlowSpec):
             max_tokens=111,
         )
 
+        cache = None
+        if self.response_cache != "off":
+            cache = open_response_cache(self.response_cache_path)
+
         # level 0 prompt tracking/versioning with Outerbounds
         self.prompt_trace = []
         for model_name in MODELS:
-            llm = current.nim.models[model_name]
-            t0 = time.time()
-            resp = llm(**self.openai_client_args)
-            tf = time.time()
+            llm = CachedModel(
+                nim_models()[model_name], model_name, cache, self.response_cache
+            )
+            stream_metrics = {}
+            t0 = time.perf_counter()
+            if self.stream:
+                # streamed requests are timed per token and never cached
+                resp, stream_metrics = stream_chat(
+                    nim_models()[model_name],
+                    model_name,
+                    **self.openai_client_args,
+                )
+                del stream_metrics["e2e"]
+            else:
+                resp = llm(**self.openai_client_args)
+            tf = time.perf_counter()
             print(
-                f"{model_name} returned {resp['usage']['completion_tokens']} tokens to client in {round(tf - t0, 3)} seconds."
+                f"{model_name} returned {resp['usage']['completion_tokens']} tokens to client in {round(tf - t0, 3)} seconds"
+                + (" from the response cache." if llm.hits else ".")
             )
             assert (
                 resp["model"] == model_name
@@ -46,6 +90,7 @@ class Llama3Comparison(FlowSpec):
                     "response": resp,
                     "model": model_name,
                     "time": tf - t0,
+                    **stream_metrics,
                 }
             )
 
@@ -67,11 +112,28 @@ class Llama3Comparison(FlowSpec):
             )
         )
 
+        if self.stream:
+            metrics = ["ttft", "itl_p50", "itl_p90", "itl_p99", "decode_tps"]
+            current.card.append(
+                Table(
+                    headers=["Model", "Time (s)"] + metrics,
+                    data=[
+                        [p["model"], round(p["time"], 3)]
+                        + [None if p[m] is None else round(p[m], 4) for m in metrics]
+                        for p in self.prompt_trace
+                    ],
+                )
+            )
+
+        self.telemetry = telemetry.snapshot(reset=True)
         self.next(self.end)
 
     @step
     def end(self):
+        from telemetry import format_summary
+
         print(self.prompt_trace)
+        print(format_summary(self.telemetry))
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+../common/response_cache.py
\ No newline at end of file
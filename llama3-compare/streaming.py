@@ -0,0 +1 @@
+../common/streaming.py
\ No newline at end of file
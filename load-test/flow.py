@@ -0,0 +1,174 @@
+from metaflow import FlowSpec, step, nim, current, card, JSONType, Parameter
+from metaflow.cards import Markdown, Table, VegaChart
+import time
+
+MODELS = ["meta/llama3-8b-instruct", "meta/llama3-70b-instruct"]
+EMBEDDING_MODEL = "nvidia/nv-embedqa-mistral-7b-v2"
+RERANK_MODEL = "nvidia/nv-rerankqa-mistral-4b-v3"
+
+
+@nim(models=MODELS + [EMBEDDING_MODEL, RERANK_MODEL])
+class LoadTestFlow(FlowSpec):
+
+    concurrency = Parameter(
+        "concurrency",
+        type=JSONType,
+        default="[1, 2, 4, 8, 16, 32, 64]",
+        help="Numbers of requests kept in flight, one sweep level each",
+    )
+    requests_per_level = Parameter(
+        "requests_per_level",
+        default=64,
+        help="Minimum number of requests sent at each level",
+    )
+    rounds = Parameter(
+        "rounds",
+        default=4,
+        help="At each level send at least this many requests per slot in flight",
+    )
+    max_tokens = Parameter("max_tokens", default=111, help="Tokens per chat completion")
+    embedding_batch = Parameter(
+        "embedding_batch", default=16, help="Texts per embedding request"
+    )
+    rerank_passages = Parameter(
+        "rerank_passages", default=20, help="Passages per rerank request"
+    )
+    knee_fraction = Parameter(
+        "knee_fraction",
+        default=0.9,
+        help="The knee is the lowest concurrency reaching this fraction of the "
+        "best throughput",
+    )
+
+    @step
+    def start(self):
+        self.models = MODELS + [EMBEDDING_MODEL, RERANK_MODEL]
+        self.next(self.sweep, foreach="models")
+
+    @card
+    @step
+    def sweep(self):
+        from request_pool import map_concurrent, timed
+        from nim_client import nim_models
+        import loadgen
+
+        self.model = self.input
+        # no retries: throttled requests should show up as errors of a level
+        llm = nim_models(max_retries=0)[self.model]
+
+        def request(i):
+            return loadgen.make_request(
+                self.model,
+                i,
+                max_tokens=self.max_tokens,
+                batch_size=self.embedding_batch,
+                n_passages=self.rerank_passages,
+            )
+
+        def send(i):
+            # failures, e.g. 429s past the server's queue, count as errors of
+            # the level instead of ending the sweep
+            req = request(i)
+            try:
+                resp, elapsed = timed(llm, **req)
+            except Exception as ex:
+                print(f"{self.model} request {i} failed: {ex}")
+                return None
+            return elapsed, loadgen.count_tokens(self.model, req, resp)
+
+        # a few requests first so that connection setup and a cold model do
+        # not count against the lowest level
+        map_concurrent(send, range(2), max_in_flight=1)
+
+        self.levels = []
+        sent = 0
+        for c in sorted(self.concurrency):
+            n = max(self.requests_per_level, self.rounds * c)
+            t0 = time.time()
+            outcomes = map_concurrent(send, range(sent, sent + n), max_in_flight=c)
+            level = loadgen.summarize(c, outcomes, time.time() - t0)
+            sent += n
+            self.levels.append(level)
+            print(
+                f"{self.model} @ {c} in flight: {level['rps']:.2f} req/s, "
+                f"{level['tokens_per_sec']:.0f} tok/s, p95 {level['p95']} s, "
+                f"{level['errors']} errors"
+            )
+
+        self.knee = loadgen.find_knee(self.levels, self.knee_fraction)
+        current.card.append(Markdown(f"## {self.model}"))
+        current.card.append(VegaChart(loadgen.chart(self.model, self.levels, self.knee)))
+        self.next(self.join)
+
+    @card
+    @step
+    def join(self, inputs):
+        import loadgen
+
+        self.results = {i.model: i.levels for i in inputs}
+        self.knees = {i.model: i.knee for i in inputs}
+
+        current.card.append(Markdown("# Saturation knees"))
+        current.card.append(
+            Markdown(
+                f"The knee is the lowest concurrency reaching {self.knee_fraction:.0%} "
+                "of a model's best throughput. Size `max_in_flight` times the number "
+                "of parallel tasks to it; more requests in flight only add queueing."
+            )
+        )
+        rows = []
+        for model, knee in self.knees.items():
+            if knee is None:
+                rows.append([model, "-", "-", "-", "-"])
+                continue
+            rows.append(
+                [
+                    model,
+                    knee["concurrency"],
+                    round(knee["rps"], 2),
+                    round(knee["tokens_per_sec"], 1),
+                    knee["p95"] and round(knee["p95"], 3),
+                ]
+            )
+        current.card.append(
+            Table(
+                headers=["Model", "Knee concurrency", "Requests/sec", "Tokens/sec", "p95 (s)"],
+                data=rows,
+            )
+        )
+
+        for model, levels in self.results.items():
+            current.card.append(Markdown(f"## {model}"))
+            current.card.append(
+                VegaChart(loadgen.chart(model, levels, self.knees[model]))
+            )
+            current.card.append(
+                Table(
+                    headers=[
+                        "Concurrency", "Requests", "Errors", "Requests/sec",
+                        "Tokens/sec", "p50 (s)", "p95 (s)", "p99 (s)",
+                    ],
+                    data=[
+                        [
+                            l["concurrency"],
+                            l["requests"],
+                            l["errors"],
+                            round(l["rps"], 2),
+                            round(l["tokens_per_sec"], 1),
+                        ]
+                        + [l[q] and round(l[q], 3) for q in ("p50", "p95", "p99")]
+                        for l in levels
+                    ],
+                )
+            )
+        self.next(self.end)
+
+    @step
+    def end(self):
+        for model, knee in self.knees.items():
+            if knee:
+                print(f"{model}: knee at {knee['concurrency']} requests in flight")
+
+
+if __name__ == "__main__":
+    LoadTestFlow()
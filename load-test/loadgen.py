@@ -0,0 +1,182 @@
+"""
+Requests, per-level summaries and the saturation knee of a concurrency sweep
+run by LoadTestFlow.
+"""
+import math
+
+from reranking import rerank_request
+from streaming import percentile
+
+CHAT_PROMPT = "Write a fanciful tale of princesses, a dragon, and a garbage collector."
+SENTENCE = (
+    "Request {i} asks how a garbage collector in the dragon's castle decides "
+    "which objects of the kingdom are still reachable from the tower."
+)
+
+
+def model_kind(model):
+    if "embed" in model:
+        return "embedding"
+    if "rerank" in model:
+        return "rerank"
+    return "chat"
+
+
+def make_request(model, i, max_tokens=111, batch_size=16, n_passages=20):
+    """Keyword arguments of the `i`-th request sent to `model` during a sweep."""
+    kind = model_kind(model)
+    if kind == "embedding":
+        texts = [SENTENCE.format(i=f"{i}.{j}") for j in range(batch_size)]
+        return dict(input=texts, model=model, input_type="passage")
+    if kind == "rerank":
+        passages = [SENTENCE.format(i=f"{i}.{j}") for j in range(n_passages)]
+        return rerank_request(f"Which request {i} is about the tower?", passages)
+    return dict(
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": CHAT_PROMPT},
+        ],
+        max_tokens=max_tokens,
+    )
+
+
+def count_tokens(model, request, response):
+    """
+    Tokens processed by one request: generated tokens for chat models, input
+    tokens for embedding models. The ranking API reports no usage, so rerank
+    tokens are estimated at four characters per token.
+    """
+    usage = response.get("usage") or {}
+    if model_kind(model) == "chat":
+        return usage.get("completion_tokens", 0)
+    if usage.get("total_tokens"):
+        return usage["total_tokens"]
+    chars = len(request["query"]["text"]) * len(request["passages"]) + sum(
+        len(p["text"]) for p in request["passages"]
+    )
+    return math.ceil(chars / 4)
+
+
+def summarize(concurrency, outcomes, wall_time):
+    """
+    Throughput and latency of one level. `outcomes` holds `(seconds, tokens)`
+    for successful requests and `None` for failed ones.
+    """
+    ok = [o for o in outcomes if o is not None]
+    latencies = [seconds for seconds, _ in ok]
+    return {
+        "concurrency": concurrency,
+        "requests": len(outcomes),
+        "errors": len(outcomes) - len(ok),
+        "wall_time": wall_time,
+        "rps": len(ok) / wall_time if wall_time > 0 else 0.0,
+        "tokens_per_sec": sum(t for _, t in ok) / wall_time if wall_time > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def find_knee(levels, fraction=0.9):
+    """
+    The saturation knee: the lowest concurrency reaching `fraction` of the
+    best throughput of the sweep. Past it more requests in flight mostly add
+    queueing delay, so it is the concurrency to provision clients for.
+    """
+    levels = sorted(levels, key=lambda l: l["concurrency"])
+    best = max((l["rps"] for l in levels), default=0.0)
+    for level in levels:
+        if best > 0 and level["rps"] >= fraction * best:
+            return level
+    return None
+
+
+def chart(model, levels, knee):
+    """
+    Vega-Lite spec of throughput and latency against concurrency for one model.
+    A level where every request failed has no latency; it is marked by a rule
+    on the latency chart instead of being left out.
+    """
+    rows = []
+    for l in levels:
+        for q in ("p50", "p95", "p99"):
+            if l[q] is not None:
+                rows.append(
+                    {"concurrency": l["concurrency"], "rps": l["rps"], "quantile": q, "latency": l[q]}
+                )
+    throughput_rows = [
+        {
+            "concurrency": l["concurrency"],
+            "rps": l["rps"],
+            "error_rate": l["errors"] / l["requests"] if l["requests"] else 0.0,
+        }
+        for l in levels
+    ]
+    failed = [
+        {"concurrency": l["concurrency"], "errors": l["errors"]}
+        for l in levels
+        if l["requests"] and l["errors"] == l["requests"]
+    ]
+    x = {
+        "field": "concurrency",
+        "type": "quantitative",
+        "scale": {"type": "log", "base": 2},
+        "title": "Requests in flight",
+    }
+    knee_rule = {
+        "data": {"values": [{"concurrency": knee["concurrency"]}] if knee else []},
+        "mark": {"type": "rule", "strokeDash": [4, 4], "color": "#d73030"},
+        "encoding": {"x": x},
+    }
+    throughput = {
+        "width": 320,
+        "height": 200,
+        "layer": [
+            {
+                "data": {"values": throughput_rows},
+                "mark": {"type": "line", "point": True},
+                "encoding": {
+                    "x": x,
+                    "y": {"field": "rps", "type": "quantitative", "title": "Requests / sec"},
+                    "tooltip": [
+                        {"field": "concurrency", "type": "quantitative"},
+                        {"field": "rps", "type": "quantitative", "format": ".2f"},
+                        {"field": "error_rate", "type": "quantitative", "format": ".0%"},
+                    ],
+                },
+            },
+            knee_rule,
+        ],
+    }
+    latency = {
+        "width": 320,
+        "height": 200,
+        "layer": [
+            {
+                "mark": {"type": "line", "point": True},
+                "encoding": {
+                    "x": x,
+                    "y": {"field": "latency", "type": "quantitative", "title": "Latency (s)"},
+                    "color": {"field": "quantile", "type": "nominal"},
+                },
+            },
+            {
+                "data": {"values": failed},
+                "mark": {"type": "rule", "color": "#7f7f7f", "strokeWidth": 2},
+                "encoding": {
+                    "x": x,
+                    "tooltip": [
+                        {"field": "concurrency", "type": "quantitative"},
+                        {"field": "errors", "type": "quantitative", "title": "failed requests"},
+                    ],
+                },
+            },
+            knee_rule,
+        ],
+    }
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "title": model,
+        "data": {"values": rows},
+        "hconcat": [throughput, latency],
+    }
@@ -0,0 +1 @@
+../common/nim_client.py
\ No newline at end of file
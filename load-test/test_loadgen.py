@@ -0,0 +1,17 @@
+from loadgen import chart, find_knee, summarize
+
+
+def test_a_level_where_every_request_failed_is_charted():
+    levels = [
+        summarize(1, [(0.1, 10)] * 4, 1.0),
+        summarize(2, [(0.2, 10)] * 8, 1.0),
+        summarize(4, [None] * 16, 1.0),
+    ]
+    assert levels[2]["p50"] is None
+    spec = chart("m", levels, find_knee(levels))
+    throughput, latency = spec["hconcat"]
+    points = throughput["layer"][0]["data"]["values"]
+    assert [p["concurrency"] for p in points] == [1, 2, 4]
+    assert (points[2]["rps"], points[2]["error_rate"]) == (0.0, 1.0)
+    assert latency["layer"][1]["data"]["values"] == [{"concurrency": 4, "errors": 16}]
+    assert {r["concurrency"] for r in spec["data"]["values"]} == {1, 2}
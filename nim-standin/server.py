@@ -0,0 +1,427 @@
+"""
+A local stand-in for the NIM endpoints used by the example flows.
+
+    python server.py --port 8000 --profile default
+
+serves, on CPU and without any model weights:
+
+ - POST /v1/chat/completions  (blocking and `stream: true`), for the llama3 models
+ - POST /v1/embeddings        for nv-embedqa
+ - POST /v1/ranking           for nv-rerankqa
+ - GET  /v1/models, /v1/health/ready and /stats
+
+Latency, concurrency and failures follow a profile from profiles.json (or a
+JSON file given by path). Per model, or for every model under "*":
+
+    ttft             {"median": s, "sigma": s} lognormal time before the first token
+    per_token        seconds per generated token (chat) or per input token
+    max_concurrency  requests served at once; the rest wait in a queue
+    max_queue        waiting requests beyond which the server answers 429
+    error_rate       fraction of requests failing with 500
+    throttle_rate    fraction of requests rejected with 429
+    dim              embedding dimension
+    logprob_mean     mean negative logprob of a token, when logprobs are requested
+    prefill_per_token    seconds per prompt token not found in the prefix cache
+    prefix_cache_blocks  prompt blocks of PREFIX_BLOCK_CHARS kept in an LRU prefix
+                         cache, 0 for none; cached prompt tokens are reported in
+                         usage.prompt_tokens_details.cached_tokens
+
+Responses are deterministic functions of the request: embeddings hash words
+into buckets, so texts sharing words are similar, and rankings score word
+overlap, which keeps retrieval and reranking benchmarks meaningful.
+Point the flows at the server with NIM_BASE_URL (see common/nim_client.py).
+"""
+from argparse import ArgumentParser
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORDS = (
+    "the a dragon princess castle garbage collector memory heap tale once upon "
+    "time brave clever kingdom night fire gold tower quiet pointer sweep mark "
+    "free young old forest river happy ending and of to in with was"
+).split()
+DEFAULTS = {
+    "ttft": {"median": 0.0, "sigma": 0.0},
+    "per_token": 0.0,
+    "max_concurrency": 64,
+    "max_queue": 256,
+    "error_rate": 0.0,
+    "throttle_rate": 0.0,
+    "dim": 1024,
+    "logprob_mean": 0.05,
+    "prefill_per_token": 0.0,
+    "prefix_cache_blocks": 0,
+}
+# 16 tokens at count_tokens' 4 characters per token
+PREFIX_BLOCK_CHARS = 64
+
+
+def load_profile(name):
+    path = name if os.path.exists(name) else os.path.join(HERE, "profiles.json")
+    with open(path) as f:
+        profiles = json.load(f)
+    return profiles if os.path.exists(name) else profiles[name]
+
+
+def count_tokens(text):
+    return max(1, math.ceil(len(text) / 4))
+
+
+def tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class Limiter(object):
+    """A slot limit with a bounded queue of waiting requests."""
+
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            if self.active >= self.max_concurrency and self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            while self.active >= self.max_concurrency:
+                self.cond.wait()
+            self.waiting -= 1
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+
+class PrefixCache(object):
+    """
+    Automatic prefix caching as in vLLM: the prompt is split into blocks,
+    each identified by a hash of everything up to and including it, and a
+    request reuses the longest run of leading blocks already cached. Blocks
+    become available once the request that computed them is prefilled.
+    """
+
+    def __init__(self, max_blocks):
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def block_hashes(text):
+        h = hashlib.blake2b(digest_size=16)
+        hashes = []
+        for start in range(0, len(text) - PREFIX_BLOCK_CHARS + 1, PREFIX_BLOCK_CHARS):
+            h.update(text[start : start + PREFIX_BLOCK_CHARS].encode())
+            hashes.append(h.copy().digest())
+        return hashes
+
+    def lookup(self, hashes):
+        """Number of leading blocks that are cached."""
+        with self.lock:
+            for n, block in enumerate(hashes):
+                if block not in self.blocks:
+                    return n
+                self.blocks.move_to_end(block)
+            return len(hashes)
+
+    def insert(self, hashes):
+        with self.lock:
+            for block in hashes:
+                self.blocks[block] = True
+                self.blocks.move_to_end(block)
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+
+
+def prompt_text(messages):
+    return "".join(f"<|{m.get('role')}|>{m.get('content', '')}" for m in messages)
+
+
+class ModelSim(object):
+    def __init__(self, name, config, seed):
+        self.name = name
+        self.config = dict(DEFAULTS, **config)
+        self.limiter = Limiter(self.config["max_concurrency"], self.config["max_queue"])
+        self.rng = random.Random(f"{seed}:{name}")
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+        self.prefix_cache = None
+        if self.config["prefix_cache_blocks"]:
+            self.prefix_cache = PrefixCache(self.config["prefix_cache_blocks"])
+            self.stats.update(prompt_tokens=0, cached_tokens=0)
+
+    def draw(self):
+        """Sample the fate of a request: (status, ttft)."""
+        ttft = self.config["ttft"]
+        with self.lock:
+            self.stats["requests"] += 1
+            u = self.rng.random()
+            delay = 0.0
+            if ttft["median"] > 0:
+                delay = ttft["median"] * math.exp(self.rng.gauss(0, ttft["sigma"]))
+        if u < self.config["throttle_rate"]:
+            return 429, 0.0
+        if u < self.config["throttle_rate"] + self.config["error_rate"]:
+            return 500, 0.0
+        return 200, delay
+
+
+def request_rng(payload):
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).digest()
+    return random.Random(digest)
+
+
+def value_for_schema(schema, rng):
+    kind = schema.get("type")
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if kind == "object":
+        return {k: value_for_schema(v, rng) for k, v in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [value_for_schema(schema.get("items", {}), rng)]
+    if kind in ("number", "integer"):
+        return rng.randint(1, 5)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return " ".join(rng.choice(WORDS) for _ in range(2)).title()
+
+
+def completion_text(payload, rng):
+    nvext = payload.get("nvext") or {}
+    if nvext.get("guided_choice"):
+        return [rng.choice(nvext["guided_choice"])]
+    if nvext.get("guided_json"):
+        return [json.dumps(value_for_schema(nvext["guided_json"], rng))]
+    max_tokens = payload.get("max_tokens") or 128
+    n = rng.randint(max(1, max_tokens // 2), max_tokens)
+    return [("" if i == 0 else " ") + rng.choice(WORDS) for i in range(n)]
+
+
+def embed(text, dim):
+    vec = [0.0] * dim
+    for word in tokens(text):
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "big")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "nim-standin/0.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            models = [{"id": m, "object": "model"} for m in self.server.known_models()]
+            self.send_json(200, {"object": "list", "data": models})
+        elif self.path == "/v1/health/ready":
+            self.send_json(200, {"object": "health.response", "message": "Service is ready."})
+        elif self.path == "/stats":
+            self.send_json(200, {m.name: m.stats for m in self.server.sims.values()})
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        routes = {
+            "/v1/chat/completions": self.chat,
+            "/v1/embeddings": self.embeddings,
+            "/v1/ranking": self.ranking,
+        }
+        if self.path not in routes:
+            return self.send_json(404, {"error": f"unknown path {self.path}"})
+        sim = self.server.sim(payload.get("model", "unknown"))
+        status, ttft = sim.draw()
+        if status == 429 or not sim.limiter.acquire():
+            with sim.lock:
+                sim.stats["throttled"] += 1
+            return self.send_json(
+                429, {"error": "Too many requests"}, headers={"Retry-After": "1"}
+            )
+        try:
+            if status == 500:
+                with sim.lock:
+                    sim.stats["errors"] += 1
+                return self.send_json(500, {"error": "Injected server error"})
+            time.sleep(ttft)
+            routes[self.path](sim, payload)
+        finally:
+            sim.limiter.release()
+
+    def chat(self, sim, payload):
+        rng = request_rng(payload)
+        prompt_tokens = sum(
+            count_tokens(str(m.get("content", ""))) for m in payload.get("messages", [])
+        )
+        pieces = completion_text(payload, rng)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+        }
+        cached_tokens = 0
+        if sim.prefix_cache is not None:
+            hashes = PrefixCache.block_hashes(prompt_text(payload.get("messages", [])))
+            cached_tokens = min(
+                prompt_tokens,
+                sim.prefix_cache.lookup(hashes) * PREFIX_BLOCK_CHARS // 4,
+            )
+            usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+            with sim.lock:
+                sim.stats["prompt_tokens"] += prompt_tokens
+                sim.stats["cached_tokens"] += cached_tokens
+        # prefill of the prompt tokens that were not cached
+        time.sleep(sim.config["prefill_per_token"] * (prompt_tokens - cached_tokens))
+        if sim.prefix_cache is not None:
+            sim.prefix_cache.insert(hashes)
+        head = {
+            "id": f"chatcmpl-{rng.getrandbits(64):x}",
+            "created": int(time.time()),
+            "model": sim.name,
+        }
+        per_token = sim.config["per_token"]
+        if not payload.get("stream"):
+            time.sleep(per_token * len(pieces))
+            message = {"role": "assistant", "content": "".join(pieces)}
+            choice = {"index": 0, "message": message, "finish_reason": "stop"}
+            if payload.get("logprobs"):
+                # mostly confident tokens with an occasional unsure one
+                choice["logprobs"] = {
+                    "content": [
+                        {"token": p, "logprob": -rng.expovariate(1 / sim.config["logprob_mean"])}
+                        for p in pieces
+                    ]
+                }
+            return self.send_json(
+                200,
+                dict(head, object="chat.completion", choices=[choice], usage=usage),
+            )
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(body):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+            data = b"data: " + body + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(per_token)
+            last = i == len(pieces) - 1
+            choice = {
+                "index": 0,
+                "delta": {"content": piece},
+                "finish_reason": "stop" if last else None,
+            }
+            event(dict(head, object="chat.completion.chunk", choices=[choice]))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            event(dict(head, object="chat.completion.chunk", choices=[], usage=usage))
+        event(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def embeddings(self, sim, payload):
+        texts = payload.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        n_tokens = sum(count_tokens(t) for t in texts)
+        time.sleep(sim.config["per_token"] * n_tokens)
+        data = [
+            {"index": i, "embedding": embed(t, sim.config["dim"]), "object": "embedding"}
+            for i, t in enumerate(texts)
+        ]
+        usage = {"prompt_tokens": n_tokens, "total_tokens": n_tokens}
+        self.send_json(
+            200, {"object": "list", "data": data, "model": sim.name, "usage": usage}
+        )
+
+    def ranking(self, sim, payload):
+        query = set(tokens(payload["query"]["text"]))
+        passages = [p["text"] for p in payload.get("passages", [])]
+        n_tokens = count_tokens(payload["query"]["text"]) * len(passages) + sum(
+            count_tokens(p) for p in passages
+        )
+        time.sleep(sim.config["per_token"] * n_tokens)
+        rankings = []
+        for i, text in enumerate(passages):
+            words = tokens(text)
+            overlap = sum(w in query for w in words) / math.sqrt(len(words) or 1)
+            rankings.append({"index": i, "logit": round(4 * overlap - 2, 4)})
+        rankings.sort(key=lambda r: r["logit"], reverse=True)
+        self.send_json(200, {"rankings": rankings})
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, profile, seed=0, verbose=False):
+        super().__init__(address, Handler)
+        self.profile = profile
+        self.seed = seed
+        self.verbose = verbose
+        self.sims = {}
+        self._lock = threading.Lock()
+
+    def known_models(self):
+        return [m for m in self.profile if m != "*"]
+
+    def sim(self, model):
+        with self._lock:
+            if model not in self.sims:
+                config = self.profile.get(model, self.profile.get("*", {}))
+                self.sims[model] = ModelSim(model, config, self.seed)
+            return self.sims[model]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--profile", default="default", help="Profile in profiles.json or a JSON file"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = StandinServer(
+        (args.host, args.port), load_profile(args.profile), args.seed, args.verbose
+    )
+    print(f"NIM stand-in serving profile {args.profile!r} on http://{args.host}:{args.port}")
+    print(f"export NIM_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
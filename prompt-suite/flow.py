@@ -0,0 +1,227 @@
+from metaflow import FlowSpec, step, nim, current, card, IncludeFile, Parameter
+from metaflow.cards import Markdown, Table
+import json
+import random
+
+MODELS = ["meta/llama3-8b-instruct", "meta/llama3-70b-instruct"]
+VARIANTS = ["shuffled", "grouped"]
+
+
+@nim(models=MODELS)
+class PromptSuiteFlow(FlowSpec):
+
+    prompts = IncludeFile(
+        "prompts",
+        default="prompts.jsonl",
+        help="JSON lines, each the arguments of one chat completion: messages "
+        "and optionally max_tokens",
+    )
+    model = Parameter("model", default=MODELS[0], help="Model the suite is sent to")
+    max_in_flight = Parameter(
+        "max_in_flight", default=8, help="Maximum number of requests in flight"
+    )
+    max_tokens = Parameter(
+        "max_tokens", default=32, help="Tokens per completion, unless a prompt sets it"
+    )
+    min_prefix_chars = Parameter(
+        "min_prefix_chars",
+        default=128,
+        help="Prompts sharing at least this many leading characters are sent together",
+    )
+    compare = Parameter(
+        "compare",
+        default=True,
+        type=bool,
+        help="Also send the suite in shuffled order and report the TTFT change",
+    )
+    isolate = Parameter(
+        "isolate",
+        default=True,
+        type=bool,
+        help="Start every prompt with a tag of the run and order, so neither order "
+        "is served from prefixes the other one or an earlier run left cached",
+    )
+    seed = Parameter("seed", default=0, help="Seed of the shuffled order")
+    prefix_cache_blocks = Parameter(
+        "prefix_cache_blocks",
+        default=0,
+        help="Prefix cache capacity of the server in blocks of 16 tokens, to estimate "
+        "hit ratios when it does not report cached tokens; 0 leaves them unavailable",
+    )
+
+    @step
+    def start(self):
+        from prefix_schedule import render, prefix_groups, shared_prefix
+        from nim_client import nim_models
+        from streaming import require_streaming
+
+        # the TTFT comparison and the release of grouped prompts at their
+        # leader's first token both need streamed responses
+        require_streaming(nim_models()[self.model])
+
+        self.suite = [json.loads(line) for line in self.prompts.splitlines() if line.strip()]
+        texts = [render(p["messages"]) for p in self.suite]
+        self.groups = prefix_groups(texts, self.min_prefix_chars)
+        self.group_prefix_chars = [shared_prefix(texts, g) for g in self.groups]
+        shared = sum(len(g) for g in self.groups if len(g) > 1)
+        print(
+            f"{len(self.suite)} prompts in {len(self.groups)} prefix groups, "
+            f"{shared} of them sharing a prefix of at least {self.min_prefix_chars} characters"
+        )
+        self.next(self.run)
+
+    @card(type="blank")
+    @step
+    def run(self):
+        from prefix_schedule import (
+            CHARS_PER_TOKEN,
+            render,
+            dispatch_grouped,
+            estimate_cached_chars,
+        )
+        from request_pool import map_concurrent
+        from streaming import stream_chat, percentile
+        from nim_client import nim_models
+        from card_report import bounded_rows
+        import telemetry
+
+        llm = nim_models()[self.model]
+        texts = [render(p["messages"]) for p in self.suite]
+
+        def sender(variant):
+            tag = f"[{current.run_id} {variant}] " if self.isolate else ""
+
+            def send(i, prefilled=None):
+                args = dict(self.suite[i])
+                args.setdefault("max_tokens", self.max_tokens)
+                first = dict(args["messages"][0])
+                first["content"] = tag + first["content"]
+                args["messages"] = [first] + args["messages"][1:]
+                response, metrics = stream_chat(
+                    llm, self.model, on_first_token=prefilled, **args
+                )
+                usage = response["usage"]
+                details = usage.get("prompt_tokens_details") or {}
+                return {
+                    "ttft": metrics["ttft"],
+                    "e2e": metrics["e2e"],
+                    "prompt_tokens": usage.get("prompt_tokens"),
+                    "cached_tokens": details.get("cached_tokens"),
+                }
+
+            return send
+
+        orders = {"grouped": [i for g in self.groups for i in g]}
+        if self.compare:
+            shuffled = list(range(len(self.suite)))
+            random.Random(self.seed).shuffle(shuffled)
+            orders["shuffled"] = shuffled
+
+        self.results = {}
+        self.report = {}
+        for variant in [v for v in VARIANTS if v in orders]:
+            if variant == "grouped":
+                results = dispatch_grouped(
+                    sender(variant), self.groups, max_in_flight=self.max_in_flight
+                )
+            else:
+                by_position = map_concurrent(
+                    sender(variant), orders[variant], max_in_flight=self.max_in_flight
+                )
+                results = [None] * len(self.suite)
+                for i, result in zip(orders[variant], by_position):
+                    results[i] = result
+            self.results[variant] = results
+
+            # reported cached tokens when the server has them, otherwise an
+            # estimate for a cache of --prefix_cache_blocks, if given
+            prompt_tokens = [
+                r["prompt_tokens"] or len(t) / CHARS_PER_TOKEN for r, t in zip(results, texts)
+            ]
+            hit_ratio, source = None, "unavailable"
+            if all(r["cached_tokens"] is not None for r in results):
+                cached = [r["cached_tokens"] for r in results]
+                hit_ratio, source = sum(cached) / max(1, sum(prompt_tokens)), "reported"
+            elif self.prefix_cache_blocks:
+                # grouped followers are sent once their leader is prefilled
+                waits_for = None
+                if variant == "grouped":
+                    waits_for = {i: g[0] for g in self.groups for i in g[1:]}
+                estimate = estimate_cached_chars(
+                    texts,
+                    orders[variant],
+                    self.prefix_cache_blocks,
+                    max_in_flight=self.max_in_flight,
+                    waits_for=waits_for,
+                )
+                cached = [min(p, c / CHARS_PER_TOKEN) for p, c in zip(prompt_tokens, estimate)]
+                hit_ratio, source = sum(cached) / max(1, sum(prompt_tokens)), "estimated"
+            ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+            self.report[variant] = {
+                "requests": len(results),
+                "prefix_cache_hit_ratio": hit_ratio,
+                "hit_ratio_source": source,
+                "ttft_mean": sum(ttfts) / len(ttfts) if ttfts else None,
+                "ttft_p50": percentile(ttfts, 50),
+                "ttft_p95": percentile(ttfts, 95),
+            }
+            print(variant, self.report[variant])
+
+        if self.compare:
+            before, after = self.report["shuffled"], self.report["grouped"]
+            self.ttft_change = {
+                q: after[q] / before[q] - 1 if before[q] else None
+                for q in ("ttft_mean", "ttft_p50", "ttft_p95")
+            }
+            print("TTFT change, grouped against shuffled:", self.ttft_change)
+        self.telemetry = telemetry.snapshot(reset=True)
+
+        current.card.append(
+            Markdown(
+                f"## Prompt suite on {self.model}\n"
+                f"{len(self.suite)} prompts in {len(self.groups)} prefix groups, "
+                f"{self.max_in_flight} requests in flight"
+            )
+        )
+        headers = ["Order", "Hit ratio", "Source", "TTFT mean (s)", "TTFT p50 (s)", "TTFT p95 (s)"]
+        rows = []
+        for variant, r in self.report.items():
+            ratio = r["prefix_cache_hit_ratio"]
+            rows.append(
+                [variant, None if ratio is None else round(ratio, 3), r["hit_ratio_source"]]
+                + [None if r[q] is None else round(r[q], 4) for q in ("ttft_mean", "ttft_p50", "ttft_p95")]
+            )
+        current.card.append(Table(headers=headers, data=rows))
+        if self.compare:
+            current.card.append(
+                Markdown(
+                    "TTFT change, grouped against shuffled: "
+                    + ", ".join(
+                        f"{q} {v:+.1%}" for q, v in self.ttft_change.items() if v is not None
+                    )
+                )
+            )
+        groups = sorted(
+            zip(self.groups, self.group_prefix_chars), key=lambda g: -len(g[0]) * g[1]
+        )
+        rows, caption = bounded_rows(
+            [[len(g), chars, texts[g[0]][:chars]] for g, chars in groups if len(g) > 1],
+            max_rows=20,
+        )
+        current.card.append(Markdown(f"### Shared prefixes\n{caption}"))
+        current.card.append(Table(headers=["Prompts", "Characters", "Prefix"], data=rows))
+        self.next(self.end)
+
+    @step
+    def end(self):
+        for variant, r in self.report.items():
+            ratio = r["prefix_cache_hit_ratio"]
+            print(
+                f"{variant}: prefix cache hit ratio "
+                f"{'n/a' if ratio is None else f'{ratio:.1%}'} "
+                f"({r['hit_ratio_source']}), TTFT p50 {r['ttft_p50'] or 0:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    PromptSuiteFlow()
@@ -0,0 +1,162 @@
+"""
+Grouping, ordering and dispatch of chat prompts by shared prefix.
+
+LLM servers with automatic prefix caching (vLLM, TensorRT-LLM, and so the
+NIM containers built on them) keep the KV cache of recent prompts in fixed
+size blocks and skip the prefill of any leading blocks a new prompt shares
+with a cached one. A long fixed system prompt or instruction is then only
+prefilled once, provided the requests sharing it arrive while it is still
+cached, and after the first of them was prefilled.
+
+`prefix_groups` sorts the prompts by their rendered text, which puts prompts
+with a common prefix next to each other, and cuts the order wherever
+neighbours share less than `min_prefix_chars`. `dispatch_grouped` sends the
+groups in that order: the first prompt of a group alone, the rest as soon as
+it has been prefilled, so that they find its prefix cached.
+
+When the server does not report cached tokens, `estimate_cached_chars`
+replays an order against an LRU block cache of a given capacity, in which a
+prompt's blocks are only cached once it has been prefilled, not while the
+prompts sent right after it are already in flight.
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import queue
+
+MIN_PREFIX_CHARS = 128
+# count_tokens in the stand-in server and shard_planner use 4 characters per token
+CHARS_PER_TOKEN = 4
+# vLLM's default KV cache block of 16 tokens
+BLOCK_CHARS = 16 * CHARS_PER_TOKEN
+
+
+def render(messages):
+    """The text of a chat prompt in the order the model reads it."""
+    return "".join(f"<|{m['role']}|>{m['content']}" for m in messages)
+
+
+def common_prefix(a, b):
+    return len(os.path.commonprefix([a, b]))
+
+
+def prefix_groups(texts, min_prefix_chars=MIN_PREFIX_CHARS):
+    """
+    Indices of `texts` in groups that share a prefix of at least
+    `min_prefix_chars`, each sorted by text, and the groups in sorted order.
+    A prompt that shares no long prefix is a group of its own.
+    """
+    order = sorted(range(len(texts)), key=lambda i: texts[i])
+    groups = []
+    for prev, i in zip([None] + order, order):
+        if prev is not None and common_prefix(texts[prev], texts[i]) >= min_prefix_chars:
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    return groups
+
+
+def shared_prefix(texts, group):
+    """Characters shared by every prompt of a sorted group."""
+    return common_prefix(texts[group[0]], texts[group[-1]])
+
+
+def block_hashes(text, block_chars=BLOCK_CHARS):
+    """One hash per full block of `text`, of everything up to its end."""
+    h = hashlib.blake2b(digest_size=16)
+    hashes = []
+    for start in range(0, len(text) - block_chars + 1, block_chars):
+        h.update(text[start : start + block_chars].encode())
+        hashes.append(h.copy().digest())
+    return hashes
+
+
+def estimate_cached_chars(
+    texts, order, capacity_blocks, max_in_flight=1, waits_for=None, block_chars=BLOCK_CHARS
+):
+    """
+    For every prompt sent in `order`, the characters of its prefix found in
+    an LRU cache of `capacity_blocks` blocks of `block_chars` characters.
+
+    A prompt's blocks are cached once it has been prefilled, which is taken
+    to be when the prompt `max_in_flight` places after it is sent, or, for a
+    prompt `i` in `waits_for`, before `waits_for[i]` is sent (see
+    `dispatch_grouped`). Both the order and the overlap of requests in
+    flight change the estimate.
+    """
+    cache = OrderedDict()
+    hashes = {}
+    in_flight = deque()
+    cached = [0] * len(texts)
+
+    def insert(j):
+        for block in hashes.pop(j, []):
+            cache[block] = True
+            cache.move_to_end(block)
+        while len(cache) > capacity_blocks:
+            cache.popitem(last=False)
+
+    for i in order:
+        if waits_for and i in waits_for:
+            insert(waits_for[i])
+        while len(in_flight) >= max(1, max_in_flight):
+            insert(in_flight.popleft())
+        hashes[i] = block_hashes(texts[i], block_chars)
+        hit = 0
+        for block in hashes[i]:
+            if block not in cache:
+                break
+            cache.move_to_end(block)
+            hit += 1
+        cached[i] = hit * block_chars
+        in_flight.append(i)
+    return cached
+
+
+def dispatch_grouped(fn, groups, max_in_flight=8, on_result=None):
+    """
+    Call `fn(idx, prefilled)` for the indices of `groups` with at most
+    `max_in_flight` calls outstanding, and return the results by index.
+
+    The first index of a group is sent on its own. `fn` calls `prefilled()`
+    once the server has prefilled its prompt, at its first streamed token,
+    and the rest of the group is then queued ahead of everything else; if it
+    never does, when the call completes. A new group is only started when no
+    prompt of a started group is waiting, so prompts sharing a prefix are
+    sent back to back.
+    """
+    n = sum(len(g) for g in groups)
+    results = [None] * n
+    pending = deque(groups)
+    ready = deque()
+    followers = {}
+    events = queue.Queue()
+
+    def release(idx):
+        ready.extendleft(reversed(followers.pop(idx, [])))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        in_flight = set()
+        while pending or ready or in_flight:
+            while len(in_flight) < max_in_flight and (ready or pending):
+                if ready:
+                    idx = ready.popleft()
+                else:
+                    group = pending.popleft()
+                    idx = group[0]
+                    followers[idx] = group[1:]
+                in_flight.add(idx)
+                future = pool.submit(fn, idx, lambda idx=idx: events.put((idx, None)))
+                future.add_done_callback(lambda f, idx=idx: events.put((idx, f)))
+            # a call's prefilled event always comes before its completion
+            idx, future = events.get()
+            if future is None:
+                release(idx)
+                continue
+            in_flight.discard(idx)
+            results[idx] = future.result()
+            release(idx)
+            if on_result is not None:
+                on_result(idx, results[idx])
+    return results
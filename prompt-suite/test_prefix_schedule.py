@@ -0,0 +1,118 @@
+import json
+import os
+import random
+import threading
+
+import pytest
+
+from prefix_schedule import (
+    BLOCK_CHARS,
+    dispatch_grouped,
+    estimate_cached_chars,
+    prefix_groups,
+    render,
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def suite(n_groups=6, per_group=5, prefix_blocks=8):
+    texts = []
+    for g in range(n_groups):
+        prefix = f"group {g} ".ljust(prefix_blocks * BLOCK_CHARS, chr(ord("a") + g))
+        texts.extend(f"{prefix} question {q}" for q in range(per_group))
+    return texts
+
+
+def hit_ratio(texts, order, capacity, **kwargs):
+    cached = estimate_cached_chars(texts, order, capacity, **kwargs)
+    return sum(cached) / sum(len(t) for t in texts)
+
+
+def test_prompts_sharing_a_prefix_are_grouped():
+    texts = suite(n_groups=3, per_group=2)
+    groups = prefix_groups(texts, min_prefix_chars=BLOCK_CHARS)
+    assert sorted(map(sorted, groups)) == [[0, 1], [2, 3], [4, 5]]
+
+
+def test_the_estimate_depends_on_the_order():
+    texts = suite()
+    grouped = list(range(len(texts)))
+    shuffled = grouped[:]
+    random.Random(0).shuffle(shuffled)
+    # room for the prefixes of two groups at a time
+    capacity = 2 * 9
+    assert hit_ratio(texts, grouped, capacity) > hit_ratio(texts, shuffled, capacity)
+    # a cache holding everything only misses every group's first prompt
+    assert hit_ratio(texts, grouped, 10**6) == hit_ratio(texts, shuffled, 10**6)
+
+
+def test_prompts_in_flight_together_share_nothing():
+    texts = suite(n_groups=2, per_group=4)
+    groups = prefix_groups(texts)
+    order = [i for g in groups for i in g]
+    assert hit_ratio(texts, order, 10**6, max_in_flight=4) < hit_ratio(texts, order, 10**6)
+    # unless they wait for the first of their group to be prefilled
+    waits_for = {i: g[0] for g in groups for i in g[1:]}
+    assert hit_ratio(texts, order, 10**6, max_in_flight=4, waits_for=waits_for) == hit_ratio(
+        texts, order, 10**6
+    )
+
+
+def test_the_shipped_suite_favours_grouping():
+    with open(os.path.join(HERE, "prompts.jsonl")) as f:
+        texts = [render(json.loads(line)["messages"]) for line in f if line.strip()]
+    groups = prefix_groups(texts)
+    grouped = [i for g in groups for i in g]
+    waits_for = {i: g[0] for g in groups for i in g[1:]}
+    shuffled = list(range(len(texts)))
+    random.Random(0).shuffle(shuffled)
+    assert hit_ratio(texts, grouped, 64, max_in_flight=8, waits_for=waits_for) > hit_ratio(
+        texts, shuffled, 64, max_in_flight=8
+    )
+
+
+def test_followers_are_sent_once_the_leader_is_prefilled():
+    follower_sent = threading.Event()
+    overlapped = []
+
+    def send(idx, prefilled):
+        if idx == 0:
+            prefilled()
+            # still decoding when the rest of the group starts
+            overlapped.append(follower_sent.wait(5))
+        else:
+            follower_sent.set()
+        return idx * 10
+
+    assert dispatch_grouped(send, [[0, 1, 2], [3]], max_in_flight=4) == [0, 10, 20, 30]
+    assert overlapped == [True]
+
+
+def test_followers_wait_for_a_leader_that_never_reports_prefill():
+    started, finished = [], []
+
+    def send(idx, prefilled):
+        started.append((idx, list(finished)))
+        finished.append(idx)
+        return idx
+
+    seen = []
+    results = dispatch_grouped(
+        send, [[0, 1], [2]], max_in_flight=4, on_result=lambda i, r: seen.append(i)
+    )
+    assert results == [0, 1, 2]
+    # sent only after its leader completed
+    assert 0 in dict(started)[1]
+    assert sorted(seen) == [0, 1, 2]
+
+
+def test_the_suite_needs_a_streaming_client():
+    from nim_client import EndpointModels
+    from streaming import require_streaming
+
+    model = "meta/llama3-8b-instruct"
+    handle = EndpointModels(handles={model: lambda **kwargs: {}})[model]
+    with pytest.raises(RuntimeError, match="NIM_BASE_URL"):
+        require_streaming(handle)
+    require_streaming(EndpointModels("http://127.0.0.1:1")[model])
@@ -1,4 +1,4 @@
-from metaflow import FlowSpec, step, current, card, Parameter, pypi, nim
+from metaflow import FlowSpec, step, current, card, Parameter, pypi, nim, retry
 from metaflow.cards import Table, VegaChart, Markdown, ProgressBar
 import time
 
@@ -18,114 +18,209 @@ class Rerank(FlowSpec):
         name="max_parallel",
         default=5,
         type=int,
-        help="Maximum number of concurrent requests"
+        help="Number of foreach tasks the dataset is split across"
     )
     max_per_batch = Parameter(
         name="max_per_batch",
         default=50,
         type=int,
-        help="Maximum number of queries per batch"
+        help="Maximum number of queries a task reads and checkpoints at once; a task "
+        "works through as many of these batches as its shard needs"
+    )
+    in_flight = Parameter(
+        name="in_flight",
+        default=8,
+        type=int,
+        help="Number of rerank requests each task keeps open against the NIM endpoint, "
+        "or the starting number with --adaptive"
+    )
+    adaptive = Parameter(
+        name="adaptive",
+        default=False,
+        type=bool,
+        help="Adapt the number of open requests to the endpoint's latency and throttling"
+    )
+    in_flight_cap = Parameter(
+        name="in_flight_cap",
+        default=64,
+        type=int,
+        help="Upper bound of the adaptive number of open requests"
+    )
+    checkpoint_every = Parameter(
+        name="checkpoint_every",
+        default=10,
+        type=int,
+        help="Save finished rerank results every this many queries, so a retry resumes"
+    )
+    card_refresh_interval = Parameter(
+        name="card_refresh_interval",
+        default=2.0,
+        type=float,
+        help="Minimum number of seconds between progress card refreshes"
     )
     model = MODELS[0]
 
-    @pypi(packages={'pandas': '2.2.2', 'pyarrow': '17.0.0', 'huggingface_hub': '0.24.2'})
+    @pypi(packages={'pyarrow': '17.0.0', 'huggingface_hub': '0.24.2'})
     @step
     def start(self):
-        import pandas as pd
+        from parquet_slices import open_parquet, plan_row_slices
 
         splits = {
             'test': 'data/test-00000-of-00001.parquet', 
             'eval': 'data/eval-00000-of-00001.parquet', 
             'dev': 'data/test-00000-of-00001.parquet'
         }
-        # self.df = pd.read_parquet("hf://datasets/jinaai/hotpotqa-reranking-en/" + splits["dev"])
-        # df_eval = pd.read_parquet("hf://datasets/jinaai/hotpotqa-reranking-en/" + splits["eval"])
-        self.df = pd.read_parquet("hf://datasets/jinaai/hotpotqa-reranking-en/" + splits["test"])
-
-        def batch_dataframe(dataframe, batch_size, max_batches=None):
-            num_batches = len(dataframe) // batch_size + (1 if len(dataframe) % batch_size != 0 else 0)
-            batches = [dataframe[i*batch_size:(i+1)*batch_size] for i in range(num_batches)]
-            if max_batches:
-                return batches[:max_batches]
-            return batches
-
-        if self.max_per_batch is not None:
-            n_per_batch = self.max_per_batch
-        else:
-            n_per_batch = (self.df.shape[0] // self.max_parallel) + 1
-        self.batch = batch_dataframe(self.df, n_per_batch, self.max_parallel)
-    
+        self.parquet_url = f"hf://datasets/{self.dataset}/" + splits["test"]
+
+        # only the Parquet footer is read here: every task gets row ranges of
+        # the whole dataset, balanced by compressed size, and reads them itself
+        shards, loads, self.n_rows = plan_row_slices(
+            open_parquet(self.parquet_url), self.max_parallel, self.max_per_batch
+        )
+        # every task carries its planned cost, compared with its time in the join
+        self.batch = [
+            {"slices": slices, "cost": cost} for slices, cost in zip(shards, loads)
+        ]
+        print(f"{self.n_rows} queries in {len(self.batch)} shards")
+
         self.next(self.rerank, foreach='batch')
 
     @card(type='blank', id='progress', refresh_interval=1)
-    @pypi(packages={'numpy': '2.0.1', 'pandas': '2.2.2'})
+    @retry(times=2)
+    @pypi(packages={'pyarrow': '17.0.0', 'huggingface_hub': '0.24.2'})
     @step
     def rerank(self):
-        import requests
-        import pandas as pd
-        
-        headers = {
-            "accept": "application/json",
-            "Content-Type": "application/json"
-        }
-        pbar = ProgressBar(max=len(self.input), label="Queries completed")
+        from request_pool import timed
+        from checkpoint import TaskCheckpoint, resumable_map
+        from parquet_slices import open_parquet, iter_slices
+        from reranking import rerank_request, ranked_indices
+        from nim_client import nim_models
+        from adaptive_limit import AIMDLimit, trajectory_spec
+        from card_report import Refresher, bounded_rows
+        import telemetry
+
+        n_queries = sum(length for _, _, length in self.input["slices"])
+        pbar = ProgressBar(max=n_queries, label="Queries completed")
         current.card['progress'].append(pbar)
-        current.card['progress'].refresh()
+        in_flight = self.in_flight
+        if self.adaptive:
+            # one limit for the whole task, so it carries over between batches
+            in_flight = AIMDLimit(initial=self.in_flight, max_limit=self.in_flight_cap)
+            limit_chart = VegaChart(trajectory_spec(in_flight.trajectory))
+            current.card['progress'].append(limit_chart)
+
+        completed = 0
+        plotted = 1
+        def render():
+            nonlocal plotted
+            pbar.update(completed)
+            if self.adaptive and len(in_flight.trajectory) != plotted:
+                plotted = len(in_flight.trajectory)
+                limit_chart.update(trajectory_spec(in_flight.trajectory))
+
+        # rendering and uploading the card costs the same whether one query
+        # or a thousand finished since the last refresh
+        refresh = Refresher(current.card['progress'], self.card_refresh_interval, render)
+        refresh(force=True)
+
+        # with --adaptive, throttled requests are retried by map_concurrent,
+        # which reports them to the limit, not by the client
+        llm = nim_models(retry_throttled=not self.adaptive)[self.model]
+
+        def send(row):
+            query, passages = row
+            request_data = rerank_request(query, passages)
+            res_json, elapsed = timed(llm, **request_data)
+            request_data['client-e2e-time'] = elapsed
+            request_data['rankings'] = res_json['rankings']
+            return request_data
+
+        def progress(i, result):
+            nonlocal completed
+            completed += 1
+            refresh()
+
         self.exp_tracking_data = []
-        for i, (index, row) in enumerate(self.input.iterrows()):      
-            request_data = {
-                "query": {"text": row.query},
-                "passages": [{"text": p} for p in row.positive],
-                "truncate": "END"
-            }
-            t0 = time.time()
-            res_json = current.nim.models[self.model](**request_data)
-            # API Reference: https://docs.nvidia.com/nim/nemo-retriever/text-reranking/latest/reference.html
-            tf = time.time()
-            pbar.update(i+1)
-            current.card['progress'].refresh()
-            _df = request_data
-            _df['client-e2e-time'] = tf - t0
-            _df['rankings'] = res_json['rankings']
-            self.exp_tracking_data.append(_df)
+        # the planner's cost, in compressed bytes, not recomputed from the rows
+        self.shard_cost = self.input["cost"]
+        t0 = time.time()
+        batches = iter_slices(
+            open_parquet(self.parquet_url),
+            self.input["slices"],
+            columns=['query', 'positive'],
+            batch_size=self.max_per_batch,
+        )
+        for k, table in enumerate(batches):
+            rows = list(zip(
+                table.column('query').to_pylist(), table.column('positive').to_pylist()
+            ))
+            # keep up to `in_flight` requests open (a limit that adapts with
+            # --adaptive); results come back out of order
+            # and are returned in the original row order. Queries finished by a
+            # failed attempt of this task are restored instead of sent again.
+            checkpoint = TaskCheckpoint(self, every=self.checkpoint_every, name=f"batch-{k}")
+            self.exp_tracking_data.extend(
+                resumable_map(
+                    send,
+                    rows,
+                    checkpoint,
+                    max_in_flight=in_flight,
+                    on_result=progress,
+                )
+            )
+        self.shard_seconds = time.time() - t0
+        # the join's card merges these samples instead of loading every
+        # task's full trace, passages included
+        self.trace_rows = len(self.exp_tracking_data)
+        self.trace_sample, _ = bounded_rows([
+            [
+                row['query']['text'],
+                len(row['passages']),
+                (ranked_indices(row) or [None])[0],
+                row['client-e2e-time'],
+            ]
+            for row in self.exp_tracking_data
+        ])
+        refresh(force=True)
+        if self.adaptive:
+            self.in_flight_trajectory = in_flight.trajectory
+            print("Adaptive in-flight limit:", in_flight.summary())
+        self.telemetry = telemetry.snapshot(reset=True)
         self.next(self.join)
 
     @card(type='blank', id='exp_track_task')
-    @pypi(packages={'numpy': '2.0.1', 'pandas': '2.2.2', 'altair': '5.3.0'})
+    @pypi(packages={'numpy': '2.0.1', 'pandas': '2.2.2'})
     @step
     def join(self, inputs):
-        import pandas as pd
-        import altair as alt
+        from shard_planner import balance_report, format_report
+        from telemetry import merge, histogram, histogram_spec, summary_table
+        from card_report import merge_samples
 
-        self.exp_tracking_data = pd.concat([
-            pd.DataFrame(i.exp_tracking_data)
-            for i in inputs
-        ])
-        bar = alt.Chart(self.exp_tracking_data).mark_boxplot().encode(
-            alt.X('client-e2e-time:Q').title('Client end-to-end time (s)')
-        )
-        text_min = alt.Chart(self.exp_tracking_data).mark_text(align='right', dx=-5).encode(
-            x='min(client-e2e-time):Q',
-            text=alt.Text('min(client-e2e-time):Q', format='.2f')
-        )
-        text_max = alt.Chart(self.exp_tracking_data).mark_text(align='left', dx=5).encode(
-            x='max(client-e2e-time):Q',
-            text=alt.Text('max(client-e2e-time):Q', format='.2f')
-        )
-        usage_plot = (bar + text_min + text_max).properties(
-            title=alt.Title(text=f"Reranking usage stats of {self.model}", subtitle=f'Based on {len(self.exp_tracking_data)} observations'),
-            width=250,
-            height=25
+        self.shard_balance = balance_report(
+            [i.shard_cost for i in inputs], [i.shard_seconds for i in inputs]
         )
+        print(format_report(self.shard_balance))
+        # request latencies come from the tasks' merged histograms, not the rows
+        self.telemetry = merge(i.telemetry for i in inputs)
+        latency = histogram(self.telemetry, self.model)
         current.card['exp_track_task'].append(
             Markdown("### Usage metrics")
         )
-        current.card['exp_track_task'].append(VegaChart.from_altair_chart(usage_plot))
-        current.card['exp_track_task'].append(Markdown("### Reranking Trace"))
+        headers, data = summary_table(self.telemetry)
+        current.card['exp_track_task'].append(Table(headers=headers, data=data))
+        current.card['exp_track_task'].append(VegaChart(histogram_spec(latency)))
         current.card['exp_track_task'].append(
-            Table.from_dataframe(
-                pd.DataFrame(self.exp_tracking_data)
-            )
+            Markdown(f"Foreach balance: {format_report(self.shard_balance)}")
+        )
+        # the full trace, passages included, stays in the exp_tracking_data
+        # artifacts of the rerank tasks and is never loaded here; the card
+        # shows the tasks' bounded samples of it
+        rows, caption = merge_samples(
+            [i.trace_sample for i in inputs], [i.trace_rows for i in inputs]
+        )
+        current.card['exp_track_task'].append(Markdown(f"### Reranking Trace\n{caption}"))
+        current.card['exp_track_task'].append(
+            Table(headers=['Query', 'Passages', 'Top passage', 'Client end-to-end time (s)'], data=rows)
         )
         self.next(self.end)
 
@@ -0,0 +1 @@
+../common/parquet_slices.py
\ No newline at end of file
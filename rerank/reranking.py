@@ -0,0 +1 @@
+../common/reranking.py
\ No newline at end of file
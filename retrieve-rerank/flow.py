@@ -0,0 +1,253 @@
+from metaflow import FlowSpec, step, current, card, Parameter, pypi, nim
+from metaflow.cards import Markdown, Table
+
+EMBEDDING_MODEL = "nvidia/nv-embedqa-mistral-7b-v2"
+RERANK_MODEL = "nvidia/nv-rerankqa-mistral-4b-v3"
+
+
+@nim(models=[EMBEDDING_MODEL, RERANK_MODEL])
+class RetrieveRerank(FlowSpec):
+
+    dataset = Parameter(
+        name="data",
+        default="jinaai/hotpotqa-reranking-en",
+        help="Name of HuggingFace Hub dataset",
+    )
+    max_queries = Parameter(
+        "max_queries", default=200, help="Number of queries to evaluate; 0 for all"
+    )
+    batch_size = Parameter("-bsz", default=10, help="Passages per embedding request")
+    retrieve_k = Parameter(
+        "retrieve_k", default=100, help="Candidates retrieved per query by similarity"
+    )
+    rerank_candidates = Parameter(
+        "rerank_candidates",
+        default=20,
+        help="Maximum number of retrieved passages sent to the reranker per query",
+    )
+    similarity_margin = Parameter(
+        "similarity_margin",
+        default=0.0,
+        help="If > 0, only rerank candidates within this cosine similarity of a "
+        "query's best candidate, so easy queries send smaller payloads",
+    )
+    eval_k = Parameter("eval_k", default=5, help="Cutoff for recall@k")
+    in_flight = Parameter(
+        "in_flight", default=8, help="Rerank requests kept open at once"
+    )
+    cache_path = Parameter(
+        "cache",
+        default="~/.cache/nim-examples/embeddings.sqlite",
+        help="Embedding cache file on local disk, shared across local runs (not "
+        "persisted by @kubernetes/@batch tasks); pass '' to disable",
+    )
+    cache_max_mb = Parameter(
+        "cache_max_mb", default=2048, help="Size bound of the embedding cache in MiB"
+    )
+    corpus_file = "corpus.npy"
+
+    @pypi(
+        packages={"pandas": "2.2.2", "pyarrow": "17.0.0", "huggingface_hub": "0.24.2"}
+    )
+    @step
+    def start(self):
+        import pandas as pd
+
+        df = pd.read_parquet(
+            f"hf://datasets/{self.dataset}/data/test-00000-of-00001.parquet"
+        )
+        if self.max_queries < 0:
+            raise ValueError(
+                f"--max_queries must be 0 for all or positive, not {self.max_queries}"
+            )
+        if self.max_queries:
+            df = df.head(self.max_queries)
+        if df.empty:
+            # retrieve and rerank have nothing to size or time
+            raise ValueError(f"{self.dataset} has no queries to evaluate")
+
+        # the corpus is every distinct passage of the selected queries; each
+        # query keeps the ids of its positive passages for evaluation
+        corpus = {}
+        self.relevant = []
+        for positive, negative in zip(df["positive"], df["negative"]):
+            for passage in list(positive) + list(negative):
+                corpus.setdefault(passage, len(corpus))
+            self.relevant.append([corpus[p] for p in positive])
+        self.queries = df["query"].tolist()
+        self.corpus = list(corpus)
+        print(f"{len(self.queries)} queries over {len(self.corpus)} passages")
+
+        self.batch = [
+            self.corpus[i : i + self.batch_size]
+            for i in range(0, len(self.corpus), self.batch_size)
+        ]
+        self.next(self.embed, foreach="batch")
+
+    @step
+    def embed(self):
+        from embedding_cache import embed_batch
+        from nim_client import nim_models
+        import telemetry
+
+        self.text_batch = self.input
+        vectors, self.usage_stats = embed_batch(
+            nim_models()[EMBEDDING_MODEL],
+            EMBEDDING_MODEL,
+            "passage",
+            self.text_batch,
+            cache=self._embedding_cache(),
+        )
+        # an empty batch has no vectors to take the dimension from
+        self.embedding_dim = len(vectors[0]) // 4 if vectors else 0
+        self.embeddings = b"".join(vectors)
+        self.telemetry = telemetry.snapshot(reset=True)
+        self.next(self.join)
+
+    @pypi(packages={"numpy": "2.0.1", "pandas": "2.2.2"})
+    @step
+    def join(self, inputs):
+        from embedding_matrix import assemble_embeddings
+        from run_storage import RunStorage
+        from telemetry import merge
+
+        storage = RunStorage(self)
+        with storage.writer(self.corpus_file) as path:
+            assemble_embeddings(inputs, path)
+        self.corpus_key = storage.key(self.corpus_file)
+        self.stats = [batch_input.usage_stats for batch_input in inputs]
+        self.telemetry = merge(batch_input.telemetry for batch_input in inputs)
+        self.merge_artifacts(inputs, include=["queries", "corpus", "relevant"])
+        self.next(self.retrieve)
+
+    @pypi(packages={"numpy": "2.0.1", "pandas": "2.2.2"})
+    @step
+    def retrieve(self):
+        import numpy as np
+        from embedding_cache import embed_batch
+        from embedding_matrix import open_embeddings
+        from ivf_index import brute_force_search
+        from run_storage import RunStorage
+        from nim_client import nim_models
+        import telemetry
+
+        llm = nim_models()[EMBEDDING_MODEL]
+        cache = self._embedding_cache()
+        query_vectors = []
+        for i in range(0, len(self.queries), self.batch_size):
+            vectors, _ = embed_batch(
+                llm,
+                EMBEDDING_MODEL,
+                "query",
+                self.queries[i : i + self.batch_size],
+                cache=cache,
+            )
+            query_vectors.extend(vectors)
+        dim = len(query_vectors[0]) // 4
+        query_vectors = np.frombuffer(b"".join(query_vectors), dtype=np.float32)
+
+        corpus = open_embeddings(RunStorage(self).local_path(self.corpus_key))
+        scores, ids = brute_force_search(
+            corpus,
+            query_vectors.reshape(-1, dim),
+            k=self.retrieve_k,
+            normalized=False,
+        )
+        self.retrieved = ids.tolist()
+
+        # the rerank payload of each query is capped by rerank_candidates and,
+        # optionally, by how far a candidate trails the query's best match
+        self.rerank_payloads = []
+        for row_ids, row_scores in zip(ids, scores):
+            keep = row_ids[: self.rerank_candidates]
+            if self.similarity_margin > 0:
+                close = row_scores[: len(keep)] >= row_scores[0] - self.similarity_margin
+                keep = keep[close]
+            self.rerank_payloads.append(keep.tolist())
+        self.telemetry = telemetry.merge([self.telemetry, telemetry.snapshot(reset=True)])
+        self.next(self.rerank)
+
+    @card(type="blank", id="retrieval")
+    @pypi(packages={"numpy": "2.0.1", "pandas": "2.2.2"})
+    @step
+    def rerank(self):
+        import numpy as np
+        from request_pool import map_concurrent, timed
+        from reranking import rerank_request, ranked_indices
+        from nim_client import nim_models
+        import telemetry
+
+        def send(i):
+            candidates = self.rerank_payloads[i]
+            request_data = rerank_request(
+                self.queries[i], [self.corpus[c] for c in candidates]
+            )
+            res_json, elapsed = timed(nim_models()[RERANK_MODEL], **request_data)
+            order = [candidates[j] for j in ranked_indices(res_json)]
+            return {
+                "reranked": order,
+                "passages": len(candidates),
+                "client-e2e-time": elapsed,
+            }
+
+        self.rerank_trace = map_concurrent(
+            send, range(len(self.queries)), max_in_flight=self.in_flight
+        )
+        self.reranked = [t["reranked"] for t in self.rerank_trace]
+
+        def recall(rankings, k):
+            return float(
+                np.mean(
+                    [
+                        len(set(r[:k]) & set(rel)) / len(rel)
+                        for r, rel in zip(rankings, self.relevant)
+                    ]
+                )
+            )
+
+        times = np.array([t["client-e2e-time"] for t in self.rerank_trace])
+        passages = np.array([t["passages"] for t in self.rerank_trace])
+        self.metrics = {
+            f"recall@{self.eval_k} retrieval": recall(self.retrieved, self.eval_k),
+            f"recall@{self.eval_k} reranked": recall(self.reranked, self.eval_k),
+            "candidate recall": recall(self.rerank_payloads, self.retrieve_k),
+            "passages per rerank request (mean)": float(passages.mean()),
+            "passages per rerank request (max)": int(passages.max()),
+            "rerank p50 (s)": float(np.percentile(times, 50)),
+            "rerank p95 (s)": float(np.percentile(times, 95)),
+        }
+        current.card["retrieval"].append(
+            Markdown(
+                f"### Retrieve-then-rerank over {len(self.corpus)} passages\n"
+                f"{len(self.queries)} queries, top {self.retrieve_k} retrieved with "
+                f"{EMBEDDING_MODEL}, at most {self.rerank_candidates} reranked with "
+                f"{RERANK_MODEL}"
+            )
+        )
+        current.card["retrieval"].append(
+            Table(
+                headers=["Metric", "Value"],
+                data=[[k, round(v, 4)] for k, v in self.metrics.items()],
+            )
+        )
+        self.telemetry = telemetry.merge([self.telemetry, telemetry.snapshot(reset=True)])
+        self.next(self.end)
+
+    @step
+    def end(self):
+        from telemetry import format_summary
+
+        for k, v in self.metrics.items():
+            print(f"{k}: {v:.4f}")
+        print(format_summary(self.telemetry))
+
+    def _embedding_cache(self):
+        if not self.cache_path:
+            return None
+        from embedding_cache import EmbeddingCache
+
+        return EmbeddingCache(self.cache_path, max_bytes=self.cache_max_mb << 20)
+
+
+if __name__ == "__main__":
+    RetrieveRerank()
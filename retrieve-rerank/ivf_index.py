@@ -0,0 +1 @@
+../common/ivf_index.py
\ No newline at end of file
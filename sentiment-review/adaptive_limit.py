@@ -0,0 +1 @@
+../common/adaptive_limit.py
\ No newline at end of file
@@ -0,0 +1 @@
+../common/card_report.py
\ No newline at end of file
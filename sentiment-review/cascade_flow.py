@@ -0,0 +1,58 @@
+from metaflow import FlowSpec, step, project, card, retry, nim, Parameter
+
+from review_sentiment import MODEL, ESCALATION_MODEL, ReviewSentimentSteps
+
+
+# ReviewSentimentFlow with a cascade: MODEL answers every review and
+# ESCALATION_MODEL, deployed only by this flow, the ones it is not trusted with
+@project(name='sentiment_analysis')
+@nim(models=[MODEL, ESCALATION_MODEL])
+class ReviewSentimentCascadeFlow(ReviewSentimentSteps, FlowSpec):
+
+    cascade = True
+    min_confidence = Parameter(
+        "min_confidence",
+        default=0.9,
+        help=f"Escalate answers whose token probability is lower to {ESCALATION_MODEL}",
+    )
+
+    def _classifier(self):
+        from cascade import Cascade
+        from review_sentiment import parse_sentiment
+
+        def off_label(resp):
+            content = resp["choices"][0]["message"]["content"]
+            return "off-label" if parse_sentiment(content) == "UNKNOWN" else None
+
+        return Cascade(
+            self._models(),
+            MODEL,
+            ESCALATION_MODEL,
+            accept=off_label,
+            min_confidence=self.min_confidence,
+        )
+
+    @step
+    def start(self):
+        self._plan_batches()
+        self.next(self.prompt, foreach="batches")
+
+    @card(type="blank", refresh_interval=1)
+    @retry(times=2)
+    @step
+    def prompt(self):
+        self._classify_batch()
+        self.next(self.join)
+
+    @step
+    def join(self, inputs):
+        self._merge_results(inputs)
+        self.next(self.end)
+
+    @step
+    def end(self):
+        pass
+
+
+if __name__ == "__main__":
+    ReviewSentimentCascadeFlow()
@@ -0,0 +1 @@
+../common/request_pool.py
\ No newline at end of file
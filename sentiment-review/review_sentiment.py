@@ -0,0 +1,198 @@
+"""
+Parameters and step bodies shared by `ReviewSentimentFlow` (flow.py) and
+`ReviewSentimentCascadeFlow` (cascade_flow.py).
+
+`@nim` starts a container for every model it lists, for the whole run, so a
+cascade switched off by a parameter would still pay for the escalation
+model. The cascade is therefore a flow of its own, the only one that lists
+ESCALATION_MODEL, and both flows run the steps defined here.
+"""
+import csv
+import io
+import time
+
+from metaflow import Parameter, IncludeFile, current
+from metaflow.cards import Markdown, ProgressBar, VegaChart
+
+MODEL = "meta/llama3-8b-instruct"
+# answers the reviews the cascade does not trust MODEL with
+ESCALATION_MODEL = "meta/llama3-70b-instruct"
+PROMPT = "answer with one word HAPPY if the sentiment of the following sentence is positive, otherwise answer with one word SAD"
+LABELS = ["HAPPY", "SAD"]
+# unguided, only the first token of the answer is decoded; it is a prefix of
+# at most one label, which parse_sentiment matches
+UNGUIDED_MAX_TOKENS = 1
+
+
+def parse_sentiment(text):
+    """Map a completion to one of LABELS, or UNKNOWN if it is neither."""
+    word = text.strip().strip(".!*\"'").upper()
+    for label in LABELS:
+        # unguided completions may be cut to the label's first token(s)
+        if word and (label.startswith(word) or word.startswith(label)):
+            return label
+    return "UNKNOWN"
+
+
+class ReviewSentimentSteps(object):
+
+    # set by ReviewSentimentCascadeFlow
+    cascade = False
+
+    num_parallel = Parameter("num_parallel", default=5)
+    max_in_flight = Parameter(
+        "max_in_flight",
+        default=8,
+        help="Reviews classified concurrently per task, or the starting number with --adaptive",
+    )
+    adaptive = Parameter(
+        "adaptive",
+        default=False,
+        type=bool,
+        help="Adapt the number of concurrent requests to the endpoint's latency and throttling",
+    )
+    max_in_flight_cap = Parameter(
+        "max_in_flight_cap",
+        default=64,
+        help="Upper bound of the adaptive number of concurrent requests",
+    )
+    guided = Parameter(
+        "guided",
+        default=True,
+        type=bool,
+        help="Constrain the output to HAPPY/SAD with guided_choice",
+    )
+    checkpoint_every = Parameter(
+        "checkpoint_every",
+        default=25,
+        help="Save finished classifications every this many reviews, so a retry resumes",
+    )
+    card_refresh_interval = Parameter(
+        "card_refresh_interval",
+        default=2.0,
+        help="Minimum number of seconds between card refreshes",
+    )
+    review_csv = IncludeFile("reviews", default="reviews.csv")
+
+    def _plan_batches(self):
+        from shard_planner import plan_shards, text_cost
+
+        self.reviews = [
+            row["Review Text"] for row in csv.DictReader(io.StringIO(self.review_csv))
+        ]
+        print("Number of reviews:", len(self.reviews))
+        # shards of about equal total review length rather than equal counts
+        shards, _ = plan_shards(map(text_cost, self.reviews), self.num_parallel)
+        self.batches = [[self.reviews[i] for i in shard] for shard in shards]
+
+    def _models(self):
+        """
+        The model clients; with --adaptive, throttled requests are retried by
+        map_concurrent, which reports them to the limit, not by the client.
+        """
+        from nim_client import nim_models
+
+        return nim_models(retry_throttled=not self.adaptive)
+
+    def _classifier(self):
+        """The client classifying a review: MODEL, or the cascade from it."""
+        return self._models()[MODEL]
+
+    def _classify_batch(self):
+        import sentiment_chart
+        from checkpoint import TaskCheckpoint, resumable_map
+        from shard_planner import text_cost
+        from adaptive_limit import AIMDLimit, trajectory_spec
+        from card_report import Latest, Refresher
+        import telemetry
+
+        reviews = [review for review in self.input if review]
+        progress = ProgressBar(max=len(reviews), label="Reviews processed")
+        text = Markdown()
+        chart = VegaChart(sentiment_chart.spec())
+        current.card.append(Markdown(f"## Prompt\n### {PROMPT}"))
+        current.card.append(progress)
+        current.card.append(chart)
+        in_flight = self.max_in_flight
+        if self.adaptive:
+            in_flight = AIMDLimit(initial=self.max_in_flight, max_limit=self.max_in_flight_cap)
+            limit_chart = VegaChart(trajectory_spec(in_flight.trajectory))
+            current.card.append(limit_chart)
+        current.card.append(text)
+
+        # get a client connected to the NIM container
+        llm = self._classifier()
+        request_args = dict(model=MODEL, temperature=0)
+        if self.guided:
+            # only a label is decoded, never free-form text
+            request_args["max_tokens"] = 4
+            request_args["extra_body"] = {"nvext": {"guided_choice": LABELS}}
+        else:
+            request_args["max_tokens"] = UNGUIDED_MAX_TOKENS
+
+        def classify(review):
+            # send a prompt to the LLM
+            prompt = {"role": "user", "content": f"{PROMPT}: {review}"}
+            chat_completion = llm(messages=[prompt], **request_args)
+            return parse_sentiment(chat_completion["choices"][0]["message"]["content"])
+
+        counts = {"HAPPY": 0, "SAD": 0, "UNKNOWN": 0}
+        latest = Latest(50)
+        completed = 0
+
+        def render():
+            text.update("\n\n".join(latest))
+            chart.update(sentiment_chart.spec(**counts))
+            if self.adaptive:
+                limit_chart.update(trajectory_spec(in_flight.trajectory))
+            progress.update(completed)
+
+        refresh = Refresher(current.card, self.card_refresh_interval, render)
+
+        def update(i, sentiment):
+            nonlocal completed
+            completed += 1
+            counts[sentiment] += 1
+            latest.append(f"**{sentiment}** - {reviews[i][:150]}...")
+            refresh(force=completed == len(reviews))
+
+        self.shard_cost = sum(map(text_cost, self.input))
+        t0 = time.time()
+        checkpoint = TaskCheckpoint(self, every=self.checkpoint_every)
+        sentiments = resumable_map(
+            classify,
+            reviews,
+            checkpoint,
+            max_in_flight=in_flight,
+            on_result=update,
+        )
+        self.shard_seconds = time.time() - t0
+        # off-label answers are kept as UNKNOWN instead of being dropped
+        self.results = list(zip(reviews, sentiments))
+        self.cascade_stats = llm.stats if self.cascade else None
+        if self.adaptive:
+            self.in_flight_trajectory = in_flight.trajectory
+            print("Adaptive in-flight limit:", in_flight.summary())
+        self.telemetry = telemetry.snapshot(reset=True)
+
+    def _merge_results(self, inputs):
+        from shard_planner import balance_report, format_report
+        from telemetry import merge, format_summary
+
+        self.results = []
+        for inp in inputs:
+            self.results.extend(inp.results)
+        self.shard_balance = balance_report(
+            [inp.shard_cost for inp in inputs], [inp.shard_seconds for inp in inputs]
+        )
+        print(format_report(self.shard_balance))
+        self.telemetry = merge(inp.telemetry for inp in inputs)
+        print(format_summary(self.telemetry))
+        if self.cascade:
+            from cascade import cascade_report, merge_stats
+            from cascade import format_report as format_cascade
+
+            self.cascade_report = cascade_report(
+                merge_stats(inp.cascade_stats for inp in inputs), MODEL, ESCALATION_MODEL
+            )
+            print(format_cascade(self.cascade_report))
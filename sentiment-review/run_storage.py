@@ -0,0 +1 @@
+../common/run_storage.py
\ No newline at end of file
@@ -1,14 +1,15 @@
-def spec(HAPPY=0, SAD=0):
+def spec(HAPPY=0, SAD=0, UNKNOWN=0):
+    values = [
+        {"color": "#d73030", "count": SAD, "label": "sad"},
+        {"color": "#77b895", "count": HAPPY, "label": "happy"},
+    ]
+    if UNKNOWN:
+        values.append({"color": "#a0a0a0", "count": UNKNOWN, "label": "unknown"})
     return {
         "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
         "width": 720,
         "height": 200,
-        "data": {
-            "values": [
-                {"color": "#d73030", "count": SAD, "label": "sad"},
-                {"color": "#77b895", "count": HAPPY, "label": "happy"},
-            ]
-        },
+        "data": {"values": values},
         "mark": {"type": "bar", "width": {"band": 0.9}, "fontSize": 10},
         "encoding": {
             "x": {
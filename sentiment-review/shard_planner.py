@@ -0,0 +1 @@
+../common/shard_planner.py
\ No newline at end of file
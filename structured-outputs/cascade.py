@@ -0,0 +1 @@
+../common/cascade.py
\ No newline at end of file
@@ -0,0 +1,51 @@
+from metaflow import FlowSpec, step, nim, Parameter
+
+from structured_extraction import MODEL, SMALL_MODEL, StructuredOutputsSteps
+
+
+class NIMStructuredOutputsCascade(StructuredOutputsSteps, FlowSpec):
+    """
+    NIMStructuredOutputs with a cascade: SMALL_MODEL extracts first and MODEL
+    answers when the output fails the schema or has low confidence.
+    """
+
+    cascade = True
+    min_confidence = Parameter(
+        "min_confidence",
+        default=0.0,
+        help="Escalate outputs whose mean token probability is lower",
+    )
+
+    def _extractor(self, validate):
+        import json
+        from nim_client import nim_models
+        from cascade import Cascade
+
+        def schema_failure(response):
+            try:
+                result = json.loads(response['choices'][0]['message']['content'])
+            except ValueError:
+                return "invalid JSON"
+            return "schema" if validate(result) else None
+
+        return Cascade(
+            nim_models(),
+            SMALL_MODEL,
+            MODEL,
+            accept=schema_failure,
+            min_confidence=self.min_confidence,
+        )
+
+    @nim(models=[MODEL, SMALL_MODEL])
+    @step
+    def start(self):
+        self._extract()
+        self.next(self.end)
+
+    @step
+    def end(self):
+        pass
+
+
+if __name__ == '__main__':
+    NIMStructuredOutputsCascade()
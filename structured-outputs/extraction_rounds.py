@@ -0,0 +1,49 @@
+"""
+Rounds of extraction requests, resending only the documents that failed.
+
+`extract(i, sampled)` returns `(result, errors, responded)` for document
+`i`: `responded` is False when the request itself failed, after the client's
+own retries, and `errors` then describes the failure instead of a schema
+violation. `sampled` is True once a response for the document was invalid,
+since a repeated greedy request would return the same invalid output.
+"""
+from request_pool import map_concurrent
+
+
+def extract_rounds(extract, n_docs, max_attempts=3, max_in_flight=16):
+    """
+    Send every document, then again each one whose request failed or whose
+    output was invalid, up to `max_attempts` times in all. Returns one
+    extraction dict per document and the counts of requests, responses,
+    invalid responses and request errors.
+    """
+    extractions = [{"result": None, "errors": [], "attempts": 0} for _ in range(n_docs)]
+    counts = {"requests": 0, "responses": 0, "invalid": 0, "request_errors": 0}
+    sampled = set()
+    queue = list(range(n_docs))
+    for _ in range(max_attempts):
+        if not queue:
+            break
+        outputs = map_concurrent(
+            lambda i: extract(i, i in sampled), queue, max_in_flight=max_in_flight
+        )
+        requeue = []
+        for i, (result, errors, responded) in zip(queue, outputs):
+            extraction = extractions[i]
+            extraction["attempts"] += 1
+            extraction["errors"] = errors
+            counts["requests"] += 1
+            if not responded:
+                # sent again as it was: no output was seen to be invalid
+                counts["request_errors"] += 1
+                requeue.append(i)
+                continue
+            counts["responses"] += 1
+            if errors:
+                counts["invalid"] += 1
+                sampled.add(i)
+                requeue.append(i)
+            else:
+                extraction["result"] = result
+        queue = requeue
+    return extractions, counts
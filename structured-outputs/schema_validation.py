@@ -0,0 +1,124 @@
+"""
+JSON Schema validation of extracted outputs, compiled once per schema.
+
+`compile_validator(schema)` returns a function mapping an instance to a list
+of error messages, empty when the instance is valid. It uses the `jsonschema`
+package when it is installed. Otherwise a small validator covering the
+keywords used by guided_json schemas here (type, properties, required,
+additionalProperties, items, enum, minimum, maximum) is built from the schema
+up front, so no schema walking happens per document.
+"""
+import numbers
+
+TYPES = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, numbers.Real) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def compile_validator(schema):
+    try:
+        import jsonschema
+    except ImportError:
+        return _compile(schema, "$")
+
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    validator = cls(schema)
+
+    def validate(instance):
+        return [
+            f"{error.json_path}: {error.message}"
+            for error in validator.iter_errors(instance)
+        ]
+
+    return validate
+
+
+def _compile(schema, path):
+    checks = []
+
+    if "type" in schema:
+        kinds = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        tests = [TYPES[k] for k in kinds]
+
+        def check_type(v, errors):
+            if not any(t(v) for t in tests):
+                errors.append(f"{path}: {v!r} is not of type {' or '.join(kinds)}")
+                return False
+            return True
+
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check_enum(v, errors):
+            if v not in allowed:
+                errors.append(f"{path}: {v!r} is not one of {allowed}")
+            return True
+
+        checks.append(check_enum)
+
+    for key, op, fails in (
+        ("minimum", "minimum", lambda v, m: v < m),
+        ("maximum", "maximum", lambda v, m: v > m),
+    ):
+        if key in schema:
+            bound = schema[key]
+
+            def check_bound(v, errors, bound=bound, op=op, fails=fails):
+                if TYPES["number"](v) and fails(v, bound):
+                    errors.append(f"{path}: {v!r} is beyond the {op} {bound}")
+                return True
+
+            checks.append(check_bound)
+
+    properties = {
+        name: _compile(sub, f"{path}.{name}")
+        for name, sub in schema.get("properties", {}).items()
+    }
+    required = schema.get("required", [])
+    extra_allowed = schema.get("additionalProperties", True) is not False
+    if properties or required or not extra_allowed:
+
+        def check_object(v, errors):
+            if not isinstance(v, dict):
+                return True
+            for name in required:
+                if name not in v:
+                    errors.append(f"{path}: '{name}' is a required property")
+            for name, value in v.items():
+                if name in properties:
+                    errors.extend(properties[name](value))
+                elif not extra_allowed:
+                    errors.append(f"{path}: additional property '{name}' is not allowed")
+            return True
+
+        checks.append(check_object)
+
+    if isinstance(schema.get("items"), dict):
+        item_validator = _compile(schema["items"], f"{path}[]")
+
+        def check_items(v, errors):
+            if isinstance(v, list):
+                for item in v:
+                    errors.extend(item_validator(item))
+            return True
+
+        checks.append(check_items)
+
+    def validate(instance):
+        errors = []
+        for check in checks:
+            # a value of the wrong type is not checked any further
+            if not check(instance, errors):
+                break
+        return errors
+
+    return validate
@@ -0,0 +1,162 @@
+"""
+Parameters and step bodies shared by `NIMStructuredOutputs` (flow.py) and
+`NIMStructuredOutputsCascade` (cascade_flow.py).
+
+`@nim` starts a container for every model it lists, so a cascade switched
+off by a parameter would still pay for the small model. The cascade is a
+flow of its own, the only one that lists SMALL_MODEL.
+"""
+import time
+
+from metaflow import IncludeFile, Parameter
+
+MODEL = 'meta/llama3-70b-instruct'
+# answers first in NIMStructuredOutputsCascade
+SMALL_MODEL = 'meta/llama3-8b-instruct'
+
+
+class StructuredOutputsSteps(object):
+
+    # set by NIMStructuredOutputsCascade
+    cascade = False
+
+    documents = IncludeFile(
+        "documents",
+        help="Text file of movie reviews, one per line, to extract in batch mode",
+    )
+    max_in_flight = Parameter(
+        "max_in_flight", default=16, help="Extraction requests sent concurrently"
+    )
+    max_attempts = Parameter(
+        "max_attempts",
+        default=3,
+        help="Times a document is sent before an invalid output is given up on",
+    )
+
+    def _extractor(self, validate):
+        """The client extracting a document: MODEL, or the cascade to it."""
+        from nim_client import nim_models
+
+        return nim_models()[MODEL]
+
+    def _extract(self):
+        import json
+        from schema_validation import compile_validator
+
+        self.json_schema = {
+            "type": "object",
+            "properties": {
+                "title": {
+                    "type": "string"
+                },
+                "rating": {
+                    "type": "number"
+                }
+            },
+            "required": [
+                "title",
+                "rating"
+            ]
+        }
+        self.system_prompt = (
+            "You are a text extraction agent that reads text and outputs JSON."
+            "Only output the title and the rating of the movie review in a valid JSON blob."
+        )
+        self.prompt = self._review_prompt(
+            "Inception is a really well made film. I rate it four stars out of five."
+        )
+
+        validate = compile_validator(self.json_schema)
+        llm = self._extractor(validate)
+
+        if self.documents:
+            self._extract_documents(llm, validate)
+        else:
+            self.response = llm(
+                messages=[
+                    {"role": "assistant", "content": self.system_prompt},
+                    {"role": "user", "content": self.prompt}
+                ],
+                max_tokens=62,
+                extra_body={"nvext": {"guided_json": self.json_schema}},
+            )
+
+            self.parsed_result = json.loads(self.response['choices'][0]['message']['content'])
+            assert self.parsed_result['title'] == "Inception"
+            assert self.parsed_result['rating'] == 4
+        if self.cascade:
+            from cascade import cascade_report, format_report
+
+            self.cascade_report = cascade_report(llm.stats, SMALL_MODEL, MODEL)
+            print(format_report(self.cascade_report))
+
+    def _review_prompt(self, review):
+        return (
+            f"Return the title and the rating based on the following movie review according to this JSON schema:{str(self.json_schema)}.\n"
+            f"Review: {review}"
+        )
+
+    def _extract_documents(self, llm, validate):
+        """
+        Extract every document of `self.documents` concurrently. Outputs that
+        are not valid JSON or fail the schema are sent again, sampled this
+        time, up to `max_attempts` times per document. A request that fails
+        is sent again for its document alone instead of failing the batch,
+        and is counted as a request error, not as a failed validation.
+        """
+        import json
+        from extraction_rounds import extract_rounds
+
+        docs = [line.strip() for line in self.documents.splitlines() if line.strip()]
+
+        def extract(i, sampled):
+            try:
+                response = llm(
+                    messages=[
+                        {"role": "assistant", "content": self.system_prompt},
+                        {"role": "user", "content": self._review_prompt(docs[i])}
+                    ],
+                    max_tokens=62,
+                    # greedy first; a repeat of a greedy request would return
+                    # the same invalid output
+                    temperature=0.7 if sampled else 0,
+                    extra_body={"nvext": {"guided_json": self.json_schema}},
+                )
+            except Exception as ex:
+                # the client has retried already; this document failed alone
+                return None, [f"request failed: {ex}"], False
+            content = response['choices'][0]['message']['content']
+            try:
+                result = json.loads(content)
+            except ValueError as ex:
+                return None, [f"invalid JSON: {ex}"], True
+            return result, validate(result), True
+
+        t0 = time.time()
+        extractions, counts = extract_rounds(
+            extract, len(docs), self.max_attempts, self.max_in_flight
+        )
+        elapsed = time.time() - t0
+        self.extractions = [dict(e, document=doc) for doc, e in zip(docs, extractions)]
+        valid = sum(e["result"] is not None for e in extractions)
+
+        self.extraction_stats = {
+            "documents": len(docs),
+            "valid": valid,
+            "gave_up": len(docs) - valid,
+            "requests": counts["requests"],
+            "request_errors": counts["request_errors"],
+            # of the responses that came back
+            "validation_failure_rate": (
+                counts["invalid"] / counts["responses"] if counts["responses"] else 0.0
+            ),
+            "seconds": elapsed,
+            "docs_per_sec": len(docs) / elapsed if elapsed > 0 else None,
+        }
+        print(
+            f"Extracted {valid}/{len(docs)} documents in "
+            f"{elapsed:.1f}s ({self.extraction_stats['docs_per_sec'] or 0:.2f} docs/sec); "
+            f"{self.extraction_stats['validation_failure_rate']:.1%} of "
+            f"{counts['responses']} responses failed validation, and "
+            f"{counts['request_errors']} of {counts['requests']} requests got no response"
+        )
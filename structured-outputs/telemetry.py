@@ -0,0 +1 @@
+../common/telemetry.py
\ No newline at end of file
@@ -0,0 +1,25 @@
+from extraction_rounds import extract_rounds
+
+
+def test_request_errors_are_not_validation_failures():
+    # document 0: valid at once; 1: a request error, then valid;
+    # 2: invalid, then valid; 3: a request error, then invalid twice
+    script = {
+        0: [({"ok": 1}, [], True)],
+        1: [(None, ["request failed: reset"], False), ({"ok": 1}, [], True)],
+        2: [(None, ["invalid JSON"], True), ({"ok": 1}, [], True)],
+        3: [(None, ["request failed: reset"], False)] + [(None, ["'x' is required"], True)] * 2,
+    }
+    seen = []
+
+    def extract(i, sampled):
+        seen.append((i, sampled))
+        return script[i].pop(0)
+
+    extractions, counts = extract_rounds(extract, 4, max_attempts=3, max_in_flight=2)
+    assert [e["result"] is not None for e in extractions] == [True, True, True, False]
+    assert [e["attempts"] for e in extractions] == [1, 2, 2, 3]
+    assert extractions[3]["errors"] == ["'x' is required"]
+    assert counts == {"requests": 8, "responses": 6, "invalid": 3, "request_errors": 2}
+    # only an invalid output is sampled when it is sent again
+    assert (1, True) not in seen and (2, True) in seen and (3, True) in seen
@@ -0,0 +1,48 @@
+from schema_validation import compile_validator
+
+MOVIE = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "rating": {"type": "number", "minimum": 0, "maximum": 5},
+        "genres": {"type": "array", "items": {"enum": ["drama", "sci-fi"]}},
+    },
+    "required": ["title", "rating"],
+    "additionalProperties": False,
+}
+
+
+def test_valid_instance_has_no_errors():
+    validate = compile_validator(MOVIE)
+    assert validate({"title": "Inception", "rating": 4}) == []
+    assert validate({"title": "Inception", "rating": 4.5, "genres": ["sci-fi"]}) == []
+
+
+def test_errors_name_their_path():
+    validate = compile_validator(MOVIE)
+    errors = validate({"title": 3, "rating": 9, "genres": ["comedy"], "year": 2010})
+    assert len(errors) == 4
+    assert any(e.startswith("$.title") for e in errors)
+    assert any(e.startswith("$.rating") for e in errors)
+    assert any("year" in e for e in errors)
+
+
+def test_missing_required_properties():
+    errors = compile_validator(MOVIE)({})
+    assert len(errors) == 2 and all("required" in e for e in errors)
+
+
+def test_wrong_type_is_not_checked_further():
+    assert len(compile_validator(MOVIE)([])) == 1
+    assert len(compile_validator(MOVIE)(None)) == 1
+
+
+def test_booleans_are_not_numbers():
+    assert compile_validator({"type": "number"})(True)
+    assert compile_validator({"type": "integer"})(3) == []
+    assert compile_validator({"type": ["string", "null"]})(None) == []
+
+
+def test_empty_schema_accepts_anything():
+    validate = compile_validator({})
+    assert validate({}) == validate([]) == validate(None) == []
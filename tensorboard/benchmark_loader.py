@@ -0,0 +1,81 @@
+"""
+Compare the per-sample transform DataLoader of `train_model` against
+`mnist_cache.TensorBatches` over preprocessed, memory-mapped tensors.
+
+    python benchmark_loader.py --batch-size 64 --threads 2
+
+Reports samples/sec of one pass over the training set with each loader, and
+of `--train-batches` training steps of `Net` fed by each, with torch limited
+to `--threads` threads like a task with @resources(cpu=2).
+"""
+from argparse import ArgumentParser
+import time
+
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+from torchvision import datasets, transforms
+
+import mnist_cache
+from mnist_torch import Net
+
+
+def transform_loader(root, batch_size):
+    transform = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize((mnist_cache.MEAN,), (mnist_cache.STD,))
+        ])
+    dataset = datasets.MNIST(root, train=True, download=True, transform=transform)
+    return torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+
+
+def read_throughput(loader):
+    n = 0
+    t0 = time.perf_counter()
+    for data, _ in loader:
+        n += len(data)
+    return n / (time.perf_counter() - t0)
+
+
+def train_throughput(loader, n_batches):
+    torch.manual_seed(0)
+    model = Net()
+    optimizer = optim.Adadelta(model.parameters(), lr=1.0)
+    model.train()
+    n = 0
+    t0 = time.perf_counter()
+    for batch_idx, (data, target) in enumerate(loader):
+        if batch_idx == n_batches:
+            break
+        optimizer.zero_grad()
+        loss = F.nll_loss(model(data), target)
+        loss.backward()
+        optimizer.step()
+        n += len(data)
+    return n / (time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default="../data", help="Where MNIST is downloaded")
+    parser.add_argument("--cache", default="mnist-cache", help="Where preprocessed tensors go")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--train-batches", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=2)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    t0 = time.perf_counter()
+    mnist_cache.preprocess(args.data, args.cache)
+    print(f"Preprocessing: {time.perf_counter() - t0:.2f}s, once per run")
+
+    cached, _ = mnist_cache.loaders(args.cache, args.batch_size, 1000)
+    loaders = {
+        "transforms": lambda: transform_loader(args.data, args.batch_size),
+        "tensor cache": lambda: cached,
+    }
+    print(f"{'loader':>14} {'read samples/s':>15} {'train samples/s':>16}")
+    for name, make in loaders.items():
+        read = read_throughput(make())
+        train = train_throughput(make(), args.train_batches)
+        print(f"{name:>14} {read:>15.0f} {train:>16.0f}")
@@ -0,0 +1,96 @@
+"""
+A preprocessed, memory-mapped copy of MNIST for training loops.
+
+`ToTensor` + `Normalize` run in Python for every sample of every epoch, which
+on a couple of CPUs costs about as much as the training step itself. The
+transforms are the same every time, so `preprocess` applies them once to
+the whole dataset, vectorized, and writes the normalized images and the
+labels as .npy files. `TensorBatches` memory-maps them and yields whole
+batches as slices, with no per-sample work at all; tasks on the same
+machine share the file through the page cache.
+"""
+import os
+
+import numpy as np
+import torch
+
+MEAN, STD = 0.1307, 0.3081
+SPLITS = ('train', 'test')
+
+
+def split_files(split):
+    return f'mnist-{split}-images.npy', f'mnist-{split}-labels.npy'
+
+
+def preprocess(root, out_dir):
+    """
+    Download MNIST to `root` and write the normalized float32 images,
+    shaped (n, 1, 28, 28), and int64 labels of both splits to `out_dir`.
+    Returns the names of the files written.
+    """
+    from torchvision import datasets
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for split in SPLITS:
+        ds = datasets.MNIST(root, train=split == 'train', download=True)
+        # the same arithmetic as ToTensor followed by Normalize
+        images = (ds.data.numpy().astype(np.float32) / 255.0 - MEAN) / STD
+        images = images[:, None, :, :]
+        labels = ds.targets.numpy().astype(np.int64)
+        for name, array in zip(split_files(split), (images, labels)):
+            tmp = os.path.join(out_dir, name + '.tmp')
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, os.path.join(out_dir, name))
+            written.append(name)
+    return written
+
+
+def open_split(images_path, labels_path):
+    """The images and labels of a split as tensors over memory-mapped files."""
+    # copy-on-write, so torch gets a writable buffer while the file stays shared
+    images = torch.from_numpy(np.load(images_path, mmap_mode='c'))
+    labels = torch.from_numpy(np.load(labels_path))
+    return images, labels
+
+
+class TensorBatches(object):
+    """
+    Batches of `(images, labels)` sliced from whole-dataset tensors; a
+    drop-in for the DataLoader iterated by `train` and `test`.
+    """
+
+    def __init__(self, images, labels, batch_size, shuffle=False, seed=0):
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = torch.Generator().manual_seed(seed)
+        # train() and test() report progress against len(loader.dataset)
+        self.dataset = labels
+
+    def __len__(self):
+        return (len(self.labels) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = len(self.labels)
+        if self.shuffle:
+            order = torch.randperm(n, generator=self.generator)
+            for start in range(0, n, self.batch_size):
+                idx = order[start:start + self.batch_size]
+                yield self.images[idx], self.labels[idx]
+        else:
+            for start in range(0, n, self.batch_size):
+                yield (self.images[start:start + self.batch_size],
+                       self.labels[start:start + self.batch_size])
+
+
+def loaders(data_dir, batch_size, test_batch_size):
+    """Train and test `TensorBatches` over the files `preprocess` wrote to `data_dir`."""
+    train_split, test_split = (
+        open_split(*(os.path.join(data_dir, name) for name in split_files(split)))
+        for split in SPLITS
+    )
+    return (TensorBatches(*train_split, batch_size),
+            TensorBatches(*test_split, test_batch_size))
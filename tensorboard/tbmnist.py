@@ -1,12 +1,35 @@
+from metaflow import tensorboard, project, FlowSpec, step, pypi, resources, Parameter
 
-from metaflow import tensorboard, project, FlowSpec, step, pypi, resources
+CACHE_DIR = 'mnist'
 
 @project(name='tb_mnist')
 class TBMnistFlow(FlowSpec):
 
+    tensor_cache = Parameter('tensor_cache',
+                             default=True,
+                             type=bool,
+                             help="Train on MNIST tensors preprocessed once in start, "
+                                  "instead of transforming every sample in every epoch")
+
+    @pypi(packages={'torch': '2.4.1',
+                    'torchvision': '0.19.1'})
     @step
     def start(self):
         self.batch_sizes = [32, 64, 128]
+        self.cache_keys = []
+        if self.tensor_cache:
+            import shutil
+            import tempfile
+            import mnist_cache
+            from run_storage import RunStorage
+            # normalized once here; every train branch memory-maps the same files
+            storage = RunStorage(self)
+            tmp = tempfile.mkdtemp()
+            for name in mnist_cache.preprocess('../data', tmp):
+                with storage.writer(f'{CACHE_DIR}/{name}') as path:
+                    shutil.move(f'{tmp}/{name}', path)
+                # run-qualified, so a resumed run's train steps find them
+                self.cache_keys.append(storage.key(f'{CACHE_DIR}/{name}'))
         self.next(self.train, foreach='batch_sizes')
 
     @pypi(packages={'torch': '2.4.1',
@@ -16,9 +39,18 @@ class TBMnistFlow(FlowSpec):
     @tensorboard
     @step
     def train(self):
+        import os
         import mnist_torch
+        from run_storage import RunStorage
         self.batch_size = self.input
-        self.accuracy = mnist_torch.train_model(self.obtb, batch_size=self.batch_size)
+        data_dir = None
+        if self.cache_keys:
+            storage = RunStorage(self)
+            # downloaded once per machine with an S3 datastore
+            paths = [storage.local_path(key) for key in self.cache_keys]
+            data_dir = os.path.dirname(paths[0])
+        self.accuracy, self.samples_per_sec = mnist_torch.train_model(
+            self.obtb, batch_size=self.batch_size, data_dir=data_dir)
         print(f"Results: {self.batch_size} accuracy: {self.accuracy}")
         self.next(self.join)
 
@@ -26,6 +58,8 @@ class TBMnistFlow(FlowSpec):
     def join(self, inputs):
         self.best = max(inputs, key=lambda x: x.accuracy).batch_size
         print(f"Best results: batch size = {self.best}")
+        for inp in inputs:
+            print(f"Batch size {inp.batch_size}: {inp.samples_per_sec:.0f} samples/sec")
         self.next(self.end)
 
     @step
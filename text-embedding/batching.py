@@ -0,0 +1,126 @@
+"""
+Token-budget batching and batch size selection for the embeddings endpoint.
+
+Batches are filled up to a token budget instead of a fixed number of lines, so
+a corpus of long passages and a corpus of short questions both send requests
+of similar cost. `probe_budgets` measures a few budgets against the endpoint
+and `best_budget` fits the request latency as a function of the batch's tokens
+to pick the budget with the highest throughput.
+"""
+import math
+
+# rough tokens per character for English text, refined from observed usage
+DEFAULT_TOKENS_PER_CHAR = 0.25
+
+
+def estimate_tokens(text, tokens_per_char=DEFAULT_TOKENS_PER_CHAR):
+    return max(1, math.ceil(len(text) * tokens_per_char))
+
+
+def split_by_token_budget(
+    texts, budget, max_items=None, tokens_per_char=DEFAULT_TOKENS_PER_CHAR
+):
+    """
+    Split `texts` into consecutive batches of at most `budget` estimated tokens
+    and `max_items` texts. A text larger than the budget gets a batch of its own.
+    """
+    batches, batch, used = [], [], 0
+    for text in texts:
+        cost = estimate_tokens(text, tokens_per_char)
+        full = max_items is not None and len(batch) >= max_items
+        if batch and (used + cost > budget or full):
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(text)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def probe_budgets(embed, texts, budgets, repeats=2, max_items=None):
+    """
+    Send `repeats` batches of each token budget through `embed(batch)`, which
+    must return `(vectors, usage)` like `embed_batch`, using consecutive slices
+    of `texts`. Pass texts that are not cached: a batch answered from a cache
+    takes no endpoint time and is not a sample.
+
+    Returns `(samples, tokens_per_char, probed)` where each sample is
+    `(budget, prompt_tokens, seconds)` and `probed` holds the vectors of the
+    texts sent, `texts[:len(probed)]`, so they need not be embedded again.
+    """
+    samples = []
+    chars = tokens = 0
+    offset = 0
+    probed = []
+    for budget in budgets:
+        for _ in range(repeats):
+            batch = split_by_token_budget(texts[offset:], budget, max_items)[:1]
+            if not batch:
+                break
+            batch = batch[0]
+            offset += len(batch)
+            vectors, usage = embed(batch)
+            probed.extend(vectors)
+            if usage["cache-hits"]:
+                # cached rows take no endpoint time and would skew the fit
+                continue
+            samples.append((budget, usage["prompt_tokens"], usage["client-e2e-time"]))
+            chars += sum(len(t) for t in batch)
+            tokens += usage["prompt_tokens"]
+    tokens_per_char = tokens / chars if chars and tokens else DEFAULT_TOKENS_PER_CHAR
+    return samples, tokens_per_char, probed
+
+
+def _solve(a, b):
+    """Solve the small dense system a x = b by Gaussian elimination."""
+    n = len(b)
+    m = [row[:] + [v] for row, v in zip(a, b)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(n):
+            if r != col:
+                f = m[r][col] / m[col][col]
+                m[r] = [x - f * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] for i in range(n)]
+
+
+def fit_latency(samples):
+    """
+    Least-squares fit of `seconds = a + b * tokens + c * tokens**2`.
+
+    `a` is the fixed per-request overhead, `b` the per-token cost and `c` the
+    slowdown of very large batches once the server saturates.
+    """
+    xs = [(1.0, t, t * t) for _, t, _ in samples]
+    ys = [s for _, _, s in samples]
+    ata = [[sum(x[i] * x[j] for x in xs) for j in range(3)] for i in range(3)]
+    aty = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(3)]
+    return _solve(ata, aty)
+
+
+def best_budget(samples):
+    """
+    Token budget with the highest fitted throughput (tokens/sec), limited to
+    the probed range. Falls back to the best observed budget when the fit is
+    degenerate.
+    """
+    observed = {}
+    for budget, tokens, seconds in samples:
+        observed.setdefault(budget, []).append(tokens / max(seconds, 1e-9))
+    best_observed = max(observed, key=lambda b: sum(observed[b]) / len(observed[b]))
+    if len(observed) < 3:
+        return best_observed
+    coef = fit_latency(samples)
+    if coef is None:
+        return best_observed
+    a, b, c = coef
+    lo, hi = min(observed), max(observed)
+    if a <= 0 or c <= 0:
+        # no saturation within the probed range: larger batches keep paying off
+        return hi if a > 0 else best_observed
+    # tokens / (a + b n + c n^2) peaks at n = sqrt(a / c)
+    return int(min(max(math.sqrt(a / c), lo), hi))
@@ -0,0 +1,64 @@
+"""
+Recall vs. latency of `IVFIndex` against brute-force NumPy search.
+
+    python benchmark_ann.py --n 100000 --dim 256 --queries 500
+
+Vectors are drawn from a mixture of Gaussian clusters so that, like real
+embeddings, they are not uniformly spread over the sphere. Recall@k is the
+fraction of the exact top-k that the index returns.
+"""
+from argparse import ArgumentParser
+import time
+
+import numpy as np
+
+from ivf_index import IVFIndex, brute_force_search, normalize
+
+
+def make_data(n, dim, n_queries, n_clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim))
+    points = centers[rng.integers(n_clusters, size=n + n_queries)]
+    points += 0.5 * rng.standard_normal(points.shape)
+    points = points.astype(np.float32)
+    return points[:n], points[n:]
+
+
+def recall(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    vectors, queries = make_data(args.n, args.dim, args.queries)
+
+    t0 = time.perf_counter()
+    index = IVFIndex.build(vectors, n_lists=args.n_lists)
+    print(f"built {len(index.centroids)} lists in {time.perf_counter() - t0:.2f}s")
+
+    normed = normalize(vectors)
+    t0 = time.perf_counter()
+    _, truth = brute_force_search(normed, queries, k=args.k)
+    exact_ms = 1000 * (time.perf_counter() - t0) / args.queries
+    t0 = time.perf_counter()
+    for q in queries:
+        brute_force_search(normed, q[None], k=args.k)
+    exact_single_ms = 1000 * (time.perf_counter() - t0) / args.queries
+
+    print(f"{'method':>12} {'recall@' + str(args.k):>10} {'ms/query':>10}")
+    print(f"{'brute':>12} {1.0:>10.3f} {exact_single_ms:>10.3f}")
+    print(f"{'brute batch':>12} {1.0:>10.3f} {exact_ms:>10.3f}")
+    for n_probe in args.n_probe:
+        t0 = time.perf_counter()
+        _, ids = index.search(queries, k=args.k, n_probe=n_probe)
+        ms = 1000 * (time.perf_counter() - t0) / args.queries
+        print(f"{'ivf p=' + str(n_probe):>12} {recall(ids, truth):>10.3f} {ms:>10.3f}")
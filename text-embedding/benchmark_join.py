@@ -0,0 +1,94 @@
+"""
+Compare the original vstack/concat join over lists of float dicts against
+`assemble_embeddings` over packed float32 batches.
+
+    python benchmark_join.py --sizes 10000 100000 --dim 64
+
+The original join re-copies the whole matrix for every row, so it is only run
+up to `--legacy-limit` vectors; larger sizes are extrapolated quadratically
+from the largest measured size and marked as such.
+"""
+from argparse import ArgumentParser
+from types import SimpleNamespace
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from embedding_matrix import assemble_embeddings
+
+
+def make_inputs(n_vectors, dim, batch_size, packed=True, seed=0):
+    """Fake embed task outputs, as packed float32 bytes or as the old list of dicts."""
+    rng = np.random.default_rng(seed)
+    inputs = []
+    for start in range(0, n_vectors, batch_size):
+        n = min(batch_size, n_vectors - start)
+        vectors = rng.standard_normal((n, dim)).astype(np.float32)
+        if packed:
+            embeddings = vectors.tobytes()
+        else:
+            embeddings = [
+                {"embedding": v, "index": i} for i, v in enumerate(vectors.tolist())
+            ]
+        inputs.append(
+            SimpleNamespace(
+                text_batch=[f"text {start + i}" for i in range(n)],
+                embeddings=embeddings,
+                embedding_dim=dim,
+            )
+        )
+    return inputs
+
+
+def legacy_join(inputs):
+    embeddings = None
+    embeddings_meta = pd.DataFrame()
+    for batch_input in inputs:
+        for i in range(len(batch_input.embeddings)):
+            if embeddings is not None:
+                embeddings = np.vstack([embeddings, batch_input.embeddings[i]["embedding"]])
+            else:
+                embeddings = [batch_input.embeddings[i]["embedding"]]
+        _start_idx = len(embeddings_meta)
+        _end_idx = _start_idx + len(batch_input.text_batch)
+        _meta_df = {
+            "text": batch_input.text_batch,
+            "embedding_row_idx": range(_start_idx, _end_idx),
+        }
+        embeddings_meta = pd.concat([embeddings_meta, pd.DataFrame(_meta_df)])
+    return embeddings, embeddings_meta
+
+
+def measure(fn, inputs):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(inputs)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--legacy-limit", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(f"{'vectors':>9} {'approach':>12} {'seconds':>10} {'peak MiB':>10}")
+    legacy_ref = None
+    for n in args.sizes:
+        t, mem = measure(assemble_embeddings, make_inputs(n, args.dim, args.batch_size))
+        print(f"{n:>9} {'prealloc':>12} {t:>10.3f} {mem:>10.1f}")
+        if n <= args.legacy_limit:
+            inputs = make_inputs(n, args.dim, args.batch_size, packed=False)
+            t, mem = measure(legacy_join, inputs)
+            legacy_ref = (n, t)
+            print(f"{n:>9} {'vstack':>12} {t:>10.3f} {mem:>10.1f}")
+        elif legacy_ref is not None:
+            t = legacy_ref[1] * (n / legacy_ref[0]) ** 2
+            print(f"{n:>9} {'vstack':>12} {t:>10.3f} {'-':>10}  (extrapolated)")
@@ -0,0 +1 @@
+../common/embedding_cache.py
\ No newline at end of file
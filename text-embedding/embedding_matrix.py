@@ -0,0 +1 @@
+../common/embedding_matrix.py
\ No newline at end of file
@@ -1,5 +1,15 @@
-from metaflow import FlowSpec, step, current, card, Parameter, IncludeFile, pypi, nim
-from metaflow.cards import VegaChart, Markdown
+from metaflow import (
+    FlowSpec,
+    step,
+    current,
+    card,
+    Parameter,
+    IncludeFile,
+    JSONType,
+    pypi,
+    nim,
+)
+from metaflow.cards import VegaChart, Markdown, Table
 
 MODELS = [
     # "nvidia/nv-embedqa-e5-v5",
@@ -13,64 +23,243 @@ class TextEmbedding(FlowSpec):
 
     text = IncludeFile(name="data", default="data.txt", help="Texts to embed")
     batch_size = Parameter("-bsz", default=10)
+    token_budget = Parameter(
+        "token_budget",
+        default=0,
+        help="If > 0, fill batches up to this many estimated tokens instead of -bsz lines",
+    )
+    adaptive = Parameter(
+        "adaptive",
+        default=False,
+        type=bool,
+        help="Probe --probe_budgets against the endpoint and batch by the fastest",
+    )
+    probe_budgets = Parameter(
+        "probe_budgets",
+        type=JSONType,
+        default="[256, 512, 1024, 2048, 4096]",
+        help="Token budgets measured in adaptive mode",
+    )
+    max_batch_items = Parameter(
+        "max_batch_items", default=64, help="Upper bound on texts per request"
+    )
+    cache_path = Parameter(
+        "cache",
+        default="~/.cache/nim-examples/embeddings.sqlite",
+        help="Embedding cache file on local disk, shared across local runs (not "
+        "persisted by @kubernetes/@batch tasks); pass '' to disable",
+    )
+    cache_max_mb = Parameter(
+        "cache_max_mb", default=2048, help="Size bound of the embedding cache in MiB"
+    )
+    n_lists = Parameter(
+        "n_lists", default=0, help="IVF lists in the ANN index; 0 picks ~4*sqrt(n)"
+    )
+    n_probe = Parameter("n_probe", default=8, help="IVF lists visited per query")
+    questions = Parameter(
+        "questions",
+        type=JSONType,
+        default='["Which city is the capital of France?"]',
+        help="Questions to answer from the index in the index step",
+    )
     model = MODELS[0]
+    input_type = "query"
+    # The join keeps the matrix in run storage, not in an `embeddings` artifact
+    # as it used to. Read it from a notebook with
+    #   open_embeddings(RunStorage.for_run(run).local_path(run["join"].task["embeddings_key"].data))
+    embeddings_file = "embeddings.npy"
+    index_file = "ann_vectors.npy"
 
     @step
     def start(self):
+        from batching import split_by_token_budget, DEFAULT_TOKENS_PER_CHAR
+        import telemetry
+
         self.text_chunks = self.text.split("\n")
 
-        self.batch = [
-            self.text_chunks[i : i + self.batch_size]
-            for i in range(0, len(self.text_chunks), self.batch_size)
-        ]
+        self.batch_plan = None
+        self.probe_batch = None
+        texts = self.text_chunks
+        if self.adaptive:
+            self.batch_plan, self.probe_batch = self._probe_batch_sizes()
+            budget = self.batch_plan["token_budget"]
+            tokens_per_char = self.batch_plan["tokens_per_char"]
+            # the probed texts are embedded already; only the rest is partitioned
+            probed = set(self.batch_plan["probed_rows"])
+            texts = [t for i, t in enumerate(texts) if i not in probed]
+        else:
+            budget = self.token_budget
+            tokens_per_char = DEFAULT_TOKENS_PER_CHAR
+
+        if budget:
+            self.batch = split_by_token_budget(
+                texts, budget, self.max_batch_items, tokens_per_char
+            )
+        else:
+            self.batch = [
+                texts[i : i + self.batch_size]
+                for i in range(0, len(texts), self.batch_size)
+            ]
+        # a foreach needs at least one split, even if probing embedded everything
+        self.batch = self.batch or [[]]
+        # the probe requests, merged with the embed tasks' in the join
+        self.probe_telemetry = telemetry.snapshot(reset=True)
         self.next(self.embed, foreach="batch")
 
+    def _probe_batch_sizes(self):
+        """
+        Measure the endpoint at each of `probe_budgets` with texts that are
+        not in the embedding cache, and pick the token budget with the best
+        fitted throughput. Returns the plan and the probed texts with their
+        vectors, as a batch for the join.
+        """
+        from batching import probe_budgets, best_budget, fit_latency
+        from embedding_cache import embed_batch
+        from nim_client import nim_models
+
+        llm = nim_models()[self.model]
+        cache = self._embedding_cache()
+        rows = list(range(len(self.text_chunks)))
+        if cache is not None:
+            found = cache.lookup(self.model, self.input_type, self.text_chunks)
+            rows = [i for i in rows if found[i] is None]
+        samples, tokens_per_char, vectors = probe_budgets(
+            lambda batch: embed_batch(
+                llm, self.model, self.input_type, batch, cache=cache
+            ),
+            [self.text_chunks[i] for i in rows],
+            self.probe_budgets,
+            max_items=self.max_batch_items,
+        )
+        plan = {
+            "samples": samples,
+            "tokens_per_char": tokens_per_char,
+            "token_budget": min(self.probe_budgets),
+            "latency_fit": None,
+            "probed_rows": rows[: len(vectors)],
+        }
+        if samples:
+            plan["token_budget"] = best_budget(samples)
+            if len(samples) >= 3:
+                plan["latency_fit"] = fit_latency(samples)
+        elif not rows:
+            # everything is cached, so no request is sent and fewer, larger
+            # batches only save tasks
+            plan["token_budget"] = max(self.probe_budgets)
+        print(
+            f"Adaptive batching: {len(samples)} probes of {len(rows)} uncached texts, "
+            f"token budget {plan['token_budget']}, "
+            f"{tokens_per_char:.3f} tokens/char"
+        )
+        probe_batch = {
+            "text_batch": [self.text_chunks[i] for i in plan["probed_rows"]],
+            "embeddings": b"".join(vectors),
+            "embedding_dim": len(vectors[0]) // 4 if vectors else 0,
+        }
+        return plan, probe_batch
+
+    def _embedding_cache(self):
+        if not self.cache_path:
+            return None
+        from embedding_cache import EmbeddingCache
+
+        return EmbeddingCache(self.cache_path, max_bytes=self.cache_max_mb << 20)
+
     @step
     def embed(self):
-        import time
-        import requests
+        from embedding_cache import embed_batch
+        from nim_client import nim_models
+        import telemetry
 
         self.text_batch = self.input
-
-        t0 = time.time()
-        res_json = current.nim.models[self.model](
-            input=self.text_batch, input_type="query"
+        # vectors are kept as packed float32 bytes, never as lists of floats
+        vectors, self.usage_stats = embed_batch(
+            nim_models()[self.model],
+            self.model,
+            self.input_type,
+            self.text_batch,
+            cache=self._embedding_cache(),
         )
-        # API reference: https://docs.nvidia.com/nim/nemo-retriever/text-embedding/latest/reference.html
-        tf = time.time()
-        res_data = res_json["data"]
-        self.usage_stats = res_json["usage"]
-        self.usage_stats["client-e2e-time"] = tf - t0
-        self.embeddings = res_data
+        # an empty batch has no vectors to take the dimension from
+        self.embedding_dim = len(vectors[0]) // 4 if vectors else 0
+        self.embeddings = b"".join(vectors)
+        self.telemetry = telemetry.snapshot(reset=True)
         self.next(self.join)
 
     @pypi(packages={"numpy": "2.0.1", "pandas": "2.2.2"})
     @step
     def join(self, inputs):
-        import numpy as np
-        import pandas as pd
+        from types import SimpleNamespace
+        from embedding_matrix import assemble_embeddings
+        from run_storage import RunStorage
+        from telemetry import merge
+
+        # the matrix goes to a run-scoped .npy file that later steps memory-map;
+        # embeddings_meta is the sidecar table mapping rows back to text
+        # texts embedded while probing batch sizes come first
+        batches = list(inputs)
+        if inputs[0].probe_batch:
+            batches.insert(0, SimpleNamespace(**inputs[0].probe_batch))
+        storage = RunStorage(self)
+        with storage.writer(self.embeddings_file) as path:
+            _, self.embeddings_meta = assemble_embeddings(batches, path)
+        self.embeddings_key = storage.key(self.embeddings_file)
+        self.stats = [batch_input.usage_stats for batch_input in inputs]
+        self.telemetry = merge(
+            [inputs[0].probe_telemetry] + [batch_input.telemetry for batch_input in inputs]
+        )
+        self.batch_plan = inputs[0].batch_plan
+        self.next(self.index)
 
-        self.embeddings = None
-        self.embeddings_meta = pd.DataFrame()
-        self.stats = []
-        for batch_input in inputs:
-            for i in range(len(batch_input.embeddings)):
-                if self.embeddings is not None:
-                    self.embeddings = np.vstack(
-                        [self.embeddings, batch_input.embeddings[i]["embedding"]]
-                    )
-                else:
-                    self.embeddings = [batch_input.embeddings[i]["embedding"]]
-            _start_idx = len(self.embeddings_meta)
-            _end_idx = _start_idx + len(batch_input.text_batch)
-            _meta_df = {
-                "text": batch_input.text_batch,
-                "embedding_row_idx": range(_start_idx, _end_idx),
-            }
-            self.embeddings_meta = pd.concat(
-                [self.embeddings_meta, pd.DataFrame(_meta_df)]
+    @card(type="blank", id="search")
+    @pypi(packages={"numpy": "2.0.1", "pandas": "2.2.2"})
+    @step
+    def index(self):
+        import time
+        from embedding_matrix import open_embeddings
+        from ivf_index import IVFIndex, search_texts
+        from run_storage import RunStorage
+        from nim_client import nim_models
+        import telemetry
+
+        storage = RunStorage(self)
+        embeddings = open_embeddings(storage.local_path(self.embeddings_key))
+        t0 = time.time()
+        with storage.writer(self.index_file) as path:
+            index = IVFIndex.build(embeddings, n_lists=self.n_lists or None, path=path)
+        self.index_key = storage.key(self.index_file)
+        self.index_build_time = time.time() - t0
+        # the reordered vectors live in index_file; the rest is a small artifact
+        self.ann_index = index.to_dict()
+
+        llm = nim_models()[self.model]
+        hits_per_question = search_texts(
+            llm,
+            self.questions,
+            self.ann_index,
+            open_embeddings(storage.local_path(self.index_key)),
+            self.embeddings_meta.text.values,
+            n_probe=self.n_probe,
+            input_type=self.input_type,
+        )
+        # the question embeddings count with the run's other requests
+        self.telemetry = telemetry.merge([self.telemetry, telemetry.snapshot(reset=True)])
+        rows = []
+        for question, hits in zip(self.questions, hits_per_question):
+            rows.extend(
+                [question, rank + 1, text, round(score, 4)]
+                for rank, (text, score) in enumerate(hits)
             )
-            self.stats.append(batch_input.usage_stats)
+        current.card["search"].append(
+            Markdown(
+                f"### ANN index over {len(embeddings)} embeddings\n"
+                f"{len(index.centroids)} IVF lists built in {self.index_build_time:.2f}s, "
+                f"{self.n_probe} probed per query"
+            )
+        )
+        current.card["search"].append(
+            Table(headers=["Question", "Rank", "Text", "Score"], data=rows)
+        )
         self.next(self.end)
 
     @card(type="blank", id="usage_stats")
@@ -88,44 +277,43 @@ class TextEmbedding(FlowSpec):
         import altair as alt
         from sklearn.manifold import TSNE
         import pandas as pd
+        from embedding_matrix import open_embeddings
+        from run_storage import RunStorage
+        from telemetry import histogram, histogram_spec, summary_table
 
-        # plot usage
-        usage_df = pd.DataFrame(self.stats)
-        bar = (
-            alt.Chart(usage_df)
-            .mark_boxplot()
-            .encode(alt.X("client-e2e-time:Q").title("Client end-to-end time (s)"))
-        )
-        text_min = (
-            alt.Chart(usage_df)
-            .mark_text(align="right", dx=-5)
-            .encode(
-                x="min(client-e2e-time):Q",
-                text=alt.Text("min(client-e2e-time):Q", format=".2f"),
+        # per request rather than per batch, probes and questions included;
+        # cached texts send no request
+        latency = histogram(self.telemetry, self.model)
+        current.card["usage_stats"].append(
+            Markdown(
+                f"### Usage metrics\n{latency.count} requests to {self.model} "
+                f"for {len(self.stats)} batches"
             )
         )
-        text_max = (
-            alt.Chart(usage_df)
-            .mark_text(align="left", dx=5)
-            .encode(
-                x="max(client-e2e-time):Q",
-                text=alt.Text("max(client-e2e-time):Q", format=".2f"),
+        current.card["usage_stats"].append(VegaChart(histogram_spec(latency)))
+        headers, rows = summary_table(self.telemetry)
+        current.card["usage_stats"].append(Table(headers=headers, data=rows))
+        if self.batch_plan:
+            probes = pd.DataFrame(
+                self.batch_plan["samples"],
+                columns=["token budget", "prompt tokens", "client-e2e-time"],
             )
-        )
-        usage_plot = (bar + text_min + text_max).properties(
-            title=alt.Title(
-                text=f"Text embedding usage stats of {self.model}",
-                subtitle=f"For each batch based on {len(usage_df)} batches of {self.batch_size} observations",
-            ),
-            width=250,
-            height=25,
-        )
-        current.card["usage_stats"].append(Markdown("### Usage metrics"))
-        current.card["usage_stats"].append(VegaChart.from_altair_chart(usage_plot))
+            probes["tokens/sec"] = probes["prompt tokens"] / probes["client-e2e-time"]
+            current.card["usage_stats"].append(
+                Markdown(
+                    f"### Adaptive batching\nChose a budget of "
+                    f"{self.batch_plan['token_budget']} tokens per request "
+                    f"({self.batch_plan['tokens_per_char']:.3f} tokens/char observed)"
+                )
+            )
+            current.card["usage_stats"].append(Table.from_dataframe(probes))
 
         # plot embeddings
         tsne = TSNE(n_components=2, random_state=77)
-        embeddings_2d = tsne.fit_transform(self.embeddings)
+        embeddings = open_embeddings(
+            RunStorage(self).local_path(self.embeddings_key)
+        )
+        embeddings_2d = tsne.fit_transform(embeddings)
         plot_df = pd.DataFrame(embeddings_2d, columns=["x", "y"])
         plot_df["text"] = self.embeddings_meta.text.values
         chart = (
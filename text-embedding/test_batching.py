@@ -0,0 +1,66 @@
+import pytest
+
+from batching import (
+    best_budget,
+    estimate_tokens,
+    probe_budgets,
+    split_by_token_budget,
+)
+
+
+def fake_embed(cached=()):
+    sent = []
+
+    def embed(batch):
+        sent.append(list(batch))
+        hits = sum(t in cached for t in batch)
+        tokens = 0 if hits == len(batch) else sum(estimate_tokens(t) for t in batch)
+        usage = {
+            "prompt_tokens": tokens,
+            "client-e2e-time": 0.01 + tokens * 1e-4,
+            "cache-hits": hits,
+        }
+        return [t.encode() for t in batch], usage
+
+    return embed, sent
+
+
+def test_split_respects_budget_and_items():
+    texts = ["x" * 40] * 10  # 10 tokens each
+    assert [len(b) for b in split_by_token_budget(texts, 25)] == [2] * 5
+    assert [len(b) for b in split_by_token_budget(texts, 1000, max_items=3)] == [3, 3, 3, 1]
+    assert split_by_token_budget([], 100) == []
+
+
+def test_oversized_text_gets_its_own_batch():
+    assert split_by_token_budget(["x" * 400, "y"], 10) == [["x" * 400], ["y"]]
+
+
+def test_probe_returns_vectors_of_a_prefix():
+    texts = [f"text number {i} " * 4 for i in range(100)]
+    embed, sent = fake_embed()
+    samples, tokens_per_char, probed = probe_budgets(embed, texts, [32, 64])
+    assert len(samples) == 4
+    assert probed == [t.encode() for t in texts[: len(probed)]]
+    assert [t for batch in sent for t in batch] == texts[: len(probed)]
+    assert tokens_per_char == pytest.approx(0.25, rel=0.1)
+
+
+def test_probe_of_nothing_has_no_samples():
+    embed, sent = fake_embed()
+    samples, tokens_per_char, probed = probe_budgets(embed, [], [32, 64])
+    assert samples == [] and probed == [] and sent == []
+
+
+def test_cached_batches_are_not_samples():
+    texts = [f"text {i}" for i in range(20)]
+    embed, _ = fake_embed(cached=set(texts))
+    samples, _, probed = probe_budgets(embed, texts, [8])
+    assert samples == []
+    assert len(probed) > 0
+
+
+def test_best_budget_finds_the_throughput_peak():
+    # seconds = 0.1 + 1e-5 n^2 peaks in tokens/sec at n = 100
+    samples = [(b, b, 0.1 + 1e-5 * b * b) for b in (25, 50, 100, 200, 400) for _ in range(2)]
+    assert best_budget(samples) == pytest.approx(100, abs=1)